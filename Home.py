@@ -1,5 +1,12 @@
+import threading
+
 import streamlit as st
-import pandas as pd
+
+from demand_capacity.data import (
+    APPOINTMENTS_PATH, APPOINTMENTS_SCHEMA, SOURCE_MEMORY, WAITING_LIST_PATH, WAITING_LIST_SCHEMA,
+    file_fingerprint, frame_memory
+)
+from demand_capacity.refresh import refresh_dataset
 
 st.set_page_config(
     page_title='Outpatient Demand and Capacity Analysis',
@@ -7,6 +14,25 @@ st.set_page_config(
     layout='wide'
 )
 
+
+@st.cache_resource(show_spinner=False)
+def loaded_datasets():
+    # The latest load of each file, shared by every session, so appended months extend it rather than reloading
+    return {}, threading.Lock()
+
+
+def load_data(path, schema, fingerprint, with_totals=False):
+    # Frame, per-specialty index (and running totals) of the file, shared by every session:
+    # pages must not modify them, and take specialty frames through specialty_view
+    datasets, lock = loaded_datasets()
+    with lock:
+        loaded = datasets.get(path)
+        if loaded is None or loaded['fingerprint'] != fingerprint:
+            with st.spinner("Loading data..."):
+                loaded = datasets[path] = refresh_dataset(path, schema, loaded, with_totals)
+    return loaded
+
+
 st.title('Welcome to the Outpatient Demand and Capacity Analysis App')
 
 st.write("""
@@ -17,13 +43,27 @@ Use the navigation on the left to select different sections of the analysis.
 # Load data from CSV files (located in the same directory as this script or in a data folder in the repository)
 try:
     # Load referral and appointment data
-    referral_df = pd.read_csv("data/waiting_list_opa.csv")
-    appointment_df = pd.read_csv("data/appointments_opa.csv")
+    referral_fingerprint = file_fingerprint(WAITING_LIST_PATH)
+    appointment_fingerprint = file_fingerprint(APPOINTMENTS_PATH)
+    referral_data = load_data(WAITING_LIST_PATH, WAITING_LIST_SCHEMA, referral_fingerprint, with_totals=True)
+    appointment_data = load_data(APPOINTMENTS_PATH, APPOINTMENTS_SCHEMA, appointment_fingerprint)
+    referral_df = referral_data['df']
+    appointment_df = appointment_data['df']
 
     # Save loaded data to session state
     st.session_state.referral_df = referral_df
     st.session_state.appointment_df = appointment_df
 
+    # Fingerprints identify the data in cache keys on the pages
+    st.session_state.referral_fingerprint = referral_data['fingerprint']
+    st.session_state.appointment_fingerprint = appointment_data['fingerprint']
+
+    # Per-specialty frames, sorted by month, for the analysis pages
+    st.session_state.referral_index = referral_data['index']
+    st.session_state.appointment_index = appointment_data['index']
+    # Cumulative sums per specialty, for window totals and trend fits without re-summing
+    st.session_state.referral_totals = referral_data['totals']
+
     # Initialize selected specialty if not already set in session state
     if 'selected_specialty' not in st.session_state:
         st.session_state.selected_specialty = None
@@ -54,3 +94,12 @@ except FileNotFoundError as e:
     st.error(f"Error loading data: {e}. Please ensure the CSV files are located in the correct directory.")
 
 st.sidebar.header('Data Files Loaded Successfully')
+if 'referral_df' in st.session_state and 'appointment_df' in st.session_state:
+    frames = [st.session_state.referral_df, st.session_state.appointment_df]
+    data_memory = sum(frame_memory(df) for df in frames)
+    # Size as parsed from the CSVs, before the schema was applied
+    source_memory = sum(df.attrs.get(SOURCE_MEMORY, frame_memory(df)) for df in frames)
+    st.sidebar.caption(
+        f"Data held in memory: {data_memory / 1e6:.2f} MB "
+        f"(down from {source_memory / 1e6:.2f} MB as parsed, {1 - data_memory / source_memory:.0%} saved)"
+    )
@@ -0,0 +1,165 @@
+"""Benchmarks for the data layer and the model at production-like scale.
+
+Run from the repository root::
+
+    python -m benchmarks.run --scale medium
+    python -m benchmarks.run --specialties 80 --sites 20 --months 120 --types 6
+
+Each run generates a synthetic dataset, times every stage and appends one
+JSON line to ``benchmarks/results.jsonl`` so runs can be compared over time.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from demand_capacity.data import (
+    APPOINTMENTS_SCHEMA, WAITING_LIST_SCHEMA, build_specialty_index, load_dataset, read_source, specialty_view
+)
+from demand_capacity.demand import baseline_yearly_additions, compare_models
+from demand_capacity.simulation import project_specialties, project_waiting_list
+from demand_capacity.synthetic import generate_datasets, write_datasets
+
+# (specialties, sites, months, appointment types)
+SCALES = {
+    'small': (20, 1, 36, 3),
+    'medium': (60, 5, 60, 3),
+    'large': (60, 20, 120, 5),
+    'xlarge': (100, 100, 120, 8),
+}
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'results.jsonl')
+
+
+def timed(func, repeat):
+    """Run ``func`` ``repeat`` times and return (best seconds, last result)."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_benchmarks(num_specialties, num_sites, num_months, num_types, num_simulations=10000, repeat=3, seed=0):
+    """Time each stage and return ``{stage: seconds}``."""
+    timings = {}
+    timings['generate'], (waiting_list_df, appointment_df) = timed(
+        lambda: generate_datasets(num_specialties, num_sites, num_months, num_types, seed=seed), 1
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        waiting_list_path = os.path.join(tmp, 'waiting_list.csv')
+        appointments_path = os.path.join(tmp, 'appointments.csv')
+        write_datasets(waiting_list_df, appointment_df, waiting_list_path, appointments_path)
+        cache_dir = os.path.join(tmp, 'cache')
+
+        # Ingestion: raw CSV parse, first load (parse + schema + cache write), cached load
+        timings['ingest_csv'], _ = timed(lambda: (read_source(waiting_list_path), read_source(appointments_path)), 1)
+        timings['ingest_first_load'], _ = timed(lambda: (
+            load_dataset(waiting_list_path, WAITING_LIST_SCHEMA, cache_dir),
+            load_dataset(appointments_path, APPOINTMENTS_SCHEMA, cache_dir)
+        ), 1)
+        timings['ingest_cached'], (waiting_list_df, appointment_df) = timed(lambda: (
+            load_dataset(waiting_list_path, WAITING_LIST_SCHEMA, cache_dir),
+            load_dataset(appointments_path, APPOINTMENTS_SCHEMA, cache_dir)
+        ), repeat)
+
+    specialties = list(waiting_list_df['specialty'].unique())
+    latest_month = waiting_list_df['month'].max()
+    baseline_start = latest_month - pd.DateOffset(months=5) + pd.offsets.MonthEnd(0)
+    model_start_date = latest_month + pd.offsets.MonthEnd(12)
+
+    # Per-specialty filtering: boolean mask per specialty vs. building and using the index
+    timings['filter_mask_all_specialties'], _ = timed(
+        lambda: [appointment_df[appointment_df['specialty'] == s].sort_values('month') for s in specialties], repeat
+    )
+    timings['filter_build_index'], index = timed(lambda: build_specialty_index(appointment_df), repeat)
+    timings['filter_index_all_specialties'], _ = timed(lambda: [specialty_view(index, s) for s in specialties], repeat)
+
+    # Baseline aggregation and regression forecasting for every specialty
+    # Sites are summed so each specialty has one row per month, as the pages expect
+    specialty_month_df = waiting_list_df.groupby(['specialty', 'month'], observed=True, as_index=False)[
+        ['additions', 'removals', 'waiting_list']
+    ].sum()
+    waiting_list_index = build_specialty_index(specialty_month_df)
+    timings['baseline_aggregation'], _ = timed(lambda: [
+        baseline_yearly_additions(waiting_list_index[s], baseline_start, latest_month) for s in specialties
+    ], repeat)
+    timings['regression_forecast'], _ = timed(lambda: [
+        compare_models(waiting_list_index[s], baseline_start, latest_month) for s in specialties
+    ], repeat)
+
+    # Monte Carlo projection: one specialty, then every specialty in one batch
+    first = waiting_list_index[specialties[0]]
+    timings['projection_single'], _ = timed(lambda: project_waiting_list(
+        first['waiting_list'].iloc[-1], first['additions'].tail(6), first['removals'].tail(6), 12, num_simulations, rng=seed
+    ), repeat)
+    timings['projection_all_specialties'], _ = timed(lambda: project_specialties(
+        specialty_month_df, baseline_start, latest_month, model_start_date, num_simulations=min(num_simulations, 2000), rng=seed
+    ), repeat)
+
+    rows = {'waiting_list_rows': len(waiting_list_df), 'appointment_rows': len(appointment_df)}
+    return timings, rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='small', help='preset size (default: %(default)s)')
+    parser.add_argument('--specialties', type=int, help='override the number of specialties')
+    parser.add_argument('--sites', type=int, help='override the number of sites')
+    parser.add_argument('--months', type=int, help='override the number of months')
+    parser.add_argument('--types', type=int, help='override the number of appointment types')
+    parser.add_argument('--simulations', type=int, default=10000, help='Monte Carlo runs (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='repeats per stage; the best is kept (default: %(default)s)')
+    parser.add_argument('--results', default=RESULTS_PATH, help='JSON lines file to append to (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    num_specialties, num_sites, num_months, num_types = SCALES[args.scale]
+    size = (
+        args.specialties or num_specialties,
+        args.sites or num_sites,
+        args.months or num_months,
+        args.types or num_types,
+    )
+    timings, rows = run_benchmarks(*size, num_simulations=args.simulations, repeat=args.repeat)
+
+    print(f"{rows['waiting_list_rows']:,} waiting list rows, {rows['appointment_rows']:,} appointment rows")
+    for stage, seconds in timings.items():
+        print(f"{stage:<32}{seconds * 1000:>12.1f} ms")
+
+    record = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scale': dict(zip(['specialties', 'sites', 'months', 'appointment_types'], size)),
+        'simulations': args.simulations,
+        **rows,
+        'seconds': timings,
+    }
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+"""Modelling code shared by the Streamlit pages.
+
+Everything in this package works on plain pandas/NumPy inputs so it can be
+reused outside of a Streamlit session.
+"""
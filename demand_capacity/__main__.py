@@ -0,0 +1,75 @@
+"""Command line entry point: ``python -m demand_capacity``.
+
+Runs the demand and capacity model for every specialty and writes one CSV per
+output table. Streamlit and plotly are not imported.
+"""
+import argparse
+import logging
+import os
+import sys
+
+import pandas as pd
+
+from demand_capacity.data import (
+    APPOINTMENTS_PATH, APPOINTMENTS_SCHEMA, WAITING_LIST_PATH, WAITING_LIST_SCHEMA, load_dataset
+)
+from demand_capacity.pipeline import BEST_MODEL, run_pipeline
+from demand_capacity.demand import AVERAGE_MODEL, REGRESSION_MODEL
+from demand_capacity.simulation import RANDOM_SAMPLING, SAMPLING_METHODS
+
+
+def month_end(value):
+    """Parse a date or month (e.g. 2024-04) to its month-end timestamp."""
+    return pd.Timestamp(value) + pd.offsets.MonthEnd(0)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m demand_capacity', description=__doc__.splitlines()[0])
+    parser.add_argument('--waiting-list', default=WAITING_LIST_PATH, help='waiting list CSV (default: %(default)s)')
+    parser.add_argument('--appointments', default=APPOINTMENTS_PATH, help='appointments CSV (default: %(default)s)')
+    parser.add_argument('--output', default='output', help='directory for the output CSVs (default: %(default)s)')
+    parser.add_argument('--baseline-start', type=month_end, help='first baseline month (default: 6 months before the latest data)')
+    parser.add_argument('--baseline-end', type=month_end, help='last baseline month (default: the latest month of data)')
+    parser.add_argument('--model-start', type=month_end, help='modelling start month (default: the next March)')
+    parser.add_argument('--model', choices=[BEST_MODEL, AVERAGE_MODEL, REGRESSION_MODEL], default=BEST_MODEL,
+                        help='demand model (default: the better fit for each specialty)')
+    parser.add_argument('--unit', nargs='+', default=['specialty'], help='columns defining one unit (default: specialty)')
+    parser.add_argument('--simulations', type=int, default=10000, help='Monte Carlo runs per unit (default: %(default)s)')
+    parser.add_argument('--sampling', choices=SAMPLING_METHODS, default=RANDOM_SAMPLING,
+                        help='how simulation draws are spread (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes, 0 for one per core (default: %(default)s)')
+    parser.add_argument('--seed', type=int, help='random seed for reproducible projections')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    waiting_list_df = load_dataset(args.waiting_list, WAITING_LIST_SCHEMA)
+    appointment_df = load_dataset(args.appointments, APPOINTMENTS_SCHEMA)
+
+    results = run_pipeline(
+        waiting_list_df,
+        appointment_df,
+        baseline_start=args.baseline_start,
+        baseline_end=args.baseline_end,
+        model_start_date=args.model_start,
+        unit_columns=args.unit,
+        max_workers=args.workers or None,
+        seed=args.seed,
+        model=args.model,
+        num_simulations=args.simulations,
+        sampling=args.sampling
+    )
+
+    os.makedirs(args.output, exist_ok=True)
+    for name, table in results.items():
+        path = os.path.join(args.output, f'{name}.csv')
+        table.to_csv(path, index=False)
+        logging.info("Wrote %s (%d rows)", path, len(table))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Appointment capacity: attended activity, follow-up ratios, utilisation/DNA uplift and allocation."""
+import numpy as np
+
+from demand_capacity.demand import filter_months, month_count, scale_to_year
+
+APPOINTMENT_TYPES = ['RTT First', 'RTT Follow-up', 'Non-RTT']
+
+# Example baseline rates used when none are supplied
+BASELINE_UTILISATION_RATE = 0.85
+BASELINE_DNA_RATE = 0.1
+
+
+def appointment_totals(appointment_df, start, end, column='appointments_attended'):
+    """Total ``column`` by appointment type between ``start`` and ``end``.
+
+    Returns a Series indexed by ``APPOINTMENT_TYPES`` with 0 for missing types.
+    """
+    baseline_df = filter_months(appointment_df, start, end)
+    totals = baseline_df.groupby('appointment_type', observed=True)[column].sum()
+    return totals.reindex(APPOINTMENT_TYPES).fillna(0)
+
+
+def yearly_attended(appointment_df, baseline_start, baseline_end):
+    """Attended appointments by type scaled to a 12-month equivalent (whole appointments)."""
+    totals = appointment_totals(appointment_df, baseline_start, baseline_end)
+    return scale_to_year(totals, month_count(baseline_start, baseline_end)).astype(int)
+
+
+def follow_up_ratios(totals):
+    """Return ``(follow-up per RTT first, non-RTT per RTT first)`` for a Series of totals.
+
+    Both are ``None`` when there are no RTT first appointments.
+    """
+    rtt_first = totals.get('RTT First', 0)
+    if rtt_first <= 0:
+        return None, None
+    return totals.get('RTT Follow-up', 0) / rtt_first, totals.get('Non-RTT', 0) / rtt_first
+
+
+def required_capacity(attended, utilisation_rate=BASELINE_UTILISATION_RATE, dna_rate=BASELINE_DNA_RATE):
+    """Appointment slots needed to deliver ``attended`` appointments at the given rates."""
+    return attended / utilisation_rate / (1 - dna_rate)
+
+
+def adjusted_attended(capacity, utilisation_rate, dna_rate):
+    """Attended appointments from ``capacity`` slots at adjusted rates, capped at ``capacity``.
+
+    Arrays of capacities and rates broadcast together.
+    """
+    return np.minimum(capacity * utilisation_rate * (1 - dna_rate), capacity)
+
+
+def attended_grid(capacity, utilisation_rates, dna_rates):
+    """Attended appointments from ``capacity`` slots at every pair of utilisation and DNA rates.
+
+    Returns an array of shape ``capacity.shape + (len(utilisation_rates), len(dna_rates))``,
+    so a grid for each of several specialties is one computation.
+    """
+    capacity = np.asarray(capacity, dtype=float)[..., None, None]
+    utilisation_rates = np.asarray(utilisation_rates, dtype=float)[:, None]
+    return adjusted_attended(capacity, utilisation_rates, np.asarray(dna_rates, dtype=float))
+
+
+def optimal_allocation(demand, capacity, weights=None):
+    """Split ``capacity`` between appointment types to minimise the weighted capacity gap.
+
+    ``demand`` has one row of required appointments per unit and one column
+    per type, and ``capacity`` the total attended appointments of each unit.
+    The gap of a type is its unmet demand; ``weights`` (one per type,
+    default equal) set how much each type's gap counts. Types are filled in
+    descending weight order, types of equal weight in proportion to their
+    demand, and any surplus is shared in proportion to demand. This is an
+    optimum of the linear program for every unit at once.
+    """
+    demand = np.asarray(demand, dtype=float)
+    remaining = np.asarray(capacity, dtype=float).copy()
+    weights = np.ones(demand.shape[-1]) if weights is None else np.asarray(weights, dtype=float)
+
+    allocated = np.zeros_like(demand)
+    for weight in np.unique(weights)[::-1]:
+        level = demand * (weights == weight)
+        level_total = level.sum(axis=-1)
+        filled = np.minimum(remaining, level_total)
+        allocated += level * _share(filled, level_total)
+        remaining -= filled
+
+    # Spare capacity goes in proportion to demand, or evenly when there is none
+    total = demand.sum(axis=-1)
+    split = np.where(total[..., None] > 0, demand / np.where(total > 0, total, 1)[..., None], 1 / demand.shape[-1])
+    return allocated + remaining[..., None] * split
+
+
+def capacity_gap(demand, allocated):
+    """Unmet demand of each type (0 where the allocation covers it)."""
+    return np.maximum(np.asarray(demand, dtype=float) - allocated, 0)
+
+
+def whole_appointments(allocated):
+    """Round an allocation to whole appointments, keeping each row's total (largest remainder)."""
+    allocated = np.asarray(allocated, dtype=float)
+    floor = np.floor(allocated)
+    shortfall = np.rint(allocated.sum(axis=-1) - floor.sum(axis=-1)).astype(int)
+    # Rank the fractional parts within each row; the largest get the leftover appointments
+    rank = np.argsort(np.argsort(floor - allocated, axis=-1, kind='stable'), axis=-1)
+    return (floor + (rank < shortfall[..., None])).astype(int)
+
+
+def _share(filled, total):
+    """Fraction of ``total`` that ``filled`` covers, as a column for broadcasting."""
+    return (filled / np.where(total > 0, total, 1))[..., None]
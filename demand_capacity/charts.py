@@ -0,0 +1,132 @@
+"""Plotly figures with small payloads.
+
+Each figure is built once from its final data, and its arrays are made
+compact before plotly serialises them:
+
+- dates are sent as milliseconds since the epoch on a date axis, and values
+  as ``float32``, so both go out as base64 typed arrays instead of JSON
+  lists of strings and numbers
+- series longer than a screen can show are decimated to the lowest and
+  highest point of each bucket, which keeps peaks and troughs
+- long series use ``Scattergl`` (WebGL) rather than SVG ``Scatter``
+
+``cached_figure`` keeps the serialised JSON of figures keyed on the inputs
+they are drawn from, so an unchanged chart is not rebuilt on a rerun.
+"""
+import json
+from collections import OrderedDict
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# Points kept per series; about one per pixel column of a wide chart
+MAX_POINTS = 2000
+
+# Series longer than this are drawn with WebGL
+WEBGL_THRESHOLD = 1000
+
+# Size of the figure JSON kept per cache; the least recently used figures are evicted first
+FIGURE_CACHE_BYTES = 16 * 2 ** 20
+
+
+def decimate(values, max_points=MAX_POINTS):
+    """Sorted indices of at most ``max_points`` points of ``values`` that keep its shape.
+
+    The series is split into ``max_points // 2`` buckets of consecutive points
+    and the lowest and highest point of each bucket are kept.
+    """
+    values = np.asarray(values, dtype=float)
+    n = values.size
+    if n <= max_points:
+        return np.arange(n)
+
+    bucket = np.repeat(np.arange(max_points // 2), np.diff(np.linspace(0, n, max_points // 2 + 1).astype(int)))
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    # Sorting by value within each bucket puts its minimum first and its maximum last
+    low = np.lexsort((np.where(np.isnan(values), np.inf, values), bucket))[starts]
+    high = np.lexsort((np.where(np.isnan(values), -np.inf, values), bucket))[ends]
+    return np.unique(np.concatenate([low, high]))
+
+
+def compact(values):
+    """Dates as epoch milliseconds and numbers as ``float32``; anything else unchanged."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+    if values.dtype.kind in 'biuf':
+        return values.astype(np.float32)
+    return values
+
+
+def line(x, y, name, max_points=MAX_POINTS, **kwargs):
+    """Line trace for ``y`` against ``x``, decimated and drawn with WebGL when long."""
+    x, y = np.asarray(x), np.asarray(y)
+    keep = decimate(y, max_points)
+    trace = go.Scattergl if len(keep) > WEBGL_THRESHOLD else go.Scatter
+    kwargs.setdefault('mode', 'lines')
+    return trace(x=compact(x[keep]), y=compact(y[keep]), name=name, **kwargs)
+
+
+def band(x, lower, upper, name, fillcolor, **kwargs):
+    """Filled area between ``lower`` and ``upper``, as one closed outline."""
+    x = compact(x)
+    return go.Scatter(
+        x=np.concatenate([x, x[::-1]]),
+        y=np.concatenate([compact(upper), compact(lower)[::-1]]),
+        name=name,
+        fill='toself',
+        fillcolor=fillcolor,
+        line=dict(color='rgba(255,255,255,0)'),
+        hoverinfo='skip',
+        **kwargs
+    )
+
+
+def heatmap(x, y, z, name=None, **kwargs):
+    """Heatmap of ``z`` (one row per ``y`` value, one column per ``x`` value), sent as ``float32``."""
+    return go.Heatmap(x=compact(x), y=compact(y), z=compact(z), name=name, **kwargs)
+
+
+def figure(traces, title=None, height=None, x_title=None, y_title=None, legend_title=None, dates=True):
+    """Figure of ``traces``; ``dates`` puts the x axis on a date scale for epoch-millisecond values."""
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        title=title,
+        height=height,
+        xaxis_title=x_title,
+        yaxis_title=y_title,
+        legend_title=legend_title,
+        xaxis_type='date' if dates else None,
+    )
+    return fig
+
+
+def state_figure_cache(state, cache_name='figure_cache'):
+    """The figure cache kept in a session state mapping, created on first use."""
+    return state.setdefault(cache_name, OrderedDict())
+
+
+def cached_figure(cache, page, chart_id, inputs, build, max_bytes=FIGURE_CACHE_BYTES):
+    """Figure for ``(page, chart_id, inputs)``, calling ``build()`` only when it is not cached.
+
+    ``inputs`` is a hashable fingerprint of everything the chart is drawn from
+    (e.g. the data fingerprint, specialty and dates). ``cache`` is an
+    ``OrderedDict`` of serialised figures kept between calls; figures are
+    evicted, least recently used first, once their JSON exceeds ``max_bytes``.
+    """
+    key = (page, chart_id, inputs)
+    spec = cache.get(key)
+    if spec is not None:
+        cache.move_to_end(key)
+        # The JSON came from a validated figure, so it is not validated again
+        return go.Figure(json.loads(spec), _validate=False)
+
+    fig = build()
+    cache[key] = pio.to_json(fig, validate=False)
+    size = sum(len(spec) for spec in cache.values())
+    while size > max_bytes and len(cache) > 1:
+        _, evicted = cache.popitem(last=False)
+        size -= len(evicted)
+    return fig
@@ -0,0 +1,345 @@
+"""Loading of the waiting list and appointment extracts.
+
+Each CSV is parsed once and written to a Parquet cache next to the data with
+the ``month`` column already normalised to month-end dates. The cache is a
+directory of Parquet parts: the history, then one part per batch of months
+added by ``append_dataset``. A manifest records the source file's
+modification time and size after each part, so replacing an extract
+invalidates the cache automatically, while appending to it only adds a
+part. Parquet needs ``pyarrow``; without it the CSV is simply parsed every
+time.
+
+Frames are converted to a declared schema on load: text columns become
+categoricals, counts become 32-bit integers (nullable ``Int32`` where a
+column has gaps, so counts stay exact) and ``month`` is a single datetime64
+month-end column. The size of the frame before and after is kept in its
+``attrs`` (``SOURCE_MEMORY`` and ``SCHEMA_MEMORY``), which the Parquet cache
+preserves.
+"""
+import json
+import logging
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+WAITING_LIST_PATH = "data/waiting_list_opa.csv"
+APPOINTMENTS_PATH = "data/appointments_opa.csv"
+CACHE_DIR = "data/.cache"
+
+# Date format of the month column in the source CSVs, and of months appended to them
+SOURCE_DATE_FORMAT = '%d/%m/%Y'
+
+# Files of a dataset's cache directory: Parquet parts in append order, and the manifest listing them
+PART_NAME = 'part-{:05d}.parquet'
+MANIFEST_NAME = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+# ``attrs`` keys for the in-memory size of a frame as parsed and with its schema applied
+SOURCE_MEMORY = 'source_memory'
+SCHEMA_MEMORY = 'schema_memory'
+
+# Column dtypes for each dataset. Columns missing from a file are skipped.
+WAITING_LIST_SCHEMA = {
+    'month': 'datetime64[ns]',
+    'specialty': 'category',
+    'priority': 'category',
+    'additions': 'int32',
+    'removals': 'int32',
+    'moved_to_admitted': 'int32',
+    'waiting_list': 'int32',
+}
+
+APPOINTMENTS_SCHEMA = {
+    'month': 'datetime64[ns]',
+    'specialty': 'category',
+    'appointment_type': 'category',
+    'priority': 'category',
+    'appointments_attended': 'int32',
+    'appointments_attended_routine': 'int32',
+    'appointments_attended_urgent': 'int32',
+    'appointments_attended_2_week_wait': 'int32',
+    'dna': 'int32',
+    'appointments_for_removals': 'int32',
+    'removals': 'int32',
+}
+
+
+def normalise_month(month, date_format=None):
+    """Convert a month column to datetime64 month-end dates (e.g. 2024-04-30).
+
+    ``date_format`` is a ``pd.to_datetime`` format such as ``'ISO8601'`` or
+    ``'%d/%m/%Y'``. Without one, dates are read day first, as in the source
+    CSVs.
+    """
+    if date_format is None:
+        month = pd.to_datetime(month, dayfirst=True)
+    else:
+        month = pd.to_datetime(month, format=date_format)
+    return month.dt.normalize() + pd.offsets.MonthEnd(0)
+
+
+def file_fingerprint(path):
+    """Return a short key that changes whenever the file is modified."""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def frame_memory(df):
+    """Return the in-memory size of a frame in bytes, including string contents."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def enforce_schema(df, schema):
+    """Return ``df`` converted to the dtypes declared in ``schema``."""
+    columns = [
+        column for column, dtype in schema.items()
+        if column in df.columns and not _has_dtype(df[column], dtype)
+    ]
+    if not columns:
+        return df
+
+    memory_before = frame_memory(df)
+    df = df.copy()
+    for column in columns:
+        dtype = schema[column]
+        if dtype.startswith('datetime64'):
+            df[column] = normalise_month(df[column])
+        elif dtype.startswith('int') and df[column].isna().any():
+            # NumPy integer dtypes cannot hold missing values; the nullable ones can
+            df[column] = df[column].astype(_nullable(dtype))
+        else:
+            df[column] = df[column].astype(dtype)
+
+    memory_after = frame_memory(df)
+    # A frame reloaded from the cache keeps the size it had when parsed
+    df.attrs.setdefault(SOURCE_MEMORY, memory_before)
+    df.attrs[SCHEMA_MEMORY] = memory_after
+    logger.info(
+        "Applied schema: %.2f MB -> %.2f MB (%.2f MB saved)",
+        memory_before / 1e6, memory_after / 1e6, (memory_before - memory_after) / 1e6
+    )
+    return df
+
+
+def _has_dtype(series, dtype):
+    if dtype.startswith('datetime64'):
+        return pd.api.types.is_datetime64_any_dtype(series)
+    if dtype.startswith('int') and str(series.dtype) == _nullable(dtype):
+        return True
+    return str(series.dtype) == dtype
+
+
+def _nullable(dtype):
+    """Nullable pandas dtype for a NumPy integer dtype (``'int32'`` -> ``'Int32'``)."""
+    return dtype.capitalize()
+
+
+def read_source(path):
+    """Parse a source CSV and normalise its month column."""
+    df = pd.read_csv(path)
+    df['month'] = normalise_month(df['month'])
+    return df
+
+
+def load_dataset(path, schema=None, cache_dir=CACHE_DIR):
+    """Load a source CSV through the Parquet cache, applying ``schema`` if given."""
+    if not HAS_PARQUET:
+        df = read_source(path)
+        return enforce_schema(df, schema) if schema else df
+
+    parts = _cached_parts(path, cache_dir)
+    if parts is not None:
+        df = _read_parts(path, parts, cache_dir)
+        # Parquet keeps the dtypes, so this is a no-op unless the schema has changed
+        return enforce_schema(df, schema) if schema else df
+
+    df = read_source(path)
+    if schema:
+        df = enforce_schema(df, schema)
+    _write_cache(df, path, cache_dir)
+    return df
+
+
+def append_dataset(path, new_rows, schema=None, cache_dir=CACHE_DIR, date_format=SOURCE_DATE_FORMAT):
+    """Append months to a source CSV and its Parquet cache without reading the history.
+
+    ``new_rows`` must only contain months after the latest month already in
+    the file; their ``month`` column is parsed with ``date_format``. The rows
+    are appended to the CSV and written to the cache as one more Parquet
+    part, so the cost grows with the new rows rather than the history.
+    Returns the appended rows with ``schema`` applied.
+    """
+    if HAS_PARQUET:
+        parts = _cached_parts(path, cache_dir)
+        if parts is None:
+            # Cache the history once; later appends only add parts
+            load_dataset(path, schema, cache_dir)
+            parts = _cached_parts(path, cache_dir)
+        latest_month = pd.Timestamp(parts[-1]['last_month'])
+    else:
+        latest_month = read_source(path)['month'].max()
+
+    new_rows = new_rows.copy()
+    new_rows['month'] = normalise_month(new_rows['month'], date_format)
+    if schema:
+        new_rows = enforce_schema(new_rows, schema)
+    if not pd.isna(latest_month) and new_rows['month'].min() <= latest_month:
+        raise ValueError(
+            f"Only months after {latest_month:%Y-%m} can be appended to {path}; "
+            f"got {new_rows['month'].min():%Y-%m}."
+        )
+
+    # Keep the file's column order and date format
+    columns = pd.read_csv(path, nrows=0).columns
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    new_rows.to_csv(path, mode='a', header=False, index=False, columns=columns, date_format=SOURCE_DATE_FORMAT)
+
+    if HAS_PARQUET:
+        _write_part(new_rows[columns], path, cache_dir, parts)
+    return new_rows
+
+
+def appended_rows(path, since_fingerprint, schema=None, cache_dir=CACHE_DIR):
+    """Rows appended to ``path`` by ``append_dataset`` since the file had ``since_fingerprint``.
+
+    Only the Parquet parts written since then are read. Returns ``None`` when
+    nothing was appended or the cache cannot tell which rows are new (e.g.
+    the file was replaced rather than appended to).
+    """
+    if not HAS_PARQUET:
+        return None
+    parts = _cached_parts(path, cache_dir)
+    fingerprints = [part['fingerprint'] for part in parts or []]
+    if since_fingerprint not in fingerprints[:-1]:
+        return None
+    df = _read_parts(path, parts[fingerprints.index(since_fingerprint) + 1:], cache_dir)
+    return enforce_schema(df, schema) if schema else df
+
+
+def concat_frames(frames):
+    """Concatenate frames with the same columns, keeping categorical columns categorical.
+
+    Categories missing from the first frame are added after its own, so its
+    codes are not re-encoded. When every frame records its size as parsed
+    (``SOURCE_MEMORY``), the result records their sum.
+    """
+    frames = list(frames)
+    if len(frames) == 1:
+        return frames[0]
+
+    first, rest = frames[0], frames[1:]
+    first_columns, rest_columns = {}, [{} for _ in rest]
+    for column in first.columns:
+        if not isinstance(first[column].dtype, pd.CategoricalDtype):
+            continue
+        categories = first[column].cat.categories
+        for frame in rest:
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                values = frame[column].cat.categories
+            else:
+                values = pd.Index(frame[column].dropna().unique())
+            categories = categories.append(values.difference(categories))
+        first_columns[column] = first[column].cat.add_categories(categories[len(first[column].cat.categories):])
+        for frame, columns in zip(rest, rest_columns):
+            columns[column] = pd.Categorical(frame[column], categories=categories)
+
+    df = pd.concat(
+        [first.assign(**first_columns)] + [frame.assign(**columns) for frame, columns in zip(rest, rest_columns)],
+        ignore_index=True
+    )
+    if all(SOURCE_MEMORY in frame.attrs for frame in frames):
+        df.attrs = {SOURCE_MEMORY: sum(frame.attrs[SOURCE_MEMORY] for frame in frames)}
+    return df
+
+
+def _dataset_cache_dir(path, cache_dir):
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0])
+
+
+def _cached_parts(path, cache_dir):
+    """Manifest entries of the cached parts of ``path``, or ``None`` when the cache is missing or out of date."""
+    directory = _dataset_cache_dir(path, cache_dir)
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            parts = json.load(f)['parts']
+    except (OSError, ValueError, KeyError):
+        return None
+    if not parts or parts[-1]['fingerprint'] != file_fingerprint(path):
+        return None
+    if not all(os.path.exists(os.path.join(directory, part['name'])) for part in parts):
+        return None
+    return parts
+
+
+def _read_parts(path, parts, cache_dir):
+    directory = _dataset_cache_dir(path, cache_dir)
+    return concat_frames(pd.read_parquet(os.path.join(directory, part['name'])) for part in parts)
+
+
+def _write_cache(df, path, cache_dir):
+    """Start the cache of ``path`` afresh with ``df`` as its only part."""
+    directory = _dataset_cache_dir(path, cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    _write_part(df, path, cache_dir, [])
+
+    # Remove parts left behind by older versions of the same file
+    for name in os.listdir(directory):
+        if name.startswith('part-') and name != PART_NAME.format(0):
+            os.remove(os.path.join(directory, name))
+
+
+def _write_part(df, path, cache_dir, parts):
+    """Add ``df`` as the next cached part of ``path`` and record it against the file's fingerprint."""
+    directory = _dataset_cache_dir(path, cache_dir)
+    name = PART_NAME.format(len(parts))
+    last_month = df['month'].max()
+    parts = parts + [{
+        'name': name,
+        'fingerprint': file_fingerprint(path),
+        'last_month': None if pd.isna(last_month) else last_month.isoformat(),
+    }]
+
+    # Write to temporary files first so a concurrent reader never sees a partial part or manifest
+    tmp_suffix = f".{os.getpid()}.tmp"
+    df.to_parquet(os.path.join(directory, name + tmp_suffix), index=False)
+    os.replace(os.path.join(directory, name + tmp_suffix), os.path.join(directory, name))
+    with open(os.path.join(directory, MANIFEST_NAME + tmp_suffix), 'w') as f:
+        json.dump({'parts': parts}, f)
+    os.replace(os.path.join(directory, MANIFEST_NAME + tmp_suffix), os.path.join(directory, MANIFEST_NAME))
+
+
+def build_specialty_index(df):
+    """Split a frame into one month-sorted frame per specialty.
+
+    Built once at load time so pages can look up a specialty instead of
+    filtering and re-sorting the full frame on every rerun.
+    """
+    return {
+        specialty: group.sort_values('month', kind='stable').reset_index(drop=True)
+        for specialty, group in df.groupby('specialty', observed=True, sort=False)
+    }
+
+
+def specialty_view(index, specialty):
+    """Return the frame for ``specialty`` without copying its data.
+
+    The result is a shallow copy, so adding or replacing columns on it does
+    not touch the shared index. Values must not be edited in place.
+    """
+    if specialty not in index:
+        # Keep the columns so callers see an empty frame rather than a KeyError
+        empty = next(iter(index.values())).iloc[0:0] if index else pd.DataFrame()
+        return empty.copy()
+    return index[specialty].copy(deep=False)
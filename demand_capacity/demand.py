@@ -0,0 +1,175 @@
+"""Referral demand: baseline scaling, trend fitting and the 12-month forecast.
+
+All functions take a single specialty's waiting list frame (``month`` as
+month-end dates, sorted) and plain timestamps, so they can be used from the
+Streamlit pages or from a batch job.
+"""
+import numpy as np
+import pandas as pd
+from scipy.stats import linregress
+
+AVERAGE_MODEL = 'average'
+REGRESSION_MODEL = 'regression'
+
+# Number of months before the baseline used to fit the trend line
+PRE_BASELINE_MONTHS = 12
+
+
+def month_count(start, end):
+    """Number of calendar months from ``start`` to ``end`` inclusive."""
+    return (end.year - start.year) * 12 + (end.month - start.month) + 1
+
+
+def scale_to_year(total, num_months):
+    """Scale a total over ``num_months`` to a 12-month equivalent."""
+    return total / num_months * 12
+
+
+def filter_months(df, start, end):
+    """Rows of ``df`` with ``start <= month <= end``."""
+    return df[(df['month'] >= start) & (df['month'] <= end)]
+
+
+def baseline_yearly_additions(specialty_df, baseline_start, baseline_end):
+    """Baseline additions scaled to a 12-month equivalent."""
+    total = filter_months(specialty_df, baseline_start, baseline_end)['additions'].sum()
+    return scale_to_year(total, month_count(baseline_start, baseline_end))
+
+
+def fit_trend(months, values):
+    """Fit a straight line to ``values`` against the ordinal dates of ``months``.
+
+    Returns ``(slope, intercept)``.
+    """
+    ordinals = pd.Series(months).map(pd.Timestamp.toordinal)
+    slope, intercept, _, _, _ = linregress(ordinals, values)
+    return slope, intercept
+
+
+def predict_trend(slope, intercept, months):
+    """Evaluate a fitted trend line at ``months``."""
+    return intercept + slope * np.array([month.toordinal() for month in months], dtype=float)
+
+
+def compare_models(specialty_df, baseline_start, baseline_end, trend=None):
+    """Fit the trend on the months before the baseline and score both models on the baseline.
+
+    Returns a dict with the fitted ``slope``/``intercept``, the baseline
+    ``months`` and ``actual`` values, both predictions, the mean absolute
+    error of each model and the ``best_model``. Returns ``None`` when there
+    are fewer than two months before the baseline to fit. ``trend`` can pass
+    in the ``(slope, intercept)`` already fitted to those months, e.g. by
+    ``trend_before`` on running totals.
+    """
+    if trend is None:
+        pre_baseline_df = specialty_df[specialty_df['month'] < baseline_start].tail(PRE_BASELINE_MONTHS)
+        if pre_baseline_df.shape[0] < 2:
+            return None
+        trend = fit_trend(pre_baseline_df['month'], pre_baseline_df['additions'])
+    slope, intercept = trend
+
+    baseline_df = filter_months(specialty_df, baseline_start, baseline_end)
+    actual = baseline_df['additions'].to_numpy(dtype=float)
+    predicted_regression = predict_trend(slope, intercept, baseline_df['month'])
+    monthly_average = baseline_yearly_additions(specialty_df, baseline_start, baseline_end) / 12
+    predicted_average = np.full(actual.size, monthly_average)
+
+    error_regression = np.mean(np.abs(actual - predicted_regression))
+    error_average = np.mean(np.abs(actual - predicted_average))
+    return {
+        'slope': slope,
+        'intercept': intercept,
+        'months': baseline_df['month'],
+        'actual': actual,
+        'predicted_average': predicted_average,
+        'predicted_regression': predicted_regression,
+        'error_average': error_average,
+        'error_regression': error_regression,
+        'best_model': AVERAGE_MODEL if error_average < error_regression else REGRESSION_MODEL,
+    }
+
+
+def forecast_demand(specialty_df, baseline_start, baseline_end, model_start_date, model=AVERAGE_MODEL, fit=None):
+    """Forecast monthly demand for the 12 months from ``model_start_date``.
+
+    ``model`` is ``'average'`` (the baseline monthly average) or
+    ``'regression'`` (the pre-baseline trend line). ``fit`` can pass in the
+    result of ``compare_models`` to avoid refitting. Returns a DataFrame with
+    ``month`` and ``predicted_demand`` columns.
+    """
+    future_months = pd.date_range(start=model_start_date, periods=12, freq=pd.offsets.MonthEnd())
+    if model == REGRESSION_MODEL:
+        if fit is None:
+            fit = compare_models(specialty_df, baseline_start, baseline_end)
+        if fit is None:
+            raise ValueError("Not enough data before the baseline period to fit the regression model.")
+        predictions = predict_trend(fit['slope'], fit['intercept'], future_months)
+    else:
+        monthly_average = baseline_yearly_additions(specialty_df, baseline_start, baseline_end) / 12
+        predictions = np.full(len(future_months), monthly_average)
+    return pd.DataFrame({'month': future_months, 'predicted_demand': predictions})
+
+
+def rolling_origin_backtest(specialty_df, horizon=12, min_window=2):
+    """Score both models from every forecast origin and every baseline window length.
+
+    For origin ``o`` and window ``w``, both models are fitted on the ``w``
+    months before ``o`` (the baseline average and a least-squares trend) and
+    scored on the ``horizon`` months from ``o``. Every fit comes from prefix
+    sums, so all windows cost about as much as one pass over the data.
+
+    Returns a DataFrame with one row per origin and window: ``origin`` (the
+    first forecast month), ``window``, ``error_average``, ``error_regression``
+    (mean absolute errors) and ``best_model``. Only origins with a full
+    horizon of data are included.
+    """
+    months = pd.to_datetime(specialty_df['month']).reset_index(drop=True)
+    y = specialty_df['additions'].to_numpy(dtype=float)
+    n = y.size
+    if n == 0:
+        return pd.DataFrame(columns=['origin', 'window', 'error_average', 'error_regression', 'best_model'])
+    # Days from the first month, so the least-squares sums stay small
+    x = (months - months.iloc[0]).dt.days.to_numpy(dtype=float)
+
+    prefix = np.zeros((4, n + 1))
+    np.cumsum(y, out=prefix[0, 1:])
+    np.cumsum(x, out=prefix[1, 1:])
+    np.cumsum(x * x, out=prefix[2, 1:])
+    np.cumsum(x * y, out=prefix[3, 1:])
+
+    origin, window = np.meshgrid(np.arange(n - horizon + 1), np.arange(min_window, n + 1), indexing='ij')
+    valid = window <= origin
+    origin, window = origin[valid], window[valid]
+    start = origin - window
+
+    sum_y, sum_x, sum_xx, sum_xy = prefix[:, origin] - prefix[:, start]
+    spread = window * sum_xx - sum_x ** 2
+    slope = np.divide(window * sum_xy - sum_x * sum_y, spread, out=np.zeros_like(spread), where=spread > 0)
+    intercept = (sum_y - slope * sum_x) / window
+
+    # Errors over the horizon, shape (fits, horizon)
+    target = origin[:, None] + np.arange(horizon)
+    actual = y[target]
+    error_average = np.abs(actual - (sum_y / window)[:, None]).mean(axis=1)
+    error_regression = np.abs(actual - (intercept[:, None] + slope[:, None] * x[target])).mean(axis=1)
+
+    return pd.DataFrame({
+        'origin': months.to_numpy()[origin],
+        'window': window,
+        'error_average': error_average,
+        'error_regression': error_regression,
+        'best_model': np.where(error_average < error_regression, AVERAGE_MODEL, REGRESSION_MODEL),
+    })
+
+
+def summarise_backtest(backtest):
+    """Mean errors and how often each model wins, by window length."""
+    summary = backtest.assign(
+        average_wins=backtest['best_model'] == AVERAGE_MODEL
+    ).groupby('window').agg(
+        origins=('origin', 'size'),
+        error_average=('error_average', 'mean'),
+        error_regression=('error_regression', 'mean'),
+        average_win_rate=('average_wins', 'mean'),
+    )
+    return summary.reset_index()
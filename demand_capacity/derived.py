@@ -0,0 +1,243 @@
+"""Derived model quantities as a lazy dependency graph.
+
+Each quantity (``forecasted_total``, ``available_rtt_first``,
+``first_followup_removals_ratio``, ...) is a node that declares what it is
+computed from: base inputs such as the specialty and baseline dates, or
+other nodes. Asking for a node computes it, and whatever it depends on, the
+first time; the result is cached under the values of the base inputs it
+actually depends on. Changing the modelling date therefore recomputes the
+forecast but not the capacity figures, and any page can ask for any quantity
+without another page having run first.
+
+Large inputs (the data frames and specialty indexes) are identified in cache
+keys by their data fingerprint rather than their contents.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+
+import pandas as pd
+
+from demand_capacity.capacity import appointment_totals, follow_up_ratios, yearly_attended
+from demand_capacity.data import specialty_view
+from demand_capacity.demand import AVERAGE_MODEL, REGRESSION_MODEL, compare_models, forecast_demand
+from demand_capacity.pipeline import BEST_MODEL, default_dates
+from demand_capacity.refresh import trend_before
+from demand_capacity.seasonal import MIN_MONTHS, SEASONAL_MODELS, forecast_specialties
+
+# Derived values kept per cache; the least recently used are evicted first
+MAX_CACHED_VALUES = 4096
+
+# Base inputs identified by a data fingerprint in cache keys, and the session state key holding it
+FINGERPRINT_KEYS = {
+    'referral_df': 'referral_fingerprint',
+    'referral_index': 'referral_fingerprint',
+    'referral_totals': 'referral_fingerprint',
+    'appointment_index': 'appointment_fingerprint',
+}
+
+NODES = {}
+
+
+def node(*inputs):
+    """Register the decorated function as a node computed from ``inputs`` (base inputs or nodes)."""
+    def register(func):
+        NODES[func.__name__] = (inputs, func)
+        return func
+    return register
+
+
+@lru_cache(maxsize=None)
+def upstream_inputs(name):
+    """Sorted tuple of the base inputs that node ``name`` depends on, directly or through other nodes."""
+    if name not in NODES:
+        return (name,)
+    return tuple(sorted({base for dependency in NODES[name][0] for base in upstream_inputs(dependency)}))
+
+
+def evaluate(name, inputs, cache=None, keys=None, max_entries=MAX_CACHED_VALUES):
+    """Value of ``name``, computing it and any missing dependencies on first request.
+
+    ``inputs`` maps base input names to values. ``keys`` can map an input to a
+    hashable stand-in (e.g. a data fingerprint) used in cache keys instead of
+    its value. ``cache`` is an ``OrderedDict`` kept between calls.
+    """
+    if name not in NODES:
+        if name not in inputs:
+            raise KeyError(f"No input or derived quantity named {name!r}.")
+        return inputs[name]
+
+    cache = OrderedDict() if cache is None else cache
+    keys = keys or {}
+    key = (name,) + tuple(keys[base] if base in keys else inputs[base] for base in upstream_inputs(name))
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    dependencies, func = NODES[name]
+    value = func(*(evaluate(dependency, inputs, cache, keys, max_entries) for dependency in dependencies))
+    cache[key] = value
+    while len(cache) > max_entries:
+        cache.popitem(last=False)
+    return value
+
+
+def state_inputs(state):
+    """Base inputs and cache keys from a session state mapping.
+
+    Dates a page has not set yet default to those the pages start with (see
+    ``default_dates``), so every quantity can be computed from any page.
+    Returns ``(inputs, keys)`` for ``evaluate``.
+    """
+    baseline_start, baseline_end, model_start_date = default_dates(state['referral_df'])
+    capacity_start, capacity_end, _ = default_dates(state['appointment_df'])
+    inputs = {
+        'referral_df': state['referral_df'],
+        'referral_index': state['referral_index'],
+        'referral_totals': state['referral_totals'],
+        'appointment_index': state['appointment_index'],
+        'specialty': state.get('selected_specialty'),
+        'baseline_start': _month_end(state.get('baseline_start_date', baseline_start)),
+        'baseline_end': _month_end(state.get('baseline_end_date', baseline_end)),
+        'model_start_date': _month_end(state.get('model_start_date', model_start_date)),
+        'capacity_baseline_start': _month_end(state.get('capacity_baseline_start', capacity_start)),
+        'capacity_baseline_end': _month_end(state.get('capacity_baseline_end', capacity_end)),
+        'selected_model': state.get('demand_model', BEST_MODEL),
+    }
+    keys = {name: state.get(fingerprint) for name, fingerprint in FINGERPRINT_KEYS.items()}
+    return inputs, keys
+
+
+def state_evaluator(state, cache_name='derived_values'):
+    """Return ``derive(name)``, which evaluates a node from the current contents of ``state``.
+
+    Inputs are read on every call, so a page can set a session state value
+    (e.g. its chosen model) and then derive what depends on it. The cache is
+    kept in ``state[cache_name]``.
+    """
+    cache = state.setdefault(cache_name, OrderedDict())
+
+    def derive(name):
+        inputs, keys = state_inputs(state)
+        return evaluate(name, inputs, cache, keys)
+    return derive
+
+
+def specialty_values(state, names, specialties, cache_name='derived_values'):
+    """Derived ``names`` (columns) for each of ``specialties`` (rows), from the current contents of ``state``.
+
+    Every other input is shared, and so are cached values that do not
+    depend on the specialty (e.g. the seasonal forecasts of every specialty).
+    """
+    cache = state.setdefault(cache_name, OrderedDict())
+    inputs, keys = state_inputs(state)
+    rows = [
+        [evaluate(name, {**inputs, 'specialty': specialty}, cache, keys) for name in names]
+        for specialty in specialties
+    ]
+    return pd.DataFrame(rows, index=pd.Index(specialties, name='specialty'), columns=list(names))
+
+
+def _month_end(value):
+    return pd.Timestamp(value).normalize() + pd.offsets.MonthEnd(0)
+
+
+# --- Demand ---
+
+@node('referral_index', 'specialty')
+def specialty_referrals(referral_index, specialty):
+    return specialty_view(referral_index, specialty)
+
+
+@node('specialty_referrals', 'referral_totals', 'specialty', 'baseline_start', 'baseline_end')
+def demand_fit(specialty_referrals, referral_totals, specialty, baseline_start, baseline_end):
+    specialty_totals = referral_totals.get(specialty)
+    trend = trend_before(specialty_totals, baseline_start) if specialty_totals is not None else None
+    return compare_models(specialty_referrals, baseline_start, baseline_end, trend=trend)
+
+
+@node('specialty_referrals', 'demand_fit', 'selected_model', 'baseline_end', 'model_start_date')
+def demand_model(specialty_referrals, demand_fit, selected_model, baseline_end, model_start_date):
+    """The chosen model, or the best fitting one when it cannot be fitted for this specialty."""
+    best = demand_fit['best_model'] if demand_fit is not None else AVERAGE_MODEL
+    if selected_model == REGRESSION_MODEL and demand_fit is None:
+        return best
+    if selected_model in SEASONAL_MODELS:
+        if model_start_date <= baseline_end:
+            return best
+        history_months = (specialty_referrals['month'] <= baseline_end).sum()
+        return selected_model if history_months >= MIN_MONTHS[selected_model] else best
+    return best if selected_model == BEST_MODEL else selected_model
+
+
+@node('referral_df', 'selected_model', 'baseline_end', 'model_start_date')
+def seasonal_forecasts(referral_df, selected_model, baseline_end, model_start_date):
+    """Seasonal forecasts for every specialty at once, or ``None`` when a seasonal model is not selected.
+
+    Seasonal models only forecast after the history, so they are not fitted
+    when the modelling start is within it.
+    """
+    if selected_model not in SEASONAL_MODELS or model_start_date <= baseline_end:
+        return None
+    return forecast_specialties(referral_df, selected_model, baseline_end, model_start_date)
+
+
+@node('specialty_referrals', 'specialty', 'demand_model', 'demand_fit', 'seasonal_forecasts',
+      'baseline_start', 'baseline_end', 'model_start_date')
+def demand_forecast(specialty_referrals, specialty, demand_model, demand_fit, seasonal_forecasts,
+                    baseline_start, baseline_end, model_start_date):
+    if demand_model in SEASONAL_MODELS:
+        return seasonal_forecasts[seasonal_forecasts['specialty'] == specialty].reset_index(drop=True)
+    return forecast_demand(
+        specialty_referrals, baseline_start, baseline_end, model_start_date, model=demand_model, fit=demand_fit
+    )
+
+
+@node('demand_forecast')
+def forecasted_total(demand_forecast):
+    return demand_forecast['predicted_demand'].sum()
+
+
+# --- Capacity ---
+
+@node('appointment_index', 'specialty')
+def specialty_appointments(appointment_index, specialty):
+    return specialty_view(appointment_index, specialty)
+
+
+@node('specialty_appointments', 'capacity_baseline_start', 'capacity_baseline_end')
+def available_capacity(specialty_appointments, capacity_baseline_start, capacity_baseline_end):
+    """Attended appointments by type over the capacity baseline, scaled to 12 months."""
+    return yearly_attended(specialty_appointments, capacity_baseline_start, capacity_baseline_end)
+
+
+@node('available_capacity')
+def available_rtt_first(available_capacity):
+    return available_capacity['RTT First']
+
+
+@node('available_capacity')
+def available_rtt_followup(available_capacity):
+    return available_capacity['RTT Follow-up']
+
+
+@node('available_capacity')
+def available_non_rtt(available_capacity):
+    return available_capacity['Non-RTT']
+
+
+@node('specialty_appointments', 'capacity_baseline_start', 'capacity_baseline_end')
+def removal_ratios(specialty_appointments, capacity_baseline_start, capacity_baseline_end):
+    """Follow-up and non-RTT appointments per RTT first, for appointments that stopped a clock."""
+    return follow_up_ratios(
+        appointment_totals(specialty_appointments, capacity_baseline_start, capacity_baseline_end, 'appointments_for_removals')
+    )
+
+
+@node('removal_ratios')
+def first_followup_removals_ratio(removal_ratios):
+    return removal_ratios[0]
+
+
+@node('removal_ratios')
+def first_non_rtt_removals_ratio(removal_ratios):
+    return removal_ratios[1]
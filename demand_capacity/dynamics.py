@@ -0,0 +1,54 @@
+"""Month-by-month waiting list dynamics.
+
+Each month the waiting list gains that month's additions and loses its
+other removals and its treatment removals, treatment being limited by that
+month's capacity; nobody is removed who is not on the list. With ``x`` the
+month's additions less other removals and capacity, the list follows
+``W[t] = max(W[t-1] + x[t], 0)``. That is computed for every month at once
+from the running sum of ``x`` and its running minimum, so monthly demand
+(e.g. a seasonal forecast) and capacity that changes during the year cost no
+more than flat ones.
+
+The month is the last axis and every other axis broadcasts, so trajectories
+for many specialties and capacity scenarios (e.g. a scenario x specialty x
+month array) are one array operation.
+"""
+import numpy as np
+
+
+def monthly_dynamics(start, additions, capacity, other_removals=0):
+    """Waiting list at the end of each month, with the removals that month.
+
+    ``start`` is the waiting list before the first month. ``additions``,
+    ``capacity`` (treatments available) and ``other_removals`` are monthly
+    arrays with the month as their last axis, or scalars; leading axes
+    broadcast with each other and with ``start``. Returns
+    ``(waiting_list, treatment_removals, other_removals)``, each of the
+    broadcast shape.
+    """
+    additions, capacity, other_removals = (np.asarray(values, dtype=float) for values in (additions, capacity, other_removals))
+    start = np.asarray(start, dtype=float)[..., None]
+    start, additions, capacity, other_removals = np.broadcast_arrays(start, additions, capacity, other_removals)
+    start = start[..., :1]
+
+    running = start + np.cumsum(additions - other_removals - capacity, axis=-1)
+    # Lifting the running total by its lowest point below 0 so far floors the list at 0
+    waiting_list = running - np.minimum(np.minimum.accumulate(running, axis=-1), 0)
+
+    # On the list each month before its removals; other removals are taken first
+    on_list = np.concatenate([start, waiting_list[..., :-1]], axis=-1) + additions
+    other = np.minimum(other_removals, on_list)
+    return waiting_list, on_list - other - waiting_list, other
+
+
+def capacity_scenarios(capacity, changes, from_month):
+    """Monthly ``capacity`` changed by each of ``changes`` (fractions, e.g. 0.1 for +10%) from ``from_month`` on.
+
+    ``from_month`` is the index of the first changed month. Returns an array
+    with a leading scenario axis, one per change, followed by the axes of
+    ``capacity``.
+    """
+    capacity = np.asarray(capacity, dtype=float)
+    changed = np.arange(capacity.shape[-1]) >= from_month
+    changes = np.asarray(changes, dtype=float).reshape((-1,) + (1,) * capacity.ndim)
+    return capacity * (1 + changes * changed)
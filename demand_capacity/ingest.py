@@ -0,0 +1,178 @@
+"""Aggregate patient-level event extracts into the monthly source files.
+
+Source systems emit one row per appointment and one row per waiting list
+event. These are read in chunks and folded into running monthly totals, so
+memory is bounded by the number of (month, specialty, appointment type)
+groups rather than the number of events. The output has exactly the columns
+of ``appointments_opa.csv`` and ``waiting_list_opa.csv``.
+
+Appointment events need the columns in ``APPOINTMENT_EVENT_COLUMNS``:
+
+- ``outcome``: ``Attended`` or ``DNA`` (anything else, e.g. cancellations, is ignored)
+- ``priority``: ``Routine``, ``Urgent`` or ``2 Week Wait``
+- ``pathway_closed``: the appointment belongs to a pathway whose clock has stopped
+- ``clock_stop``: the appointment itself stopped the clock
+
+Waiting list events need the columns in ``WAITING_LIST_EVENT_COLUMNS``, with
+``event_type`` one of ``addition``, ``removal`` or ``moved_to_admitted``
+(a move to the admitted list also counts as a removal).
+
+Event dates are parsed with one explicit format for every chunk, ISO 8601
+(``2024-04-05``) unless another is given.
+
+Run ``python -m demand_capacity.ingest --help`` to aggregate files from the
+command line.
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from demand_capacity.data import APPOINTMENTS_SCHEMA, WAITING_LIST_SCHEMA, enforce_schema, normalise_month
+
+APPOINTMENT_EVENT_COLUMNS = [
+    'appointment_date', 'specialty', 'appointment_type', 'priority', 'outcome', 'pathway_closed', 'clock_stop'
+]
+WAITING_LIST_EVENT_COLUMNS = ['event_date', 'specialty', 'event_type']
+
+# Attended appointment columns by referral priority
+PRIORITY_COLUMNS = {
+    'Routine': 'appointments_attended_routine',
+    'Urgent': 'appointments_attended_urgent',
+    '2 Week Wait': 'appointments_attended_2_week_wait',
+}
+
+APPOINTMENT_COLUMNS = [column for column in APPOINTMENTS_SCHEMA if column != 'priority']
+WAITING_LIST_COLUMNS = ['month', 'specialty', 'additions', 'removals', 'moved_to_admitted', 'waiting_list']
+
+DEFAULT_CHUNKSIZE = 1_000_000
+
+# ``pd.to_datetime`` format of the event dates
+EVENT_DATE_FORMAT = 'ISO8601'
+
+_TRUE_VALUES = {'true', '1', 'y', 'yes'}
+
+
+def aggregate_appointment_events(paths, chunksize=DEFAULT_CHUNKSIZE, date_format=EVENT_DATE_FORMAT):
+    """Stream appointment event files into monthly appointment counts."""
+    keys = ['month', 'specialty', 'appointment_type']
+    totals = None
+    category_columns = ['specialty', 'appointment_type', 'priority', 'outcome']
+    for chunk in _read_chunks(paths, APPOINTMENT_EVENT_COLUMNS, category_columns, chunksize):
+        outcome = chunk['outcome'].astype(str).str.lower()
+        attended = (outcome == 'attended').to_numpy()
+        counts = {
+            'month': normalise_month(chunk['appointment_date'], date_format),
+            'specialty': chunk['specialty'],
+            'appointment_type': chunk['appointment_type'],
+            'appointments_attended': attended,
+        }
+        for priority, column in PRIORITY_COLUMNS.items():
+            counts[column] = attended & (chunk['priority'] == priority).to_numpy()
+        counts['dna'] = (outcome == 'dna').to_numpy()
+        counts['appointments_for_removals'] = attended & _as_bool(chunk['pathway_closed'])
+        counts['removals'] = attended & _as_bool(chunk['clock_stop'])
+        totals = _fold(totals, pd.DataFrame(counts), keys)
+
+    if totals is None:
+        return pd.DataFrame(columns=APPOINTMENT_COLUMNS)
+    result = totals.reset_index().sort_values(keys, ignore_index=True)
+    return enforce_schema(result[APPOINTMENT_COLUMNS], APPOINTMENTS_SCHEMA)
+
+
+def aggregate_waiting_list_events(paths, opening_waiting_list=None, chunksize=DEFAULT_CHUNKSIZE,
+                                  date_format=EVENT_DATE_FORMAT):
+    """Stream waiting list event files into monthly additions, removals and waiting list size.
+
+    ``opening_waiting_list`` maps specialty to the list size before the first
+    month (0 when missing). Months without events are filled with zeros so the
+    waiting list is a continuous running balance.
+    """
+    keys = ['month', 'specialty']
+    totals = None
+    for chunk in _read_chunks(paths, WAITING_LIST_EVENT_COLUMNS, ['specialty', 'event_type'], chunksize):
+        event = chunk['event_type'].astype(str).str.lower()
+        moved = (event == 'moved_to_admitted').to_numpy()
+        counts = pd.DataFrame({
+            'month': normalise_month(chunk['event_date'], date_format),
+            'specialty': chunk['specialty'],
+            'additions': (event == 'addition').to_numpy(),
+            'removals': (event == 'removal').to_numpy() | moved,
+            'moved_to_admitted': moved,
+        })
+        totals = _fold(totals, counts, keys)
+
+    if totals is None:
+        return pd.DataFrame(columns=WAITING_LIST_COLUMNS)
+
+    # One row per specialty for every month in the extract
+    totals = totals.reset_index()
+    months = pd.date_range(totals['month'].min(), totals['month'].max(), freq=pd.offsets.MonthEnd())
+    specialties = totals['specialty'].astype(str).unique()
+    full_index = pd.MultiIndex.from_product([specialties, months], names=['specialty', 'month'])
+    totals['specialty'] = totals['specialty'].astype(str)
+    result = totals.set_index(['specialty', 'month']).reindex(full_index, fill_value=0).reset_index()
+
+    # Rows are grouped by specialty in month order, so the balance is a per-specialty cumulative sum
+    opening = result['specialty'].map(opening_waiting_list or {}).fillna(0).to_numpy(dtype=np.int64)
+    net = (result['additions'] - result['removals']).astype(np.int64)
+    result['waiting_list'] = opening + net.groupby(result['specialty'], sort=False).cumsum().to_numpy()
+    return enforce_schema(result[WAITING_LIST_COLUMNS], WAITING_LIST_SCHEMA)
+
+
+def _read_chunks(paths, usecols, category_columns, chunksize):
+    for path in [paths] if isinstance(paths, str) else paths:
+        yield from pd.read_csv(
+            path,
+            usecols=usecols,
+            dtype={column: 'category' for column in category_columns},
+            chunksize=chunksize
+        )
+
+
+def _fold(totals, counts, keys):
+    """Add a chunk's per-group counts into the running totals."""
+    partial = counts.groupby(keys, observed=True, sort=False).sum()
+    if totals is None:
+        return partial
+    # Specialty and type categories differ between chunks, so align on plain values
+    combined = pd.concat([totals.reset_index().astype({k: str for k in keys if k != 'month'}),
+                          partial.reset_index().astype({k: str for k in keys if k != 'month'})])
+    return combined.groupby(keys, sort=False).sum()
+
+
+def _as_bool(series):
+    if pd.api.types.is_bool_dtype(series):
+        return series.to_numpy()
+    return series.astype(str).str.strip().str.lower().isin(_TRUE_VALUES).to_numpy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m demand_capacity.ingest', description=__doc__.splitlines()[0])
+    parser.add_argument('--appointment-events', nargs='*', default=[], help='appointment event CSVs')
+    parser.add_argument('--waiting-list-events', nargs='*', default=[], help='waiting list event CSVs')
+    parser.add_argument('--opening-waiting-list', help='CSV of specialty,waiting_list before the first month')
+    parser.add_argument('--appointments-output', default='data/appointments_opa.csv', help='(default: %(default)s)')
+    parser.add_argument('--waiting-list-output', default='data/waiting_list_opa.csv', help='(default: %(default)s)')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='rows per chunk (default: %(default)s)')
+    parser.add_argument('--date-format', default=EVENT_DATE_FORMAT,
+                        help="format of the event dates, e.g. '%%d/%%m/%%Y' (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.appointment_events:
+        appointments = aggregate_appointment_events(args.appointment_events, args.chunksize, args.date_format)
+        appointments.to_csv(args.appointments_output, index=False, date_format='%d/%m/%Y')
+    if args.waiting_list_events:
+        opening = None
+        if args.opening_waiting_list:
+            opening = pd.read_csv(args.opening_waiting_list).set_index('specialty')['waiting_list'].to_dict()
+        waiting_list = aggregate_waiting_list_events(
+            args.waiting_list_events, opening, args.chunksize, args.date_format
+        )
+        waiting_list.to_csv(args.waiting_list_output, index=False, date_format='%d/%m/%Y')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""Process-pool execution of independent modelling units.
+
+A unit is one combination of the grouping columns, e.g. a specialty or a
+specialty and site. Each input frame is sorted so every unit is a contiguous
+block of rows, and its columns are copied once into shared memory. Workers
+attach to those blocks and rebuild only their own rows, so no DataFrame is
+pickled per task.
+
+Every unit gets its own random stream spawned from one seed in unit order,
+and results are returned in unit order, so the output does not depend on the
+number of workers or on the order in which units finish.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# Shared column blocks attached in each worker process
+_worker_columns = None
+_worker_handles = []
+
+
+def run_units(unit_func, frames, unit_columns, max_workers=None, seed=None, **kwargs):
+    """Run ``unit_func`` once per unit and return the results in unit order.
+
+    ``frames`` is a DataFrame or a list of DataFrames that share the unit
+    columns; units are taken from the first frame. ``unit_func(key,
+    unit_frames, rng, **kwargs)`` must be a module-level function. ``key`` is
+    the unit's value (a tuple when ``unit_columns`` has more than one column),
+    ``unit_frames`` the unit's rows (a list when a list was passed) and ``rng``
+    a ``numpy.random.Generator`` private to the unit.
+
+    DataFrame results are concatenated with the unit columns added, and dicts
+    of DataFrames are concatenated per name; otherwise a list of
+    ``(key, result)`` pairs is returned. ``max_workers=1`` runs everything in
+    the current process.
+    """
+    single_frame = isinstance(frames, pd.DataFrame)
+    frames = [frames] if single_frame else list(frames)
+    unit_columns = [unit_columns] if isinstance(unit_columns, str) else list(unit_columns)
+    frames = [frame.sort_values(unit_columns, kind='stable').reset_index(drop=True) for frame in frames]
+
+    # Row range of every unit in every frame; units missing from a frame get no rows
+    keys = list(_unit_bounds(frames[0], unit_columns))
+    frame_bounds = [_unit_bounds(frame, unit_columns) for frame in frames]
+    units = [(key, [bounds.get(key, (0, 0)) for bounds in frame_bounds]) for key in keys]
+    seeds = np.random.SeedSequence(seed).spawn(len(units))
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers == 1 or len(units) <= 1:
+        results = []
+        for (key, ranges), unit_seed in zip(units, seeds):
+            unit_frames = [frame.iloc[start:stop].reset_index(drop=True) for frame, (start, stop) in zip(frames, ranges)]
+            results.append(unit_func(key, unit_frames[0] if single_frame else unit_frames, np.random.default_rng(unit_seed), **kwargs))
+    else:
+        shared, handles = [], []
+        try:
+            for frame in frames:
+                columns, frame_handles = _share_columns(frame)
+                shared.append(columns)
+                handles.extend(frame_handles)
+            with ProcessPoolExecutor(
+                max_workers=min(max_workers, len(units)),
+                initializer=_attach_columns,
+                initargs=(shared,)
+            ) as executor:
+                futures = [
+                    executor.submit(_run_unit, unit_func, key, ranges, single_frame, unit_seed, kwargs)
+                    for (key, ranges), unit_seed in zip(units, seeds)
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            for handle in handles:
+                handle.close()
+                handle.unlink()
+
+    return _merge_results(keys, results, unit_columns)
+
+
+def _unit_bounds(frame, unit_columns):
+    """Return ``{key: (start, stop)}`` row ranges for each unit of a sorted frame, in row order."""
+    groups = frame.groupby(unit_columns, observed=True, sort=True).indices
+    bounds = []
+    for key, rows in groups.items():
+        if isinstance(key, tuple) and len(unit_columns) == 1:
+            key = key[0]
+        bounds.append((key, (int(rows[0]), int(rows[-1]) + 1)))
+    return dict(sorted(bounds, key=lambda bound: bound[1]))
+
+
+def _share_columns(frame):
+    """Copy each column of ``frame`` into its own shared memory block."""
+    columns, handles = [], []
+    try:
+        for name in frame.columns:
+            series = frame[name]
+            categories = None
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                categories = series.cat.categories
+                values = series.cat.codes.to_numpy()
+            elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+                codes, categories = pd.factorize(series, sort=True)
+                values = codes
+            else:
+                values = series.to_numpy()
+
+            handle = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            handles.append(handle)
+            np.ndarray(values.shape, dtype=values.dtype, buffer=handle.buf)[:] = values
+            columns.append((name, handle.name, values.dtype.str, values.shape, categories))
+    except BaseException:
+        for handle in handles:
+            handle.close()
+            handle.unlink()
+        raise
+    return columns, handles
+
+
+def _attach_columns(shared):
+    """Worker initializer: map the shared column blocks of every frame as NumPy arrays."""
+    global _worker_columns
+    _worker_columns = []
+    for columns in shared:
+        frame_columns = []
+        for name, shm_name, dtype, shape, categories in columns:
+            # Workers share the parent's resource tracker, which unlinks the blocks
+            # only if the parent exits without cleaning up
+            handle = shared_memory.SharedMemory(name=shm_name)
+            _worker_handles.append(handle)
+            values = np.ndarray(shape, dtype=np.dtype(dtype), buffer=handle.buf)
+            frame_columns.append((name, values, categories))
+        _worker_columns.append(frame_columns)
+
+
+def _run_unit(unit_func, key, ranges, single_frame, unit_seed, kwargs):
+    unit_frames = []
+    for frame_columns, (start, stop) in zip(_worker_columns, ranges):
+        data = {}
+        for name, values, categories in frame_columns:
+            if categories is not None:
+                data[name] = pd.Categorical.from_codes(values[start:stop], categories)
+            else:
+                data[name] = values[start:stop].copy()
+        unit_frames.append(pd.DataFrame(data))
+    return unit_func(key, unit_frames[0] if single_frame else unit_frames, np.random.default_rng(unit_seed), **kwargs)
+
+
+def _merge_results(keys, results, unit_columns):
+    if results and all(isinstance(result, dict) for result in results):
+        names = list(dict.fromkeys(name for result in results for name in result))
+        return {
+            name: _merge_results(keys, [result.get(name, pd.DataFrame()) for result in results], unit_columns)
+            for name in names
+        }
+    if not results or not all(isinstance(result, pd.DataFrame) for result in results):
+        return list(zip(keys, results))
+
+    merged = []
+    for key, result in zip(keys, results):
+        result = result.copy()
+        key_values = key if isinstance(key, tuple) else (key,)
+        for position, (column, value) in enumerate(zip(unit_columns, key_values)):
+            result.insert(position, column, value)
+        merged.append(result)
+    return pd.concat(merged, ignore_index=True)
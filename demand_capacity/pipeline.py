@@ -0,0 +1,105 @@
+"""The full demand and capacity model for every specialty, without Streamlit.
+
+``run_pipeline`` runs the same steps as the pages for each unit (a specialty,
+or a specialty and site): baseline scaling and the demand forecast, follow-up
+ratios, attended capacity with the utilisation/DNA uplift, and the waiting
+list projection to the modelling start date.
+"""
+import pandas as pd
+
+from demand_capacity.capacity import (
+    BASELINE_DNA_RATE, BASELINE_UTILISATION_RATE, appointment_totals, follow_up_ratios, required_capacity,
+    yearly_attended
+)
+from demand_capacity.demand import (
+    AVERAGE_MODEL, baseline_yearly_additions, compare_models, forecast_demand
+)
+from demand_capacity.parallel import run_units
+from demand_capacity.simulation import PERCENTILES, RANDOM_SAMPLING, project_unit
+
+BEST_MODEL = 'best'
+
+
+def default_dates(waiting_list_df):
+    """Default baseline (last 6 months of data) and modelling start (the next March), as on the pages."""
+    latest_month = waiting_list_df['month'].max()
+    baseline_start = latest_month - pd.DateOffset(months=5) + pd.offsets.MonthEnd(0)
+    model_start_date = pd.Timestamp(year=latest_month.year + (latest_month.month >= 3), month=3, day=31)
+    return baseline_start, latest_month, model_start_date
+
+
+def run_unit(key, frames, rng, baseline_start, baseline_end, model_start_date, model=BEST_MODEL,
+             utilisation_rate=BASELINE_UTILISATION_RATE, dna_rate=BASELINE_DNA_RATE,
+             num_simulations=10000, percentiles=PERCENTILES, sampling=RANDOM_SAMPLING):
+    """Model one unit. Returns a dict of DataFrames: ``summary``, ``demand_forecast`` and ``projection``."""
+    waiting_list_df, appointment_df = frames
+    waiting_list_df = waiting_list_df.groupby('month', sort=True)[['additions', 'removals', 'waiting_list']].sum().reset_index()
+    if waiting_list_df.empty:
+        return {}
+
+    # Demand
+    fit = compare_models(waiting_list_df, baseline_start, baseline_end)
+    if model == BEST_MODEL:
+        model = fit['best_model'] if fit is not None else AVERAGE_MODEL
+    demand_forecast = forecast_demand(waiting_list_df, baseline_start, baseline_end, model_start_date, model=model, fit=fit)
+    forecasted_total = demand_forecast['predicted_demand'].sum()
+
+    # Follow-up ratios and attended capacity
+    followup_ratio, non_rtt_ratio = follow_up_ratios(
+        appointment_totals(appointment_df, baseline_start, baseline_end, 'appointments_for_removals')
+    )
+    attended = yearly_attended(appointment_df, baseline_start, baseline_end)
+
+    # Waiting list projection
+    projection = project_unit(
+        key, waiting_list_df, rng, baseline_start, baseline_end, model_start_date,
+        num_simulations=num_simulations, percentiles=percentiles, sampling=sampling
+    )
+
+    summary = {
+        'latest_month': waiting_list_df['month'].iloc[-1],
+        'latest_waiting_list': waiting_list_df['waiting_list'].iloc[-1],
+        'baseline_additions_12_month': baseline_yearly_additions(waiting_list_df, baseline_start, baseline_end),
+        'demand_model': model,
+        'error_average': fit['error_average'] if fit is not None else None,
+        'error_regression': fit['error_regression'] if fit is not None else None,
+        'forecasted_total': forecasted_total,
+        'first_followup_removals_ratio': followup_ratio,
+        'first_non_rtt_removals_ratio': non_rtt_ratio,
+        'rtt_followup_demand': forecasted_total * followup_ratio if followup_ratio is not None else None,
+        'non_rtt_demand': forecasted_total * non_rtt_ratio if non_rtt_ratio is not None else None,
+        'available_rtt_first': attended['RTT First'],
+        'available_rtt_followup': attended['RTT Follow-up'],
+        'available_non_rtt': attended['Non-RTT'],
+        'required_rtt_first_capacity': required_capacity(attended['RTT First'], utilisation_rate, dna_rate),
+    }
+    if not projection.empty:
+        for p in percentiles:
+            summary[f'waiting_list_start_percentile_{p}'] = projection[f'percentile_{p}'].iloc[-1]
+
+    return {
+        'summary': pd.DataFrame([summary]),
+        'demand_forecast': demand_forecast,
+        'projection': projection,
+    }
+
+
+def run_pipeline(waiting_list_df, appointment_df, baseline_start=None, baseline_end=None, model_start_date=None,
+                 unit_columns='specialty', max_workers=1, seed=None, **kwargs):
+    """Run the model for every unit and return a dict of combined DataFrames.
+
+    Dates default to those used by the pages (see ``default_dates``). Extra
+    keyword arguments are passed to ``run_unit``.
+    """
+    default_start, default_end, default_model_start = default_dates(waiting_list_df)
+    return run_units(
+        run_unit,
+        [waiting_list_df, appointment_df],
+        unit_columns,
+        max_workers=max_workers,
+        seed=seed,
+        baseline_start=baseline_start if baseline_start is not None else default_start,
+        baseline_end=baseline_end if baseline_end is not None else default_end,
+        model_start_date=model_start_date if model_start_date is not None else default_model_start,
+        **kwargs
+    )
@@ -0,0 +1,167 @@
+"""Incremental monthly refresh of the stored data and its running totals.
+
+Running totals hold, for every specialty and month, the cumulative sums of the
+waiting list counts and of the least-squares terms of the referral trend.
+Totals over any range of months, and the trend fitted to any run of months,
+are then the difference of two rows, so nothing is re-summed over the
+history. Appending a month extends only the specialties in the new data
+from their last row, and earlier rows (and anything derived from them) are
+unchanged.
+
+``refresh_dataset`` is the app's load path: when months have been appended
+to a file it has already loaded, it reads only the new Parquet parts and
+extends the frame, specialty index and running totals with them.
+
+Run ``python -m demand_capacity.refresh --help`` to append a month of
+extracts to the stored CSVs.
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from demand_capacity.data import (
+    APPOINTMENTS_PATH, APPOINTMENTS_SCHEMA, CACHE_DIR, SOURCE_DATE_FORMAT, WAITING_LIST_PATH, WAITING_LIST_SCHEMA,
+    append_dataset, appended_rows, build_specialty_index, concat_frames, file_fingerprint, load_dataset
+)
+from demand_capacity.demand import PRE_BASELINE_MONTHS
+
+TOTAL_COLUMNS = ['additions', 'removals', 'moved_to_admitted']
+
+# Trend sums use days since this date rather than raw ordinals to keep them small
+TREND_ORIGIN = pd.Timestamp('2000-01-01').toordinal()
+_TREND_ORIGIN_DAY = np.datetime64('2000-01-01', 'D')  # the same date, for datetime64 arithmetic
+_TREND_COLUMNS = ['trend_x', 'trend_xx', 'trend_xy']
+
+
+def build_running_totals(index, columns=TOTAL_COLUMNS):
+    """Running totals for every specialty of a specialty index (see ``build_specialty_index``)."""
+    return {specialty: _extend_totals(None, frame, columns) for specialty, frame in index.items()}
+
+
+def append_month(index, totals, new_rows, columns=TOTAL_COLUMNS):
+    """Add new months to a specialty index and its running totals.
+
+    Only specialties present in ``new_rows`` are touched; their new months
+    must come after their latest month. Returns new ``(index, totals)`` dicts
+    that share every other specialty's frames with the old ones. ``totals``
+    can be ``None`` to extend the index alone.
+    """
+    index = dict(index)
+    totals = None if totals is None else dict(totals)
+    for specialty, rows in new_rows.groupby('specialty', observed=True, sort=False):
+        rows = rows.sort_values('month', kind='stable')
+        frame = index.get(specialty)
+        if frame is not None and not frame.empty and rows['month'].iloc[0] <= frame['month'].iloc[-1]:
+            raise ValueError(f"{specialty} already has data for {rows['month'].iloc[0]:%Y-%m}.")
+        index[specialty] = rows.reset_index(drop=True) if frame is None else concat_frames([frame, rows])
+        if totals is not None:
+            totals[specialty] = _extend_totals(totals.get(specialty), rows, columns)
+    return index, totals
+
+
+def refresh_dataset(path, schema, loaded=None, with_totals=False, cache_dir=CACHE_DIR):
+    """Load ``path`` with its specialty index, extending an earlier load when months were only appended.
+
+    ``loaded`` is what this returned for an earlier version of the file. If
+    the file has since only had months appended (see ``append_dataset``),
+    just those rows are read, and the frame, index and running totals are
+    extended with them; otherwise everything is loaded and built again.
+    Returns a dict with the file's ``fingerprint``, the frame ``df``, its
+    specialty ``index`` and running ``totals`` (``None`` unless
+    ``with_totals``).
+    """
+    fingerprint = file_fingerprint(path)
+    if loaded is not None and loaded['fingerprint'] == fingerprint:
+        return loaded
+
+    new_rows = None if loaded is None else appended_rows(path, loaded['fingerprint'], schema, cache_dir)
+    if new_rows is None:
+        df = load_dataset(path, schema, cache_dir)
+        index = build_specialty_index(df)
+        totals = build_running_totals(index) if with_totals else None
+    else:
+        df = concat_frames([loaded['df'], new_rows])
+        index, totals = append_month(loaded['index'], loaded['totals'], new_rows)
+    return {'fingerprint': fingerprint, 'df': df, 'index': index, 'totals': totals}
+
+
+def window_totals(specialty_totals, start, end):
+    """Sums of the counts over ``start <= month <= end``, as a Series."""
+    months = specialty_totals['month'].to_numpy()
+    first = np.searchsorted(months, np.datetime64(start), side='left')
+    last = np.searchsorted(months, np.datetime64(end), side='right')
+    return _row_difference(specialty_totals, first, last).drop(_TREND_COLUMNS)
+
+
+def trend_before(specialty_totals, baseline_start, num_months=PRE_BASELINE_MONTHS):
+    """Trend line of additions over the ``num_months`` rows before ``baseline_start``.
+
+    Returns ``(slope, intercept)`` against ordinal dates, as ``fit_trend`` does
+    for the same rows, or ``None`` when there are fewer than two months.
+    """
+    stop = np.searchsorted(specialty_totals['month'].to_numpy(), np.datetime64(baseline_start), side='left')
+    start = max(stop - num_months, 0)
+    n = stop - start
+    if n < 2:
+        return None
+
+    sums = _row_difference(specialty_totals, start, stop)
+    sum_x, sum_y = sums['trend_x'], sums['additions']
+    spread = n * sums['trend_xx'] - sum_x ** 2
+    if spread <= 0:
+        return None
+    slope = (n * sums['trend_xy'] - sum_x * sum_y) / spread
+    intercept = (sum_y - slope * sum_x) / n - slope * TREND_ORIGIN
+    return slope, intercept
+
+
+def _extend_totals(previous, rows, columns):
+    """Cumulative sums of ``rows`` continuing from the last row of ``previous``."""
+    x = (rows['month'].to_numpy(dtype='datetime64[D]') - _TREND_ORIGIN_DAY).astype(float)
+    additions = rows['additions'].to_numpy(dtype=float)
+    increments = {column: rows[column].to_numpy(dtype=np.int64) for column in columns}
+    increments.update(trend_x=x, trend_xx=x * x, trend_xy=x * additions)
+
+    continues = previous is not None and not previous.empty
+    cumulative = pd.DataFrame({'month': rows['month'].to_numpy(), **{
+        column: np.cumsum(values) + (previous[column].iloc[-1] if continues else 0)
+        for column, values in increments.items()
+    }})
+    if previous is None:
+        return cumulative
+    return pd.concat([previous, cumulative], ignore_index=True)
+
+
+def _row_difference(specialty_totals, start, stop):
+    """Sums over rows ``start`` to ``stop - 1`` from the cumulative columns."""
+    values = specialty_totals.drop(columns='month')
+    if stop <= start:
+        return pd.Series(0.0, index=values.columns)
+    total = values.iloc[stop - 1]
+    return total - values.iloc[start - 1] if start > 0 else total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m demand_capacity.refresh', description=__doc__.splitlines()[0])
+    parser.add_argument('--waiting-list', help='CSV of new waiting list months to append')
+    parser.add_argument('--appointments', help='CSV of new appointment months to append')
+    parser.add_argument('--waiting-list-path', default=WAITING_LIST_PATH, help='stored waiting list CSV (default: %(default)s)')
+    parser.add_argument('--appointments-path', default=APPOINTMENTS_PATH, help='stored appointments CSV (default: %(default)s)')
+    parser.add_argument('--date-format', default=SOURCE_DATE_FORMAT,
+                        help="format of the months in the new CSVs, e.g. ISO8601 (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    for new_path, path, schema in [
+        (args.waiting_list, args.waiting_list_path, WAITING_LIST_SCHEMA),
+        (args.appointments, args.appointments_path, APPOINTMENTS_SCHEMA),
+    ]:
+        if new_path:
+            new_rows = append_dataset(path, pd.read_csv(new_path), schema, date_format=args.date_format)
+            print(f"Appended {len(new_rows)} rows ({new_rows['month'].min():%Y-%m} to {new_rows['month'].max():%Y-%m}) to {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
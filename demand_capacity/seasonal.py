@@ -0,0 +1,200 @@
+"""Seasonal demand models fitted to every specialty at once.
+
+Each model takes a matrix of monthly referrals with one row per series and
+returns point forecasts and prediction intervals for the following months.
+All series are fitted together with array operations, so the cost grows with
+the length of the history rather than with a Python loop per specialty:
+
+- ``seasonal_naive``: each month repeats the same month of the last year
+- ``holt_winters``: additive Holt-Winters (ETS(A,A,A)), with smoothing
+  parameters chosen per series from a grid by one-step-ahead error
+- ``seasonal_regression``: least-squares trend plus month-of-year dummies
+
+A series may start later than the others: it is fitted over its own months
+only, from its first month with data. Later missing months count as zero
+referrals.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from demand_capacity.demand import filter_months, month_count
+
+SEASONAL_NAIVE_MODEL = 'seasonal_naive'
+HOLT_WINTERS_MODEL = 'holt_winters'
+SEASONAL_REGRESSION_MODEL = 'seasonal_regression'
+SEASONAL_MODELS = [SEASONAL_NAIVE_MODEL, HOLT_WINTERS_MODEL, SEASONAL_REGRESSION_MODEL]
+
+SEASON_LENGTH = 12
+
+# Months of history each model needs
+MIN_MONTHS = {
+    SEASONAL_NAIVE_MODEL: SEASON_LENGTH + 1,
+    HOLT_WINTERS_MODEL: 2 * SEASON_LENGTH,
+    SEASONAL_REGRESSION_MODEL: SEASON_LENGTH + 2,
+}
+
+# Default coverage of the prediction intervals
+INTERVAL_LEVEL = 0.9
+
+# Holt-Winters smoothing parameters searched for each series (level, trend, season)
+HOLT_WINTERS_GRID = [
+    (alpha, beta, gamma)
+    for alpha, beta, gamma in itertools.product([0.1, 0.2, 0.4, 0.6, 0.8], [0.0, 0.02, 0.1], [0.0, 0.05, 0.15, 0.3])
+    if beta <= alpha and gamma <= 1 - alpha
+]
+
+
+def batch_forecast(values, model, horizon=12, level=INTERVAL_LEVEL):
+    """Forecast ``horizon`` months for every row of ``values`` (series x months).
+
+    Every series ends in the last month. A series that starts later has NaN
+    before its first month and is fitted from that month on; one shorter than
+    ``MIN_MONTHS[model]`` gets NaN forecasts. Returns ``(forecast, lower,
+    upper)`` arrays of shape (series, horizon). Lower bounds are clipped at
+    zero.
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim != 2:
+        raise ValueError("values must be a 2-D array of series x months.")
+    if model not in MODEL_FUNCTIONS:
+        raise ValueError(f"Unknown seasonal model {model!r}; expected one of {SEASONAL_MODELS}.")
+    observed = ~np.isnan(values)
+    start = np.where(observed.any(axis=1), observed.argmax(axis=1), values.shape[1])
+    if (observed != (np.arange(values.shape[1]) >= start[:, None])).any():
+        raise ValueError("Only the months before a series starts can be missing (NaN).")
+    fitted = values.shape[1] - start >= MIN_MONTHS[model]
+    if not fitted.any():
+        raise ValueError(f"The {model} model needs at least {MIN_MONTHS[model]} months of history.")
+
+    forecast = np.full((len(values), horizon), np.nan)
+    spread = np.full((len(values), horizon), np.nan)
+    forecast[fitted], spread[fitted] = MODEL_FUNCTIONS[model](values[fitted], start[fitted], horizon)
+    z = norm.ppf(0.5 + level / 2)
+    return forecast, np.maximum(forecast - z * spread, 0), forecast + z * spread
+
+
+def forecast_specialties(waiting_list_df, model, end, model_start_date, level=INTERVAL_LEVEL, column='additions'):
+    """Fit ``model`` to every specialty's history up to ``end`` and forecast 12 months.
+
+    Seasonal models use the whole history rather than a baseline window.
+    Returns a long DataFrame with ``specialty``, ``month``,
+    ``predicted_demand``, ``lower`` and ``upper`` for the 12 months from
+    ``model_start_date``, which must be after ``end``. Each specialty is
+    fitted from its first month with referrals; one with too short a history
+    for ``model`` gets NaN forecasts.
+    """
+    if model_start_date <= end:
+        raise ValueError(
+            f"The modelling start ({model_start_date:%Y-%m}) must be after the end of the history ({end:%Y-%m})."
+        )
+    history = filter_months(waiting_list_df, waiting_list_df['month'].min(), end)
+    series = history.pivot_table(index='specialty', columns='month', values=column, aggfunc='sum', observed=True)
+    months = pd.date_range(series.columns.min(), series.columns.max(), freq=pd.offsets.MonthEnd())
+    values = series.reindex(columns=months).to_numpy(dtype=float)
+    # Months before a specialty's first referrals stay missing; later gaps are zero
+    started = np.maximum.accumulate(~np.isnan(values), axis=1)
+    values = np.where(started, np.nan_to_num(values), np.nan)
+
+    # Forecast from the month after the history up to the end of the modelling year
+    horizon = month_count(months[-1], model_start_date) - 2 + 12
+    forecast, lower, upper = batch_forecast(values, model, horizon=horizon, level=level)
+
+    future_months = pd.date_range(start=model_start_date, periods=12, freq=pd.offsets.MonthEnd())
+    keep = slice(horizon - 12, horizon)
+    return pd.DataFrame({
+        'specialty': np.repeat(series.index.to_numpy(), 12),
+        'month': np.tile(future_months.to_numpy(), len(series)),
+        'predicted_demand': forecast[:, keep].ravel(),
+        'lower': lower[:, keep].ravel(),
+        'upper': upper[:, keep].ravel(),
+    })
+
+
+def _seasonal_naive(values, start, horizon, season=SEASON_LENGTH):
+    steps = np.arange(horizon)
+    forecast = values[:, values.shape[1] - season + steps % season]
+    # Differences reaching back before a series starts are NaN and left out
+    residuals = values[:, season:] - values[:, :-season]
+    sigma = np.sqrt(np.nanmean(residuals ** 2, axis=1, keepdims=True))
+    # Each extra year ahead adds another season of error
+    return forecast, sigma * np.sqrt(steps // season + 1)
+
+
+def _seasonal_regression(values, start, horizon, season=SEASON_LENGTH):
+    num_months = values.shape[1]
+    design = _regression_design(np.arange(num_months), season)
+    future = _regression_design(np.arange(num_months, num_months + horizon), season)
+
+    # Weighted least squares with each series weighting only its own months: (series, months)
+    weights = (np.arange(num_months) >= start[:, None]).astype(float)
+    observed = np.nan_to_num(values)
+    inverse = np.linalg.pinv(np.einsum('st,ti,tj->sij', weights, design, design))
+    coefficients = np.einsum('sij,tj,st->si', inverse, design, weights * observed)
+    residuals = weights * (observed - coefficients @ design.T)
+    dof = np.maximum(weights.sum(axis=1, keepdims=True) - design.shape[1], 1)
+    sigma2 = np.sum(residuals ** 2, axis=1, keepdims=True) / dof
+
+    # Variance of a new observation: sigma^2 (1 + x (X'X)^-1 x')
+    leverage = np.einsum('hi,sij,hj->sh', future, inverse, future)
+    return coefficients @ future.T, np.sqrt(sigma2 * (1 + leverage))
+
+
+def _regression_design(steps, season):
+    dummies = np.eye(season)[steps % season][:, 1:]
+    return np.column_stack([np.ones(steps.size), steps, dummies])
+
+
+def _holt_winters(values, start, horizon, season=SEASON_LENGTH):
+    num_series, num_months = values.shape
+    grid = np.array(HOLT_WINTERS_GRID)
+    alpha, beta, gamma = (grid[:, i][None, :] for i in range(3))
+    rows = np.arange(num_series)
+
+    # Initial states from each series' first two seasons, repeated for every grid point: (series, grid)
+    first_two = values[rows[:, None], start[:, None] + np.arange(2 * season)]
+    first, second = first_two[:, :season].mean(axis=1), first_two[:, season:].mean(axis=1)
+    level = np.repeat(first[:, None], len(grid), axis=1)
+    trend = np.repeat(((second - first) / season)[:, None], len(grid), axis=1)
+    # Seasonal states are indexed by month position, so a later start fills them from its own first season
+    initial = np.empty((num_series, season))
+    initial[rows[:, None], (start[:, None] + np.arange(season)) % season] = first_two[:, :season] - first[:, None]
+    seasonal = np.repeat(initial[:, None, :], len(grid), axis=1)
+
+    # Error-correction form: each state moves by its smoothing weight times the one-step error
+    sse = np.zeros((num_series, len(grid)))
+    for t in range(start.min(), num_months):
+        position = t % season
+        active = (t >= start)[:, None]
+        # A zero error leaves the states of series that have not started yet unchanged
+        error = np.where(active, values[:, t][:, None] - (level + trend + seasonal[:, :, position]), 0)
+        sse += np.where((t >= start + season)[:, None], error ** 2, 0)
+        level = np.where(active, level + trend + alpha * error, level)
+        trend = trend + beta * error
+        seasonal[:, :, position] += gamma * error
+
+    best = np.argmin(sse, axis=1)
+    level, trend, seasonal = level[rows, best], trend[rows, best], seasonal[rows, best]
+    alpha, beta, gamma = grid[best].T
+    sigma2 = sse[rows, best] / (num_months - start - season)
+
+    steps = np.arange(1, horizon + 1)
+    forecast = (
+        level[:, None] + steps[None, :] * trend[:, None]
+        + seasonal[:, (num_months + steps - 1) % season]
+    )
+
+    # ETS(A,A,A) forecast variance: sigma^2 (1 + sum over j < h of c_j^2)
+    j = np.arange(1, horizon)
+    c = alpha[:, None] + beta[:, None] * j[None, :] + gamma[:, None] * (j % season == 0)[None, :]
+    cumulative = np.concatenate([np.zeros((num_series, 1)), np.cumsum(c ** 2, axis=1)], axis=1)
+    return forecast, np.sqrt(sigma2[:, None] * (1 + cumulative))
+
+
+MODEL_FUNCTIONS = {
+    SEASONAL_NAIVE_MODEL: _seasonal_naive,
+    HOLT_WINTERS_MODEL: _holt_winters,
+    SEASONAL_REGRESSION_MODEL: _seasonal_regression,
+}
@@ -0,0 +1,443 @@
+"""Monte Carlo projection of the total waiting list.
+
+Each projected month adds one addition and subtracts one removal, both drawn
+independently and uniformly (with replacement) from the baseline months. All
+simulations are drawn in one go as a (simulations x months) array, so the
+number of runs can be raised without slowing the pages down. Several
+specialties can also be projected together as a (specialty x simulation x
+month) array, each with its own baseline sampling pool.
+
+Above ``CHUNK_SIZE`` runs, simulations are drawn one chunk at a time and only
+a count of each waiting list value per month is kept. The counts grow with
+the spread of the simulated values rather than the number of runs, and the
+percentiles read from them are exactly those of all the runs together.
+
+``exact_projection`` gives the same bands without sampling: the distribution
+of one month's net change is the convolution of the baseline additions with
+the negated removals, and the change over ``t`` months is its ``t``-fold
+convolution, computed for every month with FFTs.
+
+Draws map uniform numbers onto the sorted baseline months, so the same
+random stream picks comparable months for different baselines (common random
+numbers). ``sampling`` chooses how the uniforms are drawn: independently
+(``'random'``), in mirrored pairs ``u`` and ``1 - u`` (``'antithetic'``), or
+one per equal slice of [0, 1) in each month (``'stratified'``). The last two
+give the same bands with less noise for a given number of runs.
+"""
+import numpy as np
+import pandas as pd
+from scipy.fft import irfft, next_fast_len, rfft
+from scipy.stats import norm
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# Simulations drawn at once; larger runs are streamed in chunks of this size
+CHUNK_SIZE = 50_000
+
+# Adaptive runs: first batch size, cap on the total, and confidence of the stopping rule
+ADAPTIVE_BATCH_SIZE = 1000
+ADAPTIVE_MAX_SIMULATIONS = 1_000_000
+ADAPTIVE_CONFIDENCE = 0.95
+
+RANDOM_SAMPLING = 'random'
+ANTITHETIC_SAMPLING = 'antithetic'
+STRATIFIED_SAMPLING = 'stratified'
+SAMPLING_METHODS = [RANDOM_SAMPLING, ANTITHETIC_SAMPLING, STRATIFIED_SAMPLING]
+
+
+def simulate_paths(start, additions, removals, num_months, num_simulations, rng=None, sampling=RANDOM_SAMPLING):
+    """Return a (num_simulations x num_months) array of simulated waiting list totals."""
+    rng = np.random.default_rng(rng)
+    additions = np.sort(np.asarray(additions, dtype=float))
+    removals = np.sort(np.asarray(removals, dtype=float))
+    if additions.size == 0 or removals.size == 0:
+        raise ValueError("Baseline additions and removals must not be empty.")
+
+    shape = (num_simulations, num_months)
+    sampled_additions = additions[_pool_index(_uniforms(rng, shape, sampling), additions.size)]
+    sampled_removals = removals[_pool_index(_uniforms(rng, shape, sampling), removals.size)]
+    # Net monthly change, accumulated in place along the month axis
+    paths = np.subtract(sampled_additions, sampled_removals, out=sampled_additions)
+    np.cumsum(paths, axis=1, out=paths)
+    paths += start
+    return paths
+
+
+def simulate_chunks(start, additions, removals, num_months, num_simulations, chunk_size=CHUNK_SIZE, rng=None,
+                    sampling=RANDOM_SAMPLING):
+    """Yield the simulated paths in arrays of at most ``chunk_size`` runs.
+
+    Each chunk has its own random stream spawned from ``rng`` in order, so
+    the runs do not depend on how the chunks are consumed.
+    """
+    rng = np.random.default_rng(rng)
+    sizes = _chunk_sizes(num_simulations, chunk_size)
+    for size, chunk_rng in zip(sizes, rng.spawn(len(sizes))):
+        yield simulate_paths(start, additions, removals, num_months, size, rng=chunk_rng, sampling=sampling)
+
+
+def project_waiting_list(start, additions, removals, num_months, num_simulations=10000,
+                         percentiles=PERCENTILES, rng=None, chunk_size=CHUNK_SIZE, sampling=RANDOM_SAMPLING):
+    """Project the waiting list forward and return its percentile bands.
+
+    ``rng`` can be a seed or a ``numpy.random.Generator``. Returns an array of
+    shape (len(percentiles), num_months); row ``i`` holds ``percentiles[i]``
+    for each projected month. Above ``chunk_size`` runs the paths are
+    streamed through ``simulate_chunks`` and never held all at once.
+    """
+    if num_simulations <= chunk_size:
+        paths = simulate_paths(start, additions, removals, num_months, num_simulations, rng=rng, sampling=sampling)
+        return np.percentile(paths, percentiles, axis=0)
+
+    _check_integer_counts(start, additions, removals)
+    counts, low = None, None
+    chunks = simulate_chunks(start, additions, removals, num_months, num_simulations, chunk_size, rng=rng, sampling=sampling)
+    for paths in chunks:
+        counts, low = _accumulate_counts(counts, low, paths)
+    return _percentiles_from_counts(counts, low, percentiles)
+
+
+def iter_adaptive_projection(start, additions, removals, num_months, tolerance, percentiles=PERCENTILES,
+                             batch_size=ADAPTIVE_BATCH_SIZE, max_simulations=ADAPTIVE_MAX_SIMULATIONS,
+                             confidence=ADAPTIVE_CONFIDENCE, rng=None, sampling=RANDOM_SAMPLING):
+    """Simulate in growing batches until every percentile is known to within ``tolerance``.
+
+    After each batch, yields ``(bands, num_simulations, half_width)``: the
+    bands so far (as from ``project_waiting_list``), the runs so far and the
+    widest ``confidence`` interval half-width of any percentile in any month.
+    Stops once ``half_width <= tolerance`` or after ``max_simulations`` runs.
+    Each batch doubles the runs so far, and only value counts are kept.
+    """
+    _check_integer_counts(start, additions, removals)
+    rng = np.random.default_rng(rng)
+    counts, low, total, size = None, None, 0, batch_size
+    while total < max_simulations:
+        size = min(size, max_simulations - total)
+        paths = simulate_paths(start, additions, removals, num_months, size, rng=rng, sampling=sampling)
+        counts, low = _accumulate_counts(counts, low, paths)
+        total += size
+        half_width = _percentile_half_width(counts, low, percentiles, confidence)
+        yield _percentiles_from_counts(counts, low, percentiles), total, half_width
+        if half_width <= tolerance:
+            return
+        size = total
+
+
+def project_adaptive(start, additions, removals, num_months, tolerance, percentiles=PERCENTILES, **kwargs):
+    """Return the final ``(bands, num_simulations, half_width)`` of ``iter_adaptive_projection``."""
+    for result in iter_adaptive_projection(start, additions, removals, num_months, tolerance, percentiles, **kwargs):
+        pass
+    return result
+
+
+def exact_projection(start, additions, removals, num_months, percentiles=PERCENTILES):
+    """Exact percentile bands of the projection, with the same shape as ``project_waiting_list``.
+
+    ``percentiles[i]`` of month ``t`` is the smallest waiting list whose
+    probability of not being exceeded is at least ``percentiles[i]`` per cent.
+    Counts must be whole numbers.
+    """
+    additions = np.asarray(additions)
+    removals = np.asarray(removals)
+    if additions.size == 0 or removals.size == 0:
+        raise ValueError("Baseline additions and removals must not be empty.")
+    _check_integer_counts(start, additions, removals)
+    additions, removals = additions.astype(np.int64), removals.astype(np.int64)
+
+    # Probabilities of one month's net change, from step_low upwards
+    addition_low, removal_high = additions.min(), removals.max()
+    addition_pmf = np.bincount(additions - addition_low) / additions.size
+    negated_removal_pmf = np.bincount(removal_high - removals) / removals.size
+    step = np.convolve(addition_pmf, negated_removal_pmf)
+    step_low = addition_low - removal_high
+
+    # The t-month change is the t-th power of the step's transform
+    length = next_fast_len(num_months * (step.size - 1) + 1, real=True)
+    transform = rfft(step, length)
+    power = np.ones_like(transform)
+    # Small tolerance so rounding in the transforms cannot skip a value whose CDF is exactly q
+    quantiles = np.asarray(percentiles, dtype=float) / 100 - 1e-9
+
+    bands = np.empty((len(quantiles), num_months))
+    for month in range(num_months):
+        power *= transform
+        support = (month + 1) * (step.size - 1) + 1
+        pmf = np.clip(irfft(power, length)[:support], 0, None)
+        cdf = np.cumsum(pmf)
+        cdf /= cdf[-1]
+        bands[:, month] = start + (month + 1) * step_low + np.searchsorted(cdf, quantiles, side='left')
+    return bands
+
+
+def simulate_batch(starts, addition_pools, removal_pools, num_months, num_simulations, rng=None,
+                   sampling=RANDOM_SAMPLING):
+    """Simulate several independent groups (e.g. specialties) in one array pass.
+
+    Group ``i`` starts from ``starts[i]`` and samples from its own
+    ``addition_pools[i]`` and ``removal_pools[i]``. Returns an array of shape
+    (groups, num_simulations, num_months).
+    """
+    rng = np.random.default_rng(rng)
+    starts = np.asarray(starts, dtype=float)
+    shape = (len(starts), num_simulations, num_months)
+
+    sampled_additions = _draw_from_pools(addition_pools, shape, rng, sampling)
+    sampled_removals = _draw_from_pools(removal_pools, shape, rng, sampling)
+    paths = np.subtract(sampled_additions, sampled_removals, out=sampled_additions)
+    np.cumsum(paths, axis=2, out=paths)
+    paths += starts[:, None, None]
+    return paths
+
+
+def backtest_projection(starts, addition_pools, removal_pools, actual, num_simulations=10000,
+                        percentiles=PERCENTILES, rng=None, chunk_size=CHUNK_SIZE, sampling=RANDOM_SAMPLING):
+    """Score the projection against known history for several validation windows at once.
+
+    Window ``i`` starts from ``starts[i]`` and samples from ``addition_pools[i]``
+    and ``removal_pools[i]`` (the months before the period being predicted).
+    ``actual`` holds the observed totals for the predicted months.
+
+    Returns ``(bands, mae, mse)`` where ``bands`` has shape
+    (windows, len(percentiles), months) and ``mae``/``mse`` compare the median
+    path with ``actual`` for each window. Above ``chunk_size`` runs the paths
+    are streamed in chunks, as in ``project_waiting_list``.
+    """
+    actual = np.asarray(actual, dtype=float)
+    quantiles = list(percentiles) + ([] if 50 in percentiles else [50])
+
+    if num_simulations <= chunk_size:
+        paths = simulate_batch(starts, addition_pools, removal_pools, actual.size, num_simulations, rng=rng, sampling=sampling)
+        values = np.moveaxis(np.percentile(paths, quantiles, axis=1), 0, 1)
+    else:
+        _check_integer_counts(starts, *addition_pools, *removal_pools)
+        rng = np.random.default_rng(rng)
+        sizes = _chunk_sizes(num_simulations, chunk_size)
+        counts, low = None, None
+        for size, chunk_rng in zip(sizes, rng.spawn(len(sizes))):
+            paths = simulate_batch(starts, addition_pools, removal_pools, actual.size, size, rng=chunk_rng, sampling=sampling)
+            # Count each (window, month) cell separately: (runs, windows x months)
+            cells = np.moveaxis(paths, 1, 0).reshape(size, -1)
+            counts, low = _accumulate_counts(counts, low, cells)
+        values = _percentiles_from_counts(counts, low, quantiles).reshape(len(quantiles), len(starts), actual.size)
+        values = np.moveaxis(values, 0, 1)
+
+    bands = values[:, :len(percentiles)]
+    median = values[:, quantiles.index(50)]
+    errors = actual - median
+    return bands, np.abs(errors).mean(axis=1), (errors ** 2).mean(axis=1)
+
+
+def project_specialties(waiting_list_df, baseline_start, baseline_end, model_start_date,
+                        num_simulations=2000, percentiles=PERCENTILES, rng=None, sampling=RANDOM_SAMPLING):
+    """Project every specialty's waiting list to ``model_start_date`` in one batch.
+
+    Each specialty starts from its latest waiting list and samples from its own
+    months between ``baseline_start`` and ``baseline_end``. Specialties with no
+    baseline data, or with data already beyond ``model_start_date``, are left
+    out. Returns a DataFrame with a ``specialty`` column and a
+    ``percentile_{p}`` column per percentile, plus a final ``Total`` row taken
+    from the sum of the specialty paths.
+    """
+    latest = waiting_list_df.sort_values('month').groupby('specialty', observed=True, sort=False).tail(1)
+    baseline = waiting_list_df[
+        (waiting_list_df['month'] >= baseline_start) & (waiting_list_df['month'] <= baseline_end)
+    ]
+    pools = {
+        specialty: (group['additions'].to_numpy(), group['removals'].to_numpy())
+        for specialty, group in baseline.groupby('specialty', observed=True, sort=False)
+    }
+
+    specialties, starts, horizons = [], [], []
+    for row in latest.itertuples(index=False):
+        horizon = (model_start_date.year - row.month.year) * 12 + (model_start_date.month - row.month.month)
+        if row.specialty in pools and horizon > 0:
+            specialties.append(row.specialty)
+            starts.append(row.waiting_list)
+            horizons.append(horizon)
+
+    columns = ['specialty'] + [f'percentile_{p}' for p in percentiles]
+    if not specialties:
+        return pd.DataFrame(columns=columns)
+
+    paths = simulate_batch(
+        starts,
+        [pools[s][0] for s in specialties],
+        [pools[s][1] for s in specialties],
+        max(horizons),
+        num_simulations,
+        rng=rng,
+        sampling=sampling
+    )
+    # Each specialty's value in the month of the model start date
+    final = paths[np.arange(len(specialties)), :, np.array(horizons) - 1]
+    final = np.vstack([final, final.sum(axis=0)])
+
+    result = pd.DataFrame(np.percentile(final, percentiles, axis=1).T, columns=columns[1:])
+    result.insert(0, 'specialty', specialties + ['Total'])
+    return result
+
+
+def project_unit(key, unit_frame, rng, baseline_start, baseline_end, model_start_date,
+                 num_simulations=10000, percentiles=PERCENTILES, sampling=RANDOM_SAMPLING):
+    """Project one unit's waiting list to ``model_start_date``.
+
+    Written for ``parallel.run_units``: ``unit_frame`` holds one specialty (or
+    specialty and site). Returns a DataFrame with a ``month`` column and a
+    ``percentile_{p}`` column per percentile, empty when the unit has no
+    baseline data or no months left to project.
+    """
+    columns = ['month'] + [f'percentile_{p}' for p in percentiles]
+    unit_frame = unit_frame.groupby('month', sort=True)[['additions', 'removals', 'waiting_list']].sum().reset_index()
+    baseline = unit_frame[(unit_frame['month'] >= baseline_start) & (unit_frame['month'] <= baseline_end)]
+    if baseline.empty or unit_frame.empty:
+        return pd.DataFrame(columns=columns)
+
+    latest_month = unit_frame['month'].iloc[-1]
+    future_months = pd.date_range(latest_month + pd.offsets.MonthEnd(1), model_start_date, freq=pd.offsets.MonthEnd())
+    if future_months.empty:
+        return pd.DataFrame(columns=columns)
+
+    bands = project_waiting_list(
+        unit_frame['waiting_list'].iloc[-1],
+        baseline['additions'].to_numpy(),
+        baseline['removals'].to_numpy(),
+        num_months=len(future_months),
+        num_simulations=num_simulations,
+        percentiles=percentiles,
+        rng=rng,
+        sampling=sampling
+    )
+    result = pd.DataFrame(bands.T, columns=columns[1:])
+    result.insert(0, 'month', future_months)
+    return result
+
+
+def _chunk_sizes(num_simulations, chunk_size):
+    full, remainder = divmod(num_simulations, chunk_size)
+    return [chunk_size] * full + ([remainder] if remainder else [])
+
+
+def _check_integer_counts(*values):
+    for value in values:
+        if not np.all(np.mod(value, 1) == 0):
+            raise ValueError("Streamed simulations need whole-number waiting list counts.")
+
+
+def _accumulate_counts(counts, low, values):
+    """Add a chunk of whole-number ``values`` (runs x cells) to per-cell value counts.
+
+    ``counts[c, k]`` is the number of runs where cell ``c`` took the value
+    ``low[c] + k``. The value range grows as later chunks go beyond it.
+    """
+    values = values.astype(np.int64)
+    num_cells = values.shape[1]
+    chunk_low, chunk_high = values.min(axis=0), values.max(axis=0)
+    if counts is None:
+        new_low, high = chunk_low, chunk_high
+    else:
+        new_low = np.minimum(low, chunk_low)
+        high = np.maximum(low + counts.shape[1] - 1, chunk_high)
+    width = int((high - new_low).max()) + 1
+
+    if counts is None:
+        counts = np.zeros((num_cells, width), dtype=np.int64)
+    elif width != counts.shape[1] or (new_low != low).any():
+        # Shift each cell's counts into the wider range
+        expanded = np.zeros((num_cells, width), dtype=np.int64)
+        columns = (low - new_low)[:, None] + np.arange(counts.shape[1])
+        expanded[np.arange(num_cells)[:, None], columns] = counts
+        counts = expanded
+
+    flat = (values - new_low) + np.arange(num_cells) * width
+    counts += np.bincount(flat.ravel(), minlength=num_cells * width).reshape(num_cells, width)
+    return counts, new_low
+
+
+def _percentiles_from_counts(counts, low, percentiles):
+    """Percentiles of every cell from its value counts, as ``np.percentile`` would give them.
+
+    Returns an array of shape (len(percentiles), cells).
+    """
+    total = counts[0].sum()
+    quantiles = np.asarray(percentiles, dtype=float) / 100
+    # Same virtual index and interpolation as numpy's default 'linear' method
+    position = total * quantiles + (1 - quantiles) - 1
+    below = np.floor(position)
+    fraction = (position - below)[:, None]
+    lower_value, upper_value = np.split(
+        _order_statistics(counts, low, np.concatenate([below, np.minimum(below + 1, total - 1)])), 2
+    )
+    difference = upper_value - lower_value
+    return np.where(
+        fraction >= 0.5,
+        upper_value - difference * (1 - fraction),
+        lower_value + difference * fraction
+    )
+
+
+def _order_statistics(counts, low, ranks):
+    """Values at 0-based ``ranks`` of every cell's sorted runs, shape (len(ranks), cells)."""
+    cumulative = np.cumsum(counts, axis=1)
+    result = np.empty((len(ranks), counts.shape[0]))
+    for cell in range(counts.shape[0]):
+        result[:, cell] = low[cell] + np.searchsorted(cumulative[cell], ranks, side='right')
+    return result
+
+
+def _percentile_half_width(counts, low, percentiles, confidence):
+    """Largest half-width of the distribution-free confidence intervals of the percentiles.
+
+    The interval for quantile ``q`` from ``n`` runs spans the order statistics
+    at ranks ``n q -/+ z sqrt(n q (1 - q))``. An interval between two
+    neighbouring simulated values counts as zero width: the waiting list
+    only takes certain values, and a percentile that sits on a jump between
+    two of them flips between them however many runs there are.
+    """
+    total = counts[0].sum()
+    quantiles = np.asarray(percentiles, dtype=float) / 100
+    spread = norm.ppf(0.5 + confidence / 2) * np.sqrt(total * quantiles * (1 - quantiles))
+    lower_rank = np.clip(np.floor(total * quantiles - spread), 0, total - 1)
+    upper_rank = np.clip(np.ceil(total * quantiles + spread), 0, total - 1)
+    lower, upper = np.split(_order_statistics(counts, low, np.concatenate([lower_rank, upper_rank])), 2)
+
+    # Runs strictly between the two ends of each interval
+    cumulative = np.cumsum(counts, axis=1)
+    cells = np.arange(counts.shape[0])
+    lower_index, upper_index = (lower - low).astype(np.intp), (upper - low).astype(np.intp)
+    between = cumulative[cells, np.maximum(upper_index - 1, 0)] - cumulative[cells, lower_index]
+    return float(np.max(np.where(between > 0, upper - lower, 0)) / 2)
+
+
+def _draw_from_pools(pools, shape, rng, sampling=RANDOM_SAMPLING):
+    """Sample uniformly from each pool into ``shape``; the first axis indexes the pool."""
+    counts = np.array([len(pool) for pool in pools])
+    if (counts == 0).any():
+        raise ValueError("Sampling pools must not be empty.")
+    # Pad the sorted pools into one 2-D array so every pool is sampled in the same call
+    padded = np.zeros((len(pools), counts.max()))
+    for i, pool in enumerate(pools):
+        padded[i, :counts[i]] = np.sort(pool)
+    # Runs come first when drawing, so antithetic pairs and strata span the runs
+    uniforms = np.moveaxis(_uniforms(rng, (shape[1], shape[0]) + shape[2:], sampling), 0, 1)
+    idx = _pool_index(uniforms, counts.reshape((-1,) + (1,) * (len(shape) - 1)))
+    return np.take_along_axis(padded, idx.reshape(shape[0], -1), axis=1).reshape(shape)
+
+
+def _uniforms(rng, shape, sampling):
+    """Uniform numbers in [0, 1] with runs along the first axis of ``shape``."""
+    num_runs = shape[0]
+    if sampling == RANDOM_SAMPLING:
+        return rng.random(shape)
+    if sampling == ANTITHETIC_SAMPLING:
+        half = rng.random(((num_runs + 1) // 2,) + tuple(shape[1:]))
+        return np.concatenate([half, 1 - half])[:num_runs]
+    if sampling == STRATIFIED_SAMPLING:
+        # Each run gets a different slice of [0, 1) in every column, in random order
+        strata = np.broadcast_to(np.arange(num_runs).reshape((-1,) + (1,) * (len(shape) - 1)), shape)
+        return (rng.permuted(strata, axis=0) + rng.random(shape)) / num_runs
+    raise ValueError(f"Unknown sampling method {sampling!r}; expected one of {SAMPLING_METHODS}.")
+
+
+def _pool_index(uniforms, counts):
+    """Map uniforms onto indices of sorted pools of size ``counts``."""
+    return np.minimum((uniforms * counts).astype(np.intp), counts - 1)
@@ -0,0 +1,21 @@
+"""Named, reproducible random streams.
+
+A stream is identified by a seed and a list of names, e.g.
+``random_stream('projection', 'Cardiology')``. The same names always give the
+same random numbers, so scenarios that differ only in their inputs (two
+baselines, two modelling dates) share common random numbers: the difference
+between their results is the effect of the inputs, not sampling noise, and
+reruns of a page give the same numbers.
+"""
+import zlib
+
+import numpy as np
+
+DEFAULT_SEED = 0
+
+
+def random_stream(*names, seed=DEFAULT_SEED):
+    """Return a ``numpy.random.Generator`` for ``seed`` and the given names."""
+    # crc32 rather than hash(), which is salted per process for strings
+    keys = tuple(zlib.crc32(str(name).encode()) for name in names)
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=keys))
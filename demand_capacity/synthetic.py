@@ -0,0 +1,92 @@
+"""Synthetic waiting list and appointment extracts at configurable scale.
+
+The generated frames have the same columns as ``waiting_list_opa.csv`` and
+``appointments_opa.csv`` (plus a ``site`` column when there is more than one
+site), so they can go through the loader, the pages and the batch pipeline.
+Everything is generated with array operations, so tens of millions of rows
+take seconds rather than minutes.
+"""
+import numpy as np
+import pandas as pd
+
+from demand_capacity.capacity import APPOINTMENT_TYPES
+
+
+def generate_datasets(num_specialties=20, num_sites=1, num_months=36, num_appointment_types=3,
+                      end_month='2024-11-30', seed=0):
+    """Return ``(waiting_list_df, appointment_df)`` with one row per unit and month.
+
+    The waiting list frame has ``num_specialties * num_sites * num_months``
+    rows and the appointment frame ``num_appointment_types`` times as many.
+    Referrals follow a per-unit level with yearly seasonality and Poisson
+    noise, and the waiting list is the running balance of additions and
+    removals.
+    """
+    rng = np.random.default_rng(seed)
+    months = pd.date_range(end=pd.Timestamp(end_month) + pd.offsets.MonthEnd(0), periods=num_months,
+                           freq=pd.offsets.MonthEnd())
+    specialties = [f'Specialty {i + 1:03d}' for i in range(num_specialties)]
+    sites = [f'Site {i + 1:02d}' for i in range(num_sites)]
+    appointment_types = APPOINTMENT_TYPES[:num_appointment_types] + [
+        f'Other {i + 1}' for i in range(num_appointment_types - len(APPOINTMENT_TYPES))
+    ]
+    num_units = num_specialties * num_sites
+
+    # Monthly referrals: unit level x seasonality x noise, shape (units, months)
+    level = rng.lognormal(mean=6.0, sigma=0.8, size=(num_units, 1))
+    seasonality = 1 + 0.1 * np.sin(2 * np.pi * (months.month.to_numpy() - 1) / 12)
+    trend = 1 + rng.normal(0, 0.002, size=(num_units, 1)) * np.arange(num_months)
+    additions = rng.poisson(level * seasonality * trend).astype(np.int32)
+    removals = rng.poisson(level * seasonality * rng.uniform(0.9, 1.05, size=(num_units, 1))).astype(np.int32)
+    moved_to_admitted = rng.binomial(removals, 0.02).astype(np.int32)
+
+    start = (level[:, 0] * rng.uniform(2, 8, size=num_units)).astype(np.int64)
+    waiting_list = np.maximum(start[:, None] + np.cumsum(additions - removals, axis=1, dtype=np.int64), 0)
+
+    unit_specialty = np.repeat(np.arange(num_specialties), num_sites)
+    unit_site = np.tile(np.arange(num_sites), num_specialties)
+    waiting_list_df = pd.DataFrame({
+        'month': np.tile(months.to_numpy(), num_units),
+        'specialty': pd.Categorical.from_codes(np.repeat(unit_specialty, num_months), specialties),
+        'additions': additions.ravel(),
+        'removals': removals.ravel(),
+        'moved_to_admitted': moved_to_admitted.ravel(),
+        'waiting_list': waiting_list.ravel().astype(np.int32),
+    })
+    if num_sites > 1:
+        waiting_list_df.insert(2, 'site', pd.Categorical.from_codes(np.repeat(unit_site, num_months), sites))
+
+    # Appointments: RTT firsts track removals, other types are multiples of them
+    type_share = np.concatenate([[1.0], rng.uniform(0.2, 1.5, size=num_appointment_types - 1)])
+    attended = rng.poisson(
+        (removals * 1.1)[:, :, None] * type_share[None, None, :]
+    ).astype(np.int32)
+    routine = rng.binomial(attended, 0.6)
+    urgent = rng.binomial(attended - routine, 0.6)
+    dna = rng.binomial(attended, 0.08).astype(np.int32)
+    for_removals = rng.binomial(attended, 0.85).astype(np.int32)
+    appointment_removals = rng.binomial(for_removals, 0.9).astype(np.int32)
+
+    rows = num_units * num_months * num_appointment_types
+    appointment_df = pd.DataFrame({
+        'month': np.tile(np.repeat(months.to_numpy(), num_appointment_types), num_units),
+        'specialty': pd.Categorical.from_codes(np.repeat(unit_specialty, num_months * num_appointment_types), specialties),
+        'appointment_type': pd.Categorical.from_codes(np.tile(np.arange(num_appointment_types), rows // num_appointment_types), appointment_types),
+        'appointments_attended': attended.ravel(),
+        'appointments_attended_routine': routine.ravel().astype(np.int32),
+        'appointments_attended_urgent': urgent.ravel().astype(np.int32),
+        'appointments_attended_2_week_wait': (attended - routine - urgent).ravel().astype(np.int32),
+        'dna': dna.ravel(),
+        'appointments_for_removals': for_removals.ravel(),
+        'removals': appointment_removals.ravel(),
+    })
+    if num_sites > 1:
+        appointment_df.insert(2, 'site', pd.Categorical.from_codes(np.repeat(unit_site, num_months * num_appointment_types), sites))
+
+    return waiting_list_df, appointment_df
+
+
+def write_datasets(waiting_list_df, appointment_df, waiting_list_path, appointments_path):
+    """Write generated frames as CSVs with the same date format as the source extracts."""
+    for df, path in [(waiting_list_df, waiting_list_path), (appointment_df, appointments_path)]:
+        df.to_csv(path, index=False, date_format='%d/%m/%Y')
@@ -1,6 +1,9 @@
 import streamlit as st
 import pandas as pd
 
+from demand_capacity.simulation import project_specialties
+from demand_capacity.streams import random_stream
+
 st.title("Specialty Summary Table")
 
 # Ensure both dataframes are available
@@ -44,17 +47,41 @@ referral_baseline_df = referral_df[(referral_df['month'] >= baseline_start) & (r
 appointment_baseline_df = appointment_df[(appointment_df['month'] >= baseline_start) & (appointment_df['month'] <= baseline_end)]
 
 # Aggregate both dataframes by specialty
-referral_aggregated = referral_baseline_df.groupby('specialty').agg({'additions': 'sum'}).reset_index()
-appointment_aggregated = referral_baseline_df.groupby('specialty').agg({'removals': 'sum'}).reset_index()
+referral_aggregated = referral_baseline_df.groupby('specialty', observed=True).agg({'additions': 'sum'}).reset_index()
+appointment_aggregated = referral_baseline_df.groupby('specialty', observed=True).agg({'removals': 'sum'}).reset_index()
 
 # Calculate waiting list at the start and end of the baseline
-wl_start = referral_df[referral_df['month'] == baseline_start].groupby('specialty').agg({'waiting_list': 'sum'}).reset_index()
-wl_end = referral_df[referral_df['month'] == baseline_end].groupby('specialty').agg({'waiting_list': 'sum'}).reset_index()
+wl_start = referral_df[referral_df['month'] == baseline_start].groupby('specialty', observed=True).agg({'waiting_list': 'sum'}).reset_index()
+wl_end = referral_df[referral_df['month'] == baseline_end].groupby('specialty', observed=True).agg({'waiting_list': 'sum'}).reset_index()
 
 # Merge all data
-specialty_summary = pd.merge(referral_aggregated, appointment_aggregated, on='specialty', how='outer').fillna(0)
-specialty_summary = pd.merge(specialty_summary, wl_start.rename(columns={'waiting_list': 'WL Start'}), on='specialty', how='left').fillna(0)
-specialty_summary = pd.merge(specialty_summary, wl_end.rename(columns={'waiting_list': 'WL End'}), on='specialty', how='left').fillna(0)
+specialty_summary = pd.merge(referral_aggregated, appointment_aggregated, on='specialty', how='outer')
+specialty_summary = pd.merge(specialty_summary, wl_start.rename(columns={'waiting_list': 'WL Start'}), on='specialty', how='left')
+specialty_summary = pd.merge(specialty_summary, wl_end.rename(columns={'waiting_list': 'WL End'}), on='specialty', how='left')
+# Fill only the numeric columns; specialty is categorical and cannot take a 0
+specialty_summary = specialty_summary.fillna({'additions': 0, 'removals': 0, 'WL Start': 0, 'WL End': 0})
+
+# Project every specialty's waiting list to the modelling start date in one batch
+if 'model_start_date' in st.session_state:
+    model_start_date = pd.to_datetime(st.session_state.model_start_date).to_period('M').to_timestamp('M')
+else:
+    # Default to the end of the next March after the latest data, as on the Historic Waiting List page
+    latest_month = referral_df['month'].max()
+    model_start_date = pd.Timestamp(year=latest_month.year + (latest_month.month >= 3), month=3, day=31)
+
+# A fixed stream keeps the table steady across reruns and comparable between baselines
+projection = project_specialties(referral_df, baseline_start, baseline_end, model_start_date, rng=random_stream('summary'))
+projection_by_specialty = projection.set_index('specialty')
+
+def format_predicted_range(row):
+    return f"{row['percentile_5']:.0f} to {row['percentile_95']:.0f}"
+
+projection_display = pd.DataFrame({
+    'Predicted WL': projection_by_specialty['percentile_50'].round(),
+    'Predicted WL (90% Range)': projection_by_specialty.apply(format_predicted_range, axis=1)
+})
+specialty_summary['Predicted WL'] = specialty_summary['specialty'].map(projection_display['Predicted WL']).astype(float)
+specialty_summary['Predicted WL (90% Range)'] = specialty_summary['specialty'].map(projection_display['Predicted WL (90% Range)']).astype(object)
 
 # Calculate the number of months in the baseline period
 num_baseline_months = (baseline_end.year - baseline_start.year) * 12 + (baseline_end.month - baseline_start.month) + 1
@@ -83,6 +110,10 @@ specialty_summary['Expected Change'] = specialty_summary['Deficit (12-Month)'].a
 totals = pd.DataFrame(specialty_summary.sum(numeric_only=True)).T
 totals['specialty'] = 'Total'
 totals['Expected Change'] = format_expected_change(totals['Deficit (12-Month)'].values[0])
+# The trust total comes from the summed simulation paths, not the sum of specialty medians
+if 'Total' in projection_display.index:
+    totals['Predicted WL'] = projection_display.loc['Total', 'Predicted WL']
+    totals['Predicted WL (90% Range)'] = projection_display.loc['Total', 'Predicted WL (90% Range)']
 specialty_summary = pd.concat([specialty_summary, totals], ignore_index=True)
 
 # Select relevant columns to display
@@ -94,6 +125,8 @@ columns_to_display = [
     'WL Start',
     'WL End',
     'WL Change',
+    'Predicted WL',
+    'Predicted WL (90% Range)',
     'Referrals (12-Month)',
     'Removals (12-Month)'
 ]
@@ -105,7 +138,9 @@ specialty_summary_display = specialty_summary[columns_to_display].rename(columns
     'removals': 'Removals (Baseline)',
     'WL Start': 'Waiting List Start',
     'WL End': 'Waiting List End',
-    'WL Change': 'Waiting List Change'
+    'WL Change': 'Waiting List Change',
+    'Predicted WL': f"Predicted Waiting List ({model_start_date:%b %Y})",
+    'Predicted WL (90% Range)': 'Predicted Waiting List (90% Range)'
 })
 
 # Display the summary table
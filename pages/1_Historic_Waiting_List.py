@@ -1,8 +1,88 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 
+from demand_capacity import charts
+from demand_capacity.data import specialty_view
+from demand_capacity.simulation import (
+    ANTITHETIC_SAMPLING, PERCENTILES, RANDOM_SAMPLING, STRATIFIED_SAMPLING, backtest_projection, exact_projection,
+    iter_adaptive_projection, project_waiting_list
+)
+from demand_capacity.streams import random_stream
+
+# Number of Monte Carlo runs for the waiting list projection and validation
+NUM_SIMULATIONS = 10000
+
+# Run counts offered for the projection; large counts are streamed in chunks
+ADAPTIVE_SIMULATIONS = 'Adaptive'
+SIMULATION_OPTIONS = [10_000, 100_000, 1_000_000, ADAPTIVE_SIMULATIONS]
+
+# Default half-width (patients) of the percentile confidence intervals in adaptive mode
+DEFAULT_TOLERANCE = 5
+
+# Adaptive projections remembered per session
+MAX_ADAPTIVE_RESULTS = 16
+
+# Projection methods: sampled paths, or the exact distribution by convolution
+MONTE_CARLO_METHOD = 'Monte Carlo'
+EXACT_METHOD = 'Exact (Convolution)'
+
+# Labels for the Monte Carlo sampling options
+SAMPLING_LABELS = {RANDOM_SAMPLING: 'Random', ANTITHETIC_SAMPLING: 'Antithetic', STRATIFIED_SAMPLING: 'Stratified'}
+
+# Lengths (in months) of the pre-baseline windows used to validate the projection
+VALIDATION_WINDOWS = [3, 6, 12, 18, 24]
+
+
+@st.cache_data(max_entries=32)
+def run_backtest(specialty, starts, addition_pools, removal_pools, actual):
+    # Cached on the input arrays, so unrelated widget changes skip the backtest
+    return backtest_projection(
+        starts, addition_pools, removal_pools, actual,
+        num_simulations=NUM_SIMULATIONS, rng=random_stream('validation', specialty)
+    )
+
+
+@st.cache_data(max_entries=32, show_spinner="Simulating...")
+def run_projection(specialty, start, additions, removals, num_months, method, num_simulations, sampling):
+    if method == EXACT_METHOD:
+        return exact_projection(start, additions, removals, num_months)
+    # The stream depends only on the specialty, so different baselines and dates use common random numbers
+    return project_waiting_list(
+        start, additions, removals, num_months=num_months, num_simulations=num_simulations,
+        rng=random_stream('projection', specialty), sampling=sampling
+    )
+
+
+def adaptive_projection(specialty, start, additions, removals, future_months, tolerance, sampling):
+    # Kept in session state rather than st.cache_data so the progress charts are not replayed on a hit
+    key = (specialty, start, additions.tobytes(), removals.tobytes(), len(future_months), tolerance, sampling)
+    results = st.session_state.setdefault('adaptive_projections', {})
+    if key in results:
+        return results[key]
+
+    progress = st.empty()
+    batches = iter_adaptive_projection(
+        start, additions, removals, len(future_months), tolerance,
+        rng=random_stream('projection', specialty), sampling=sampling
+    )
+    for bands, runs, half_width in batches:
+        fig = charts.figure(
+            [
+                charts.band(future_months, bands[0], bands[-1], '5th-95th Percentile', 'rgba(200, 200, 200, 0.4)'),
+                charts.line(future_months, bands[len(bands) // 2], 'Median'),
+            ],
+            title=f'Simulating... {runs:,} runs, percentiles within ±{half_width:.1f}',
+            height=300
+        )
+        progress.plotly_chart(fig, use_container_width=True, key=f'adaptive_progress_{runs}')
+    progress.empty()
+
+    if len(results) >= MAX_ADAPTIVE_RESULTS:
+        results.pop(next(iter(results)))
+    results[key] = (bands, runs, half_width)
+    return results[key]
+
 
 st.title("Historic Waiting List")
 
@@ -26,6 +106,333 @@ color_map = {
 }
 
 
+@st.fragment
+def projection_section(selected_specialty, waiting_list_specialty_df, baseline_start_date, baseline_end_date):
+    # Reruns on its own when the modelling date or projection settings change
+    ### **3. Waiting List Over Time Plot (fig2)**
+    st.subheader("Total Size of the Waiting List Over Time")
+
+    # fig2 traces, without predictions until there are some
+    fig2_title = 'Total Size of the Waiting List'
+    fig2_traces = [
+        charts.line(
+            waiting_list_specialty_df['month'],
+            waiting_list_specialty_df['waiting_list'],
+            'Actual',
+            line=dict(color=color_map['Actual'], width=3)
+        )
+    ]
+
+    # fig2 is drawn here once, with predictions when there are any
+    fig2_container = st.container()
+
+    st.write("""
+    Select the date from which you want the model to start predicting the waiting list size. This date should be after the latest month in the data.
+    """)
+
+    # Get the maximum date from the DataFrame
+    max_date = waiting_list_specialty_df['month'].max()
+    
+    # Calculate the next March after max_date
+    if max_date.month >= 3:
+        next_march_year = max_date.year + 1
+    else:
+        next_march_year = max_date.year
+    
+    # Set the last day of March as the default value
+    default_model_start_date = pd.Timestamp(year=next_march_year, month=3, day=31)
+    
+    # Check if 'model_start_date' is already in session state
+    if 'model_start_date' not in st.session_state:
+        # Initialize with default value if not set
+        st.session_state.model_start_date = default_model_start_date
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        # Use the value from session state for the date input
+        model_start_date = st.date_input(
+            'Start Date for Modeling',
+            value=st.session_state.model_start_date
+        )
+    with col2:
+        projection_method = st.radio(
+            'Projection Method',
+            [MONTE_CARLO_METHOD, EXACT_METHOD],
+            help='The exact method computes the distribution of the sampled months directly, so the bands have no simulation noise.'
+        )
+    with col3:
+        num_simulations = st.selectbox(
+            'Number of Simulations',
+            SIMULATION_OPTIONS,
+            format_func=lambda option: option if option == ADAPTIVE_SIMULATIONS else f'{option:,}',
+            disabled=projection_method == EXACT_METHOD,
+            help='Adaptive mode adds runs until every percentile is known to within the tolerance.'
+        )
+        tolerance = st.number_input(
+            'Tolerance (patients)',
+            min_value=0.5,
+            value=float(DEFAULT_TOLERANCE),
+            step=0.5,
+            disabled=projection_method == EXACT_METHOD or num_simulations != ADAPTIVE_SIMULATIONS
+        )
+        sampling = st.selectbox(
+            'Sampling',
+            list(SAMPLING_LABELS),
+            format_func=SAMPLING_LABELS.get,
+            disabled=projection_method == EXACT_METHOD,
+            help='Antithetic and stratified sampling reach the same bands with less simulation noise.'
+        )
+    
+    # Update session state with the selected date
+    st.session_state.model_start_date = model_start_date
+    
+    # Convert modeling start date to datetime
+    model_start_date = pd.to_datetime(st.session_state.model_start_date).to_period('M').to_timestamp('M')
+
+
+    
+    # Latest month in the data
+    latest_month_in_data = waiting_list_specialty_df['month'].max()
+
+    ### **5. Add Prediction Line to fig2 and Print Prediction Message**
+    if model_start_date > latest_month_in_data:
+        # Calculate the number of months to predict
+        num_future_months = (model_start_date.year - latest_month_in_data.year) * 12 + \
+                            (model_start_date.month - latest_month_in_data.month)
+
+        # Proceed with prediction if the number of months is positive
+        if num_future_months > 0:
+            # Filter the baseline data
+            baseline_data = waiting_list_specialty_df[
+                (waiting_list_specialty_df['month'] >= baseline_start_date) &
+                (waiting_list_specialty_df['month'] <= baseline_end_date)
+            ]
+
+            if baseline_data.empty:
+                st.error("No data available in the selected baseline period.")
+            else:
+                # Get the last known total waiting list size
+                last_total_waiting_list = waiting_list_specialty_df.iloc[-1]['waiting_list']
+
+                # Create date range for future months, including the modeling start date
+                future_months = pd.date_range(
+                    start=latest_month_in_data + pd.offsets.MonthEnd(1),
+                    end=model_start_date,
+                    freq='M'
+                )
+
+
+                # Percentile bands only; large Monte Carlo runs never hold every path at once
+                if projection_method == MONTE_CARLO_METHOD and num_simulations == ADAPTIVE_SIMULATIONS:
+                    percentile_values, runs, half_width = adaptive_projection(
+                        selected_specialty,
+                        last_total_waiting_list,
+                        baseline_data['additions'].to_numpy(),
+                        baseline_data['removals'].to_numpy(),
+                        future_months,
+                        tolerance,
+                        sampling
+                    )
+                    st.caption(f"Adaptive projection: {runs:,} runs, every percentile within ±{half_width:.1f} patients (95% confidence).")
+                else:
+                    percentile_values = run_projection(
+                        selected_specialty,
+                        last_total_waiting_list,
+                        baseline_data['additions'].to_numpy(),
+                        baseline_data['removals'].to_numpy(),
+                        len(future_months),
+                        projection_method,
+                        num_simulations,
+                        sampling
+                    )
+                simulation_results = pd.DataFrame({'month': future_months})
+                for p, values in zip(PERCENTILES, percentile_values):
+                    simulation_results[f'percentile_{p}'] = values
+
+                # Use the 50th percentile (median) as the average prediction, with shaded percentile bands
+                fig2_title = 'Total Size of the Waiting List with Predictions'
+                fig2_traces += [
+                    charts.line(
+                        simulation_results['month'],
+                        simulation_results['percentile_50'],
+                        'Predicted',
+                        line=dict(color=color_map['Predicted'], dash='dash', width=4)
+                    ),
+                    charts.band(
+                        simulation_results['month'],
+                        simulation_results['percentile_5'],
+                        simulation_results['percentile_95'],
+                        '5th-95th Percentile',
+                        'rgba(200, 200, 200, 0.2)'
+                    ),
+                    charts.band(
+                        simulation_results['month'],
+                        simulation_results['percentile_25'],
+                        simulation_results['percentile_75'],
+                        '25th-75th Percentile',
+                        'rgba(160, 160, 160, 0.3)'
+                    ),
+                ]
+
+                # Access the percentile values for the last predicted month
+                last_month_data = simulation_results.iloc[-1]
+                percentile_5 = last_month_data['percentile_5']
+                percentile_25 = last_month_data['percentile_25']
+                percentile_50 = last_month_data['percentile_50']  # Median
+                percentile_75 = last_month_data['percentile_75']
+                percentile_95 = last_month_data['percentile_95']
+                
+                # Display the prediction in larger font
+                st.markdown(f"### Predicted Waiting List Size: **{percentile_50:.0f}**")
+                
+                st.write(f"""
+                - **Prediction Date:** {model_start_date.strftime('%b %Y')}
+                - **Expected Range (50% probability):** {percentile_25:.0f} to {percentile_75:.0f}
+                - **Expected Range (90% probability):** {percentile_5:.0f} to {percentile_95:.0f}
+                """)
+                st.write(f"This will be the starting position for modelling the impact of future capacity.")
+                st.session_state['waiting_list_start'] = percentile_50
+
+    fig2 = charts.figure(
+        fig2_traces,
+        title=fig2_title,
+        height=600,
+        x_title='Month',
+        y_title='Total Waiting List',
+        legend_title='Data Type'
+    )
+    fig2_container.plotly_chart(fig2, use_container_width=True)
+
+
+@st.fragment
+def validation_section(selected_specialty, waiting_list_specialty_df, baseline_start_date, baseline_end_date):
+    # Depends only on the baseline dates; the window selector reruns just this section
+    ### **6. Validation of Prediction Methodology**
+    st.subheader("Validation of Total Waiting List Prediction Methodology")
+    
+    st.write("""
+    This section validates the prediction methodology by using data from the months before the baseline period to predict the baseline period. 
+    The results are averaged over multiple simulations, with the mean prediction plotted as a line, and the 50th and 95th percentiles displayed as shaded areas.
+    The entire historic waiting list data is also included in the chart for context.
+    """)
+    
+    # Filter baseline data
+    actual_baseline_data = waiting_list_specialty_df[
+        (waiting_list_specialty_df['month'] >= baseline_start_date) &
+        (waiting_list_specialty_df['month'] <= baseline_end_date)
+    ].reset_index(drop=True)
+
+    # Collect the validation data for each window length (months before baseline start)
+    validation_end_date = baseline_start_date - pd.DateOffset(months=1)
+    validation_windows = {}
+    for window in VALIDATION_WINDOWS:
+        validation_start_date = baseline_start_date - pd.DateOffset(months=window)
+        validation_data = waiting_list_specialty_df[
+            (waiting_list_specialty_df['month'] >= validation_start_date) &
+            (waiting_list_specialty_df['month'] <= validation_end_date)
+        ]
+        if not validation_data.empty:
+            validation_windows[window] = validation_data
+    
+    if not validation_windows or actual_baseline_data.empty:
+        st.error("No data available in the validation period.")
+    else:
+        # Backtest every window length in one batched simulation
+        window_lengths = list(validation_windows)
+        bands, mae_by_window, mse_by_window = run_backtest(
+            selected_specialty,
+            tuple(validation_windows[w].iloc[-1]['waiting_list'] for w in window_lengths),
+            tuple(validation_windows[w]['additions'].to_numpy() for w in window_lengths),
+            tuple(validation_windows[w]['removals'].to_numpy() for w in window_lengths),
+            actual_baseline_data['waiting_list'].to_numpy()
+        )
+
+        st.write("**Backtest Error by Validation Window Length**")
+        st.table(pd.DataFrame({
+            'Validation Window (Months)': window_lengths,
+            'Mean Absolute Error (MAE)': mae_by_window.round(2),
+            'Mean Squared Error (MSE)': mse_by_window.round(2)
+        }))
+
+        col1, _, _ = st.columns(3)
+        with col1:
+            default_window = window_lengths.index(12) if 12 in window_lengths else len(window_lengths) - 1
+            selected_window = st.selectbox('Validation Window to Plot (Months)', window_lengths, index=default_window)
+        window_index = window_lengths.index(selected_window)
+
+        simulation_results = pd.DataFrame({'month': actual_baseline_data['month']})
+        for p, values in zip(PERCENTILES, bands[window_index]):
+            simulation_results[f'percentile_{p}'] = values
+    
+        # Plot all historic data, the actual baseline and the percentiles
+        st.subheader("Comparison of Historic, Actual Baseline, and Predicted Baseline")
+        fig_validation = charts.figure(
+            [
+                charts.line(
+                    waiting_list_specialty_df['month'],
+                    waiting_list_specialty_df['waiting_list'],
+                    'Historic Total Waiting List',
+                    line=dict(color=color_map['Historic Total Waiting List'], width=3)
+                ),
+                charts.line(
+                    actual_baseline_data['month'],
+                    actual_baseline_data['waiting_list'],
+                    'Actual Total Waiting List',
+                    line=dict(color=color_map['Actual Total Waiting List'], width=3)
+                ),
+                charts.band(
+                    simulation_results['month'],
+                    simulation_results['percentile_5'],
+                    simulation_results['percentile_95'],
+                    '5th-95th Percentile',
+                    'rgba(200, 200, 200, 0.2)'
+                ),
+                charts.band(
+                    simulation_results['month'],
+                    simulation_results['percentile_25'],
+                    simulation_results['percentile_75'],
+                    '25th-75th Percentile',
+                    'rgba(160, 160, 160, 0.3)'
+                ),
+                charts.line(
+                    simulation_results['month'],
+                    simulation_results['percentile_50'],
+                    'Mean Prediction',
+                    line=dict(color=color_map['Mean Prediction'], width=3, dash='dash')
+                ),
+            ],
+            title='Validation of Baseline Prediction Methodology',
+            height=600,
+            x_title='Month',
+            y_title='Total Waiting List',
+            legend_title='Data Type'
+        )
+
+        st.plotly_chart(fig_validation, use_container_width=True)
+    
+        # Calculate evaluation metrics
+        comparison_actual_predicted = pd.merge(
+            actual_baseline_data,
+            simulation_results[['month', 'percentile_50']].rename(columns={'percentile_50': 'Predicted Total Waiting List'}),
+            on='month'
+        )
+        mae = mae_by_window[window_index]
+        mse = mse_by_window[window_index]
+    
+        st.write(f"**Mean Absolute Error (MAE):** {mae:.2f}")
+        st.write(f"**Mean Squared Error (MSE):** {mse:.2f}")
+        st.write("""
+        A lower MAE and MSE indicate better predictive accuracy. Use this information to assess the reliability of the model.
+        """)
+        
+        # Compare final month mean prediction to actual value
+        final_month = comparison_actual_predicted.iloc[-1]
+        final_actual = final_month['waiting_list']
+        final_predicted = final_month['Predicted Total Waiting List']
+        st.write(f"**Final Month Comparison:** The actual value for the final month is {final_actual:.0f}, "
+                 f"Mean predicted value is {final_predicted:.0f}.")
+
+
 # Check if data is available in session state
 if st.session_state.referral_df is not None and st.session_state.appointment_df is not None:
     waiting_list_df = st.session_state.referral_df
@@ -47,30 +454,30 @@ if st.session_state.referral_df is not None and st.session_state.appointment_df
         # Save the selected specialty to session state
         st.session_state.selected_specialty = selected_specialty
 
-        # Filter data based on selected specialty
-        waiting_list_specialty_df = waiting_list_df[waiting_list_df['specialty'] == selected_specialty]
-        # Convert 'month' column to datetime and adjust to end of month
-        waiting_list_specialty_df['month'] = pd.to_datetime(waiting_list_specialty_df['month']).dt.to_period('M').dt.to_timestamp('M')
-        # Sort by month
-        waiting_list_specialty_df = waiting_list_specialty_df.sort_values('month')
+        # Data for the selected specialty (month-end dates, sorted by month)
+        waiting_list_specialty_df = specialty_view(st.session_state.referral_index, selected_specialty)
 
         ### **1. Additions and Removals Plot (fig1)**
         st.subheader("Additions and Removals from Waiting List Over Time")
-        fig1 = px.line(
-            waiting_list_specialty_df,
-            x='month',
-            y=['additions', 'removals'],
-            labels={'value': 'Number of Patients', 'variable': 'Legend'},
+        fig1 = charts.figure(
+            [
+                charts.line(
+                    waiting_list_specialty_df['month'],
+                    waiting_list_specialty_df[column],
+                    column,
+                    line=dict(color=color_map[column], width=3)
+                )
+                for column in ['additions', 'removals']
+            ],
             title='Additions and Removals from Waiting List',
             height=600,
-            color_discrete_map=color_map
+            x_title='month',
+            y_title='Number of Patients',
+            legend_title='Legend'
         )
 
-        fig1.update_traces(line=dict(width=3))
-
-        # Display fig1 before the baseline date selections
-        fig1_placeholder = st.empty()
-        fig1_placeholder.plotly_chart(fig1, use_container_width=True)
+        # fig1 sits above the baseline date selections but is drawn once they are known
+        fig1_container = st.container()
 
         ### **2. Baseline Period Selection**
         st.subheader("Baseline Period Selection")
@@ -84,12 +491,12 @@ if st.session_state.referral_df is not None and st.session_state.appointment_df
         with col1:
             baseline_start_date = st.date_input(
                 'Baseline Start Date',
-                value = max_date - pd.DateOffset(months=5)
+                value = st.session_state.get('baseline_start_date', max_date - pd.DateOffset(months=5))
             )
         with col2:
             baseline_end_date = st.date_input(
                 'Baseline End Date',
-                value = max_date
+                value = st.session_state.get('baseline_end_date', max_date)
             )
 
         # Convert selected dates to datetime
@@ -98,14 +505,10 @@ if st.session_state.referral_df is not None and st.session_state.appointment_df
 
         baseline_months = (baseline_end_date.year - baseline_start_date.year) * 12 + (baseline_end_date.month - baseline_start_date.month)
         
-        if 'baseline_start_date' not in st.session_state:
-            st.session_state.baseline_start_date = baseline_start_date
-
-        if 'baseline_end_date' not in st.session_state:
-            st.session_state.baseline_end_date = baseline_end_date
-
-        if 'baseline_months' not in st.session_state:
-            st.session_state.baseline_months = baseline_months
+        # Kept up to date so the quantities derived on other pages follow the selected baseline
+        st.session_state.baseline_start_date = baseline_start_date
+        st.session_state.baseline_end_date = baseline_end_date
+        st.session_state.baseline_months = baseline_months
         
         # Update fig1 to highlight the baseline period if dates are selected
         if baseline_start_date != baseline_end_date:
@@ -127,337 +530,13 @@ if st.session_state.referral_df is not None and st.session_state.appointment_df
                     showlegend=True
                 )
             )
-            # Re-display fig1 with the baseline highlight
-            fig1_placeholder.plotly_chart(fig1, use_container_width=True)
-
-        ### **3. Waiting List Over Time Plot (fig2)**
-        st.subheader("Total Size of the Waiting List Over Time")
-
-        # Initialize fig2 without predictions
-        fig2 = px.line(
-            waiting_list_specialty_df,
-            x='month',
-            y='waiting_list',
-            labels={'waiting_list': 'Total Waiting List'},
-            title='Total Size of the Waiting List',
-            height=600,
-            color_discrete_map=color_map
-        )
-        fig2.update_traces(line=dict(width=3))
-        
-        # Display fig2
-        fig2_placeholder = st.empty()
-        fig2_placeholder.plotly_chart(fig2, use_container_width=True)
-
-        st.write("""
-        Select the date from which you want the model to start predicting the waiting list size. This date should be after the latest month in the data.
-        """)
-
-        # Get the maximum date from the DataFrame
-        max_date = waiting_list_specialty_df['month'].max()
-        
-        # Calculate the next March after max_date
-        if max_date.month >= 3:
-            next_march_year = max_date.year + 1
-        else:
-            next_march_year = max_date.year
-        
-        # Set the last day of March as the default value
-        default_model_start_date = pd.Timestamp(year=next_march_year, month=3, day=31)
-        
-        # Check if 'model_start_date' is already in session state
-        if 'model_start_date' not in st.session_state:
-            # Initialize with default value if not set
-            st.session_state.model_start_date = default_model_start_date
-        
-        col1, _, _ = st.columns(3)
-        with col1:
-            # Use the value from session state for the date input
-            model_start_date = st.date_input(
-                'Start Date for Modeling',
-                value=st.session_state.model_start_date
-            )
-        
-        # Update session state with the selected date
-        st.session_state.model_start_date = model_start_date
-        
-        # Convert modeling start date to datetime
-        model_start_date = pd.to_datetime(st.session_state.model_start_date).to_period('M').to_timestamp('M')
 
+        fig1_container.plotly_chart(fig1, use_container_width=True)
 
-        
-        # Latest month in the data
-        latest_month_in_data = waiting_list_specialty_df['month'].max()
-
-        ### **5. Add Prediction Line to fig2 and Print Prediction Message**
-        if model_start_date > latest_month_in_data:
-            # Calculate the number of months to predict
-            num_future_months = (model_start_date.year - latest_month_in_data.year) * 12 + \
-                                (model_start_date.month - latest_month_in_data.month)
-
-            # Proceed with prediction if the number of months is positive
-            if num_future_months > 0:
-                # Filter the baseline data
-                baseline_data = waiting_list_specialty_df[
-                    (waiting_list_specialty_df['month'] >= baseline_start_date) &
-                    (waiting_list_specialty_df['month'] <= baseline_end_date)
-                ]
+        projection_section(selected_specialty, waiting_list_specialty_df, baseline_start_date, baseline_end_date)
 
-                if baseline_data.empty:
-                    st.error("No data available in the selected baseline period.")
-                else:
-                    # Get the last known total waiting list size
-                    last_total_waiting_list = waiting_list_specialty_df.iloc[-1]['waiting_list']
-
-                    # Create date range for future months, including the modeling start date
-                    future_months = pd.date_range(
-                        start=latest_month_in_data + pd.offsets.MonthEnd(1),
-                        end=model_start_date,
-                        freq='M'
-                    )
-
-                    
-                    # Initialize a DataFrame to store total waiting list sizes for each simulation
-                    simulation_results = pd.DataFrame({'month': future_months})
-
-                    num_simulations = 100
-                    
-                    for sim in range(num_simulations):
-                        current_total = last_total_waiting_list
-                        predicted_totals = []
-                        for month in future_months:
-                            sampled_addition = baseline_data['additions'].sample(n=1).values[0]
-                            sampled_removal = baseline_data['removals'].sample(n=1).values[0]
-                            current_total = current_total + sampled_addition - sampled_removal
-                            predicted_totals.append(current_total)
-                        # Add the predicted totals to the DataFrame
-                        simulation_results[f'simulation_{sim+1}'] = predicted_totals
-                    
-                    # Calculate percentiles for the predictions
-                    percentiles = [5, 25, 50, 75, 95]
-                    percentile_values = simulation_results.filter(like='simulation_').quantile(q=[p/100 for p in percentiles], axis=1).T
-                    percentile_values.columns = [f'percentile_{p}' for p in percentiles]
-    
-                    # Merge percentiles with simulation_results
-                    simulation_results = pd.concat([simulation_results[['month']], percentile_values], axis=1)
-    
-                    # Use the 50th percentile (median) as the average prediction
-                    predictions_df = simulation_results[['month', 'percentile_50']].rename(columns={'percentile_50': 'waiting_list'})
-                    predictions_df['Data Type'] = 'Predicted'
-
-                    # Prepare combined data
-                    actual_data = waiting_list_specialty_df.copy()
-                    actual_data['Data Type'] = 'Actual'
-
-                    combined_df = pd.concat([actual_data, predictions_df], ignore_index=True)
-
-                    # Update fig2 with predictions
-                    fig2 = px.line(
-                        combined_df,
-                        x='month',
-                        y='waiting_list',
-                        color='Data Type',
-                        line_dash='Data Type',
-                        labels={'waiting_list': 'Total Waiting List', 'month': 'Month'},
-                        title='Total Size of the Waiting List with Predictions',
-                        height=600,
-                        color_discrete_map=color_map
-                    )
-                    fig2.update_traces(line=dict(width=3))
-                    
-                    # Add shaded areas for the percentiles
-                    fig2.add_traces([
-                        go.Scatter(
-                            name='5th-95th Percentile',
-                            x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                            y=simulation_results['percentile_95'].tolist() + simulation_results['percentile_5'][::-1].tolist(),
-                            fill='toself',
-                            fillcolor='rgba(200, 200, 200, 0.2)',
-                            line=dict(color='rgba(255,255,255,0)'),
-                            hoverinfo="skip",
-                            showlegend=True
-                        ),
-                        go.Scatter(
-                            name='25th-75th Percentile',
-                            x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                            y=simulation_results['percentile_75'].tolist() + simulation_results['percentile_25'][::-1].tolist(),
-                            fill='toself',
-                            fillcolor='rgba(160, 160, 160, 0.3)',
-                            line=dict(color='rgba(255,255,255,0)'),
-                            hoverinfo="skip",
-                            showlegend=True
-                        )
-                    ])
-                    
-                    # Customize line styles
-                    fig2.update_traces(
-                        line=dict(width=3),
-                        selector=dict(mode='lines')
-                    )
-
-                    fig2.update_traces(
-                        line=dict(dash='dash', width=4),
-                        selector=dict(name='Predicted')
-                    )
-
-                    # Re-display fig2 with predictions
-                    fig2_placeholder.plotly_chart(fig2, use_container_width=True)
-
-                    # Access the percentile values for the last predicted month
-                    last_month_data = simulation_results.iloc[-1]
-                    percentile_5 = last_month_data['percentile_5']
-                    percentile_25 = last_month_data['percentile_25']
-                    percentile_50 = last_month_data['percentile_50']  # Median
-                    percentile_75 = last_month_data['percentile_75']
-                    percentile_95 = last_month_data['percentile_95']
-                    
-                    # Display the prediction in larger font
-                    st.markdown(f"### Predicted Waiting List Size: **{percentile_50:.0f}**")
-                    
-                    st.write(f"""
-                    - **Prediction Date:** {model_start_date.strftime('%b %Y')}
-                    - **Expected Range (50% probability):** {percentile_25:.0f} to {percentile_75:.0f}
-                    - **Expected Range (90% probability):** {percentile_5:.0f} to {percentile_95:.0f}
-                    """)
-                    st.write(f"This will be the starting position for modelling the impact of future capacity.")
-                    st.session_state['waiting_list_start'] = percentile_50
-                    
         st.write(f"")
-        ### **6. Validation of Prediction Methodology**
-        st.subheader("Validation of Total Waiting List Prediction Methodology")
-        
-        st.write("""
-        This section validates the prediction methodology by using data from the 6 months before the baseline period to predict the baseline period. 
-        The results are averaged over multiple simulations, with the mean prediction plotted as a line, and the 50th and 95th percentiles displayed as shaded areas.
-        The entire historic waiting list data is also included in the chart for context.
-        """)
-        
-        # Define the validation period (6 months before baseline start)
-        validation_start_date = baseline_start_date - pd.DateOffset(months=12)
-        validation_end_date = baseline_start_date - pd.DateOffset(months=1)
-        
-        # Filter validation data
-        validation_data = waiting_list_specialty_df[
-            (waiting_list_specialty_df['month'] >= validation_start_date) &
-            (waiting_list_specialty_df['month'] <= validation_end_date)
-        ]
-        
-        if validation_data.empty:
-            st.error("No data available in the validation period.")
-        else:
-            # Filter baseline data
-            actual_baseline_data = waiting_list_specialty_df[
-                (waiting_list_specialty_df['month'] >= baseline_start_date) &
-                (waiting_list_specialty_df['month'] <= baseline_end_date)
-            ]
-            
-            # Initialize a DataFrame to store predictions for each simulation
-            simulation_results = pd.DataFrame({'month': actual_baseline_data['month']})
-            num_simulations = 100  # Number of simulations
-        
-            for sim in range(num_simulations):
-                current_total = validation_data.iloc[-1]['waiting_list']  # Last total from validation period
-                simulated_totals = []
-                for _, row in actual_baseline_data.iterrows():
-                    sampled_addition = validation_data['additions'].sample(n=1).values[0]
-                    sampled_removal = validation_data['removals'].sample(n=1).values[0]
-                    current_total = current_total + sampled_addition - sampled_removal
-                    simulated_totals.append(current_total)
-                simulation_results[f'simulation_{sim + 1}'] = simulated_totals
-        
-            # Calculate percentiles and mean
-            percentiles = [5, 25, 50, 75, 95]
-            percentile_values = simulation_results.filter(like='simulation_').quantile(
-                q=[p / 100 for p in percentiles], axis=1).T
-            percentile_values.columns = [f'percentile_{p}' for p in percentiles]
-            simulation_results = pd.concat([simulation_results[['month']], percentile_values], axis=1)
-        
-            # Include all historic waiting list data
-            historic_data = waiting_list_specialty_df[['month', 'waiting_list']].rename(
-                columns={'waiting list': 'Historic Total Waiting List'}
-            )
-        
-            # Combine data for visualization
-            actual_baseline = actual_baseline_data[['month', 'waiting_list']].rename(
-                columns={'waiting list': 'Actual Total Waiting List'}
-            )
-            comparison_df = pd.merge(
-                historic_data, actual_baseline, on='month', how='outer'
-            )
-        
-            # Plot all data and percentiles
-            st.subheader("Comparison of Historic, Actual Baseline, and Predicted Baseline")
-            fig_validation = px.line(
-                comparison_df.melt(id_vars='month', var_name='Data Type', value_name='Total Waiting List'),
-                x='month',
-                y='Total Waiting List',
-                color='Data Type',
-                labels={'Total Waiting List': 'Total Waiting List', 'month': 'Month'},
-                title='Validation of Baseline Prediction Methodology',
-                height=600,
-                color_discrete_map=color_map
-            )
-
-            fig_validation.update_traces(line=dict(width=3))
-        
-            # Add shaded areas for percentiles
-            fig_validation.add_traces([
-                go.Scatter(
-                    name='5th-95th Percentile',
-                    x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                    y=simulation_results['percentile_95'].tolist() + simulation_results['percentile_5'][::-1].tolist(),
-                    fill='toself',
-                    fillcolor='rgba(200, 200, 200, 0.2)',
-                    line=dict(color='rgba(255,255,255,0)'),
-                    hoverinfo="skip",
-                    showlegend=True
-                ),
-                go.Scatter(
-                    name='25th-75th Percentile',
-                    x=simulation_results['month'].tolist() + simulation_results['month'][::-1].tolist(),
-                    y=simulation_results['percentile_75'].tolist() + simulation_results['percentile_25'][::-1].tolist(),
-                    fill='toself',
-                    fillcolor='rgba(160, 160, 160, 0.3)',
-                    line=dict(color='rgba(255,255,255,0)'),
-                    hoverinfo="skip",
-                    showlegend=True
-                )
-            ])
-        
-            # Add mean prediction line
-            fig_validation.add_trace(
-                go.Scatter(
-                    name='Mean Prediction',
-                    x=simulation_results['month'],
-                    y=simulation_results['percentile_50'],
-                    mode='lines',
-                    line=dict(color='#f5136f', width=3, dash='dash')
-                )
-            )
-            
-            st.plotly_chart(fig_validation, use_container_width=True)
-        
-            # Calculate evaluation metrics
-            comparison_actual_predicted = pd.merge(
-                actual_baseline_data,
-                simulation_results[['month', 'percentile_50']].rename(columns={'percentile_50': 'Predicted Total Waiting List'}),
-                on='month'
-            )
-            mae = (comparison_actual_predicted['waiting_list'] - comparison_actual_predicted['Predicted Total Waiting List']).abs().mean()
-            mse = ((comparison_actual_predicted['waiting_list'] - comparison_actual_predicted['Predicted Total Waiting List']) ** 2).mean()
-        
-            st.write(f"**Mean Absolute Error (MAE):** {mae:.2f}")
-            st.write(f"**Mean Squared Error (MSE):** {mse:.2f}")
-            st.write("""
-            A lower MAE and MSE indicate better predictive accuracy. Use this information to assess the reliability of the model.
-            """)
-            
-            # Compare final month mean prediction to actual value
-            final_month = comparison_actual_predicted.iloc[-1]
-            final_actual = final_month['waiting_list']
-            final_predicted = final_month['Predicted Total Waiting List']
-            st.write(f"**Final Month Comparison:** The actual value for the final month is {final_actual:.0f}, "
-                     f"Mean predicted value is {final_predicted:.0f}.")
+        validation_section(selected_specialty, waiting_list_specialty_df, baseline_start_date, baseline_end_date)
 
     else:
         st.error("Uploaded files do not contain the required columns.")
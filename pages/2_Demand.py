@@ -2,8 +2,43 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from scipy.stats import linregress
-import numpy as np
+
+from demand_capacity import charts
+from demand_capacity.capacity import appointment_totals, follow_up_ratios
+from demand_capacity.data import specialty_view
+from demand_capacity.demand import (
+    AVERAGE_MODEL, REGRESSION_MODEL, filter_months, month_count, rolling_origin_backtest, summarise_backtest
+)
+from demand_capacity.derived import state_evaluator
+from demand_capacity.refresh import window_totals
+from demand_capacity.seasonal import (
+    HOLT_WINTERS_MODEL, INTERVAL_LEVEL, MIN_MONTHS, SEASONAL_MODELS, SEASONAL_NAIVE_MODEL, SEASONAL_REGRESSION_MODEL
+)
+
+# Labels shown for each prediction model
+MODEL_LABELS = {
+    AVERAGE_MODEL: "Average (Baseline)",
+    REGRESSION_MODEL: "Regression",
+    SEASONAL_NAIVE_MODEL: "Seasonal Naive",
+    HOLT_WINTERS_MODEL: "Holt-Winters",
+    SEASONAL_REGRESSION_MODEL: "Seasonal Regression",
+}
+
+# Page name in figure cache keys
+PAGE = 'demand'
+
+# Forecast horizons (months) offered for the rolling-origin backtest
+BACKTEST_HORIZONS = [3, 6, 12]
+
+# Backtests kept in the cache; the least recently used are evicted first
+MAX_CACHED_BACKTESTS = 64
+
+
+# Arguments starting with an underscore are not hashed: the specialty and data
+# fingerprint identify them, so a rerun looks up the key instead of hashing frames
+@st.cache_data(max_entries=MAX_CACHED_BACKTESTS, show_spinner=False)
+def backtest_models(specialty, horizon, fingerprint, _specialty_df):
+    return rolling_origin_backtest(_specialty_df, horizon=horizon)
 
 st.title("Referral Demand Analysis")
 
@@ -15,10 +50,15 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
     if all(column in referral_df.columns for column in required_columns):
         selected_specialty = st.session_state.selected_specialty
 
-        # Filter referral data based on selected specialty
-        specialty_referral_df = referral_df[referral_df['specialty'] == selected_specialty].copy()
-        specialty_referral_df['month'] = pd.to_datetime(specialty_referral_df['month']).dt.to_period('M').dt.to_timestamp('M')
-        specialty_referral_df.sort_values('month', inplace=True)
+        # Fits and forecasts are derived lazily and cached per input (see demand_capacity.derived)
+        derive = state_evaluator(st.session_state)
+        fingerprint = st.session_state.get('referral_fingerprint')
+
+        # Charts are rebuilt only when the inputs in their cache key change
+        figure_cache = charts.state_figure_cache(st.session_state)
+
+        # Referral data for the selected specialty (month-end dates, sorted by month)
+        specialty_referral_df = specialty_view(st.session_state.referral_index, selected_specialty)
 
         
         st.subheader(f"Referral Trends for {selected_specialty}")
@@ -38,28 +78,31 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
         baseline_end = pd.to_datetime(baseline_end).to_period('M').to_timestamp('M')
 
         # Filter the referral data based on the selected baseline period
-        baseline_referral_df = specialty_referral_df[(specialty_referral_df['month'] >= baseline_start) & (specialty_referral_df['month'] <= baseline_end)]
+        baseline_referral_df = filter_months(specialty_referral_df, baseline_start, baseline_end)
 
         # Plot referral trends and highlight the baseline period
-        fig = px.line(
-            specialty_referral_df,
-            x='month',
-            y='additions',
-            labels={'additions': 'Number of Referrals'},
-            title=f'Referrals Over Time for {selected_specialty}'
-        )
-
-        if baseline_start != baseline_end:
-            fig.add_vrect(
-                x0=baseline_start,
-                x1=baseline_end,
-                fillcolor="LightGrey",
-                opacity=0.5,
-                layer="below",
-                line_width=0,
+        def referrals_figure():
+            fig = charts.figure(
+                [charts.line(specialty_referral_df['month'], specialty_referral_df['additions'], 'Referrals')],
+                title=f'Referrals Over Time for {selected_specialty}',
+                x_title='month',
+                y_title='Number of Referrals'
             )
-
-        st.plotly_chart(fig, use_container_width=True)
+            if baseline_start != baseline_end:
+                fig.add_vrect(
+                    x0=baseline_start,
+                    x1=baseline_end,
+                    fillcolor="LightGrey",
+                    opacity=0.5,
+                    layer="below",
+                    line_width=0,
+                )
+            return fig
+
+        st.plotly_chart(
+            charts.cached_figure(figure_cache, PAGE, 'referrals', (fingerprint, selected_specialty, baseline_start, baseline_end), referrals_figure),
+            use_container_width=True
+        )
 
 
 
@@ -70,128 +113,133 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
 
 
         
-        # Display baseline period
-        baseline_start = st.session_state.baseline_start_date
-        baseline_end = st.session_state.baseline_end_date
-        num_baseline_months = (pd.to_datetime(baseline_end).to_period('M') - pd.to_datetime(baseline_start).to_period('M')).n + 1
-
-        # Filter data for the baseline period
-        baseline_df = specialty_referral_df[
-            (specialty_referral_df['month'] >= pd.to_datetime(baseline_start)) &
-            (specialty_referral_df['month'] <= pd.to_datetime(baseline_end))
-        ]
+        # Display baseline period (set on the Historic Waiting List page, or the default)
+        baseline_start = derive('baseline_start')
+        baseline_end = derive('baseline_end')
 
         # Display total and scaled baseline referrals
-        total_baseline_additions = baseline_df['additions'].sum()
-        baseline_scaled_additions = (total_baseline_additions / num_baseline_months) * 12
+        # Running totals for the specialty, so window sums and the trend are looked up rather than re-summed
+        specialty_totals = st.session_state.referral_totals.get(selected_specialty)
+        total_baseline_additions = window_totals(specialty_totals, baseline_start, baseline_end)['additions'] if specialty_totals is not None else 0
         st.write(f"**Total Baseline Referrals ({baseline_start:%Y-%m} to {baseline_end:%Y-%m}):** {total_baseline_additions:.0f}")
         # Extrapolate baseline referrals to a year's worth
         if not baseline_referral_df.empty:
-            num_baseline_months = (baseline_end.year - baseline_start.year) * 12 + (baseline_end.month - baseline_start.month) + 1
             total_referrals_baseline = baseline_referral_df['additions'].sum()
-            baseline_yearly_referrals = (total_referrals_baseline / num_baseline_months) * 12
+            baseline_yearly_referrals = (total_referrals_baseline / month_count(baseline_start, baseline_end)) * 12
             st.write(f"**Total Referrals (12-Month Equivalent):** {baseline_yearly_referrals:.0f}")        
 
         # --- Analyze Model Fit ---
         st.subheader("Model Fit: Baseline Average vs. Trend Line")
-        pre_baseline_df = specialty_referral_df[
-            (specialty_referral_df['month'] < pd.to_datetime(baseline_start))
-        ].tail(12)  # Use the last 12 months before the baseline
+        fit = derive('demand_fit')
 
-        if pre_baseline_df.empty or pre_baseline_df.shape[0] < 2:
+        if fit is None:
             st.warning("Not enough data points before the baseline period to perform regression analysis.")
         else:
-            # Perform regression on pre-baseline data
-            pre_months_ordinal = pre_baseline_df['month'].map(pd.Timestamp.toordinal)
-            slope, intercept, _, _, _ = linregress(pre_months_ordinal, pre_baseline_df['additions'])
+            # Plot baseline fit
+            def fit_figure():
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(x=fit['months'], y=fit['actual'], mode='lines+markers', name='Actual Demand'))
+                fig.add_trace(go.Scatter(x=fit['months'], y=fit['predicted_average'], mode='lines', name='Predicted (Average)', line=dict(dash='dash')))
+                fig.add_trace(go.Scatter(x=fit['months'], y=fit['predicted_regression'], mode='lines', name='Predicted (Regression)', line=dict(dash='dot')))
+                return fig
+
+            st.plotly_chart(
+                charts.cached_figure(figure_cache, PAGE, 'model_fit', (fingerprint, selected_specialty, baseline_start, baseline_end), fit_figure),
+                use_container_width=True
+            )
 
-            # Predict baseline demand using regression
-            baseline_months_ordinal = baseline_df['month'].map(pd.Timestamp.toordinal)
-            predicted_regression = intercept + slope * baseline_months_ordinal
-            predicted_average = [baseline_scaled_additions / 12] * len(baseline_months_ordinal)
+            # Determine best fit
+            st.write(f"**Mean Absolute Error (Regression):** {fit['error_regression']:.2f}")
+            st.write(f"**Mean Absolute Error (Average):** {fit['error_average']:.2f}")
+            st.write(f"**Best Fit Model:** {'Average' if fit['best_model'] == AVERAGE_MODEL else 'Regression'}")
+        # --- Rolling-Origin Backtest ---
+        st.subheader("Rolling-Origin Backtest")
+        st.write(
+            "Both models are refitted from every possible forecast start, using every baseline length that fits before it, "
+            "and scored on the following months."
+        )
+        horizon = st.selectbox("Forecast horizon (months)", BACKTEST_HORIZONS, index=len(BACKTEST_HORIZONS) - 1)
+        backtest = backtest_models(selected_specialty, horizon, fingerprint, specialty_referral_df)
 
-            # Calculate errors
-            actual_baseline = baseline_df['additions']
-            error_regression = np.mean(np.abs(actual_baseline - predicted_regression))
-            error_average = np.mean(np.abs(actual_baseline - predicted_average))
+        if backtest.empty:
+            st.warning("Not enough data to backtest the models over this horizon.")
+        else:
+            backtest_summary = summarise_backtest(backtest)
+
+            def backtest_figure():
+                fig = go.Figure()
+                fig.add_trace(go.Scatter(x=backtest_summary['window'], y=backtest_summary['error_average'], mode='lines+markers', name=MODEL_LABELS[AVERAGE_MODEL]))
+                fig.add_trace(go.Scatter(x=backtest_summary['window'], y=backtest_summary['error_regression'], mode='lines+markers', name=MODEL_LABELS[REGRESSION_MODEL]))
+                fig.update_layout(
+                    title=f'Mean Absolute Error by Baseline Length ({horizon}-Month Horizon)',
+                    xaxis_title='Baseline Length (Months)',
+                    yaxis_title='Mean Absolute Error'
+                )
+                return fig
+
+            st.plotly_chart(
+                charts.cached_figure(figure_cache, PAGE, 'backtest', (fingerprint, selected_specialty, horizon), backtest_figure),
+                use_container_width=True
+            )
 
-            # Plot baseline fit
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=baseline_df['month'], y=actual_baseline, mode='lines+markers', name='Actual Demand'))
-            fig.add_trace(go.Scatter(x=baseline_df['month'], y=predicted_average, mode='lines', name='Predicted (Average)', line=dict(dash='dash')))
-            fig.add_trace(go.Scatter(x=baseline_df['month'], y=predicted_regression, mode='lines', name='Predicted (Regression)', line=dict(dash='dot')))
-            st.plotly_chart(fig, use_container_width=True)
+            average_win_rate = (backtest['best_model'] == AVERAGE_MODEL).mean()
+            st.write(f"**Average (Baseline) is more accurate in {average_win_rate:.0%} of {len(backtest)} backtests.**")
+            st.dataframe(
+                backtest_summary.rename(columns={
+                    'window': 'Baseline Length (Months)',
+                    'origins': 'Forecast Starts',
+                    'error_average': 'MAE (Average)',
+                    'error_regression': 'MAE (Regression)',
+                    'average_win_rate': 'Average Better (Share)',
+                }),
+                hide_index=True
+            )
 
-            # Determine best fit
-            st.write(f"**Mean Absolute Error (Regression):** {error_regression:.2f}")
-            st.write(f"**Mean Absolute Error (Average):** {error_average:.2f}")
-            best_fit = "Average" if error_average < error_regression else "Regression"
-            st.write(f"**Best Fit Model:** {best_fit}")
         # --- Choose Prediction Model ---
         st.subheader("Choose Prediction Model")
+        model_options = [AVERAGE_MODEL, REGRESSION_MODEL] if fit is not None else [AVERAGE_MODEL]
+        # Seasonal models are fitted on the whole history up to the end of the baseline
+        history_months = (specialty_referral_df['month'] <= baseline_end).sum()
+        model_options += [model for model in SEASONAL_MODELS if history_months >= MIN_MONTHS[model]]
         selected_model = st.radio(
             "Select the model to generate the predicted trend for the next 12 months:",
-            options=["Average (Baseline)", "Regression"],
-            index=0 if error_average < error_regression else 1
+            options=model_options,
+            format_func=MODEL_LABELS.get,
+            index=model_options.index(fit['best_model']) if fit is not None else 0
         )
+        # The other pages derive their demand from the chosen model
+        st.session_state.demand_model = selected_model
 
         # --- Predict Future Demand ---
         st.subheader("Predict Future Demand")
-        future_months = pd.date_range(start=pd.to_datetime(st.session_state.model_start_date), periods=12, freq='M')
-        if selected_model == "Average (Baseline)":
-            future_predictions = [baseline_scaled_additions / 12] * len(future_months)
-        else:
-            future_months_ordinal = future_months.map(pd.Timestamp.toordinal)
-            future_predictions = intercept + slope * future_months_ordinal
-
-        # Create DataFrame for future predictions
-        future_df = pd.DataFrame({
-            'month': future_months,
-            'predicted_demand': future_predictions
-        })
-        forecasted_total = future_df['predicted_demand'].sum()
-        st.session_state.forecasted_total = forecasted_total
+        future_df = derive('demand_forecast')
+        forecasted_total = derive('forecasted_total')
         # Display future predictions
         st.write(f"**Total Predicted Demand for Next 12 Months:** {forecasted_total:.0f}")
 
         # Plot future predictions
-        fig_future = go.Figure()
-        fig_future.add_trace(go.Scatter(x=specialty_referral_df['month'], y=specialty_referral_df['additions'], mode='lines+markers', name='Historical Demand'))
-        fig_future.add_trace(go.Scatter(x=future_df['month'], y=future_df['predicted_demand'], mode='lines+markers', name='Predicted Demand'))
-        st.plotly_chart(fig_future, use_container_width=True)
+        def future_figure():
+            future_traces = [charts.line(specialty_referral_df['month'], specialty_referral_df['additions'], 'Historical Demand', mode='lines+markers')]
+            if 'lower' in future_df.columns:
+                future_traces.append(charts.band(future_df['month'], future_df['lower'], future_df['upper'], f'{INTERVAL_LEVEL:.0%} Prediction Interval', 'rgba(0, 100, 255, 0.2)'))
+            future_traces.append(charts.line(future_df['month'], future_df['predicted_demand'], 'Predicted Demand', mode='lines+markers'))
+            return charts.figure(future_traces)
+
+        future_inputs = (fingerprint, selected_specialty, derive('demand_model'), baseline_start, baseline_end, derive('model_start_date'))
+        st.plotly_chart(charts.cached_figure(figure_cache, PAGE, 'forecast', future_inputs, future_figure), use_container_width=True)
 
         # --- Analyze Appointments for Removals ---
         st.subheader("Appointments to Stop a Clock")
-        appointment_df = st.session_state.appointment_df
-        referral_df = referral_df[referral_df['specialty'] == selected_specialty]
-        appointment_df = appointment_df[appointment_df['specialty'] == selected_specialty]
-
-        # Convert 'month' to datetime
-        referral_df['month'] = pd.to_datetime(referral_df['month']).dt.to_period('M').dt.to_timestamp('M')
-        appointment_df['month'] = pd.to_datetime(appointment_df['month']).dt.to_period('M').dt.to_timestamp('M')
+        appointment_df = specialty_view(st.session_state.appointment_index, selected_specialty)
 
         # Baseline period for appointments to stop a clock
         baseline_start = pd.to_datetime("2023-04-01").to_period('M').to_timestamp('M')
         baseline_end = pd.to_datetime("2024-03-31").to_period('M').to_timestamp('M')
 
-        baseline_appointment_df = appointment_df[
-            (appointment_df['month'] >= baseline_start) &
-            (appointment_df['month'] <= baseline_end)
-        ]
-        # Group by appointment_type and sum appointments_for_removals
-        appointment_totals = baseline_appointment_df.groupby('appointment_type')['appointments_for_removals'].sum()
-        
-        # Order the appointment types
-        appointment_order = ['RTT First', 'RTT Follow-up', 'Non-RTT']
-        appointment_totals = appointment_totals.reindex(appointment_order).fillna(0)
-
-        # Calculate ratios
-        rtt_first = appointment_totals.get('RTT First', 0)
-        rtt_followup = appointment_totals.get('RTT Follow-up', 0)
-        non_rtt = appointment_totals.get('Non-RTT', 0)
-
-        first_to_followup_ratio = rtt_followup / rtt_first if rtt_first > 0 else None
-        first_to_all_followup_ratio = (rtt_followup + non_rtt) / rtt_first if rtt_first > 0 else None
+        # Total appointments_for_removals by appointment type and calculate ratios
+        appointment_totals_for_removals = appointment_totals(appointment_df, baseline_start, baseline_end, 'appointments_for_removals')
+        first_to_followup_ratio, first_to_non_rtt_ratio = follow_up_ratios(appointment_totals_for_removals)
+        first_to_all_followup_ratio = first_to_followup_ratio + first_to_non_rtt_ratio if first_to_followup_ratio is not None else None
 
         # Display ratios
         st.write(f"**Baseline Period (April 2023 - March 2024):**")
@@ -203,7 +251,7 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
         st.subheader("Future Appointment Needs")
         
         # Assume one RTT First appointment per referral and use ratios to calculate follow-ups
-        predicted_yearly_referrals = st.session_state.forecasted_total  # From referral predictions
+        predicted_yearly_referrals = forecasted_total  # From referral predictions
         rtt_followup_needed = predicted_yearly_referrals * first_to_followup_ratio if first_to_followup_ratio else 0
         non_rtt_needed = predicted_yearly_referrals * (first_to_all_followup_ratio - first_to_followup_ratio) if first_to_all_followup_ratio else 0
 
@@ -215,21 +263,28 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
 
         # --- Chart for Future Appointment Needs ---
         st.subheader("Appointments Needed by Type (Next 12 Months)")
-        future_appointments = pd.DataFrame({
-            'Appointment Type': ['RTT First', 'RTT Follow-Up', 'Non-RTT'],
-            'Appointments Needed': [predicted_yearly_referrals, rtt_followup_needed, non_rtt_needed]
-        })
-
-        fig = px.bar(
-            future_appointments,
-            x='Appointment Type',
-            y='Appointments Needed',
-            title="Appointments Needed by Type (Next 12 Months)",
-            labels={'Appointments Needed': 'Appointments'},
-            text='Appointments Needed'
+        appointments_needed = (predicted_yearly_referrals, rtt_followup_needed, non_rtt_needed)
+
+        def appointments_figure():
+            future_appointments = pd.DataFrame({
+                'Appointment Type': ['RTT First', 'RTT Follow-Up', 'Non-RTT'],
+                'Appointments Needed': list(appointments_needed)
+            })
+            fig = px.bar(
+                future_appointments,
+                x='Appointment Type',
+                y='Appointments Needed',
+                title="Appointments Needed by Type (Next 12 Months)",
+                labels={'Appointments Needed': 'Appointments'},
+                text='Appointments Needed'
+            )
+            fig.update_traces(texttemplate='%{text:.0f}', textposition='outside')
+            return fig
+
+        st.plotly_chart(
+            charts.cached_figure(figure_cache, PAGE, 'appointments_needed', tuple(map(float, appointments_needed)), appointments_figure),
+            use_container_width=True
         )
-        fig.update_traces(texttemplate='%{text:.0f}', textposition='outside')
-        st.plotly_chart(fig, use_container_width=True)
 
     
     else:
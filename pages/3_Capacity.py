@@ -1,8 +1,24 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+from demand_capacity import charts
+from demand_capacity.capacity import (
+    BASELINE_DNA_RATE, BASELINE_UTILISATION_RATE, adjusted_attended, attended_grid, follow_up_ratios,
+    required_capacity
+)
+from demand_capacity.data import specialty_view
+from demand_capacity.derived import specialty_values, state_evaluator
+
+# Page name in figure cache keys
+PAGE = 'capacity'
+
+# Rates evaluated in the utilisation x DNA grid
+GRID_UTILISATION_RATES = np.arange(50, 101) / 100
+GRID_DNA_RATES = np.arange(0, 31) / 100
+
 st.title("Capacity Analysis")
 
 # Ensure necessary session state data is available
@@ -21,14 +37,9 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
     if all(column in referral_df.columns for column in referral_required_columns) and \
        all(column in appointment_df.columns for column in appointment_required_columns):
 
-        # Filter data for selected specialty
-        specialty_referral_df = referral_df[referral_df['specialty'] == selected_specialty].copy()
-        specialty_appointment_df = appointment_df[appointment_df['specialty'] == selected_specialty].copy()
-
-        # Convert 'month' to datetime and set as month-end
-        specialty_referral_df['month'] = pd.to_datetime(specialty_referral_df['month']).dt.to_period('M').dt.to_timestamp('M')
-        specialty_appointment_df['month'] = pd.to_datetime(specialty_appointment_df['month']).dt.to_period('M').dt.to_timestamp('M')
-        specialty_appointment_df.sort_values(by='month', inplace=True)
+        # Data for the selected specialty (month-end dates, sorted by month)
+        specialty_referral_df = specialty_view(st.session_state.referral_index, selected_specialty)
+        specialty_appointment_df = specialty_view(st.session_state.appointment_index, selected_specialty)
 
         # Default baseline period as the last 6 months of available data
         max_date = specialty_appointment_df['month'].max()
@@ -41,59 +52,62 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
 
         col1, col2, _, _ = st.columns(4)  
         with col1:
-           baseline_start = st.date_input('Baseline Start Date', value=default_baseline_start, min_value=specialty_appointment_df['month'].min(), max_value=max_date)
+           baseline_start = st.date_input('Baseline Start Date', value=st.session_state.get('capacity_baseline_start', default_baseline_start), min_value=specialty_appointment_df['month'].min(), max_value=max_date)
         with col2:
-           baseline_end = st.date_input('Baseline End Date', value=max_date, min_value=specialty_appointment_df['month'].min(), max_value=max_date)
+           baseline_end = st.date_input('Baseline End Date', value=st.session_state.get('capacity_baseline_end', max_date), min_value=specialty_appointment_df['month'].min(), max_value=max_date)
 
         # Convert baseline dates to datetime
         baseline_start = pd.to_datetime(baseline_start).to_period('M').to_timestamp('M')
         baseline_end = pd.to_datetime(baseline_end).to_period('M').to_timestamp('M')
 
-        # Filter data based on the selected baseline period
-        baseline_appointment_df = specialty_appointment_df[(specialty_appointment_df['month'] >= baseline_start) & (specialty_appointment_df['month'] <= baseline_end)]
-
-        fig = px.line(
-            specialty_appointment_df,
-            x='month',
-            y='appointments_attended',
-            color='appointment_type',
-            labels={'appointments_attended': 'Number of Appointments Attended', 'appointment_type': 'Appointment Type'},
-            title='Monthly Appointments Attended by Type',
-            color_discrete_sequence=px.colors.qualitative.Safe  # Consistent colors for clarity
-        )
-
-        # Highlight the baseline period in the chart
-        if baseline_start != baseline_end:
-            fig.add_vrect(
-                x0=baseline_start,
-                x1=baseline_end,
-                fillcolor="LightGrey",
-                opacity=0.5,
-                layer="below",
-                line_width=0,
+        # The capacity figures on every page are derived from this baseline (see demand_capacity.derived)
+        st.session_state.capacity_baseline_start = baseline_start
+        st.session_state.capacity_baseline_end = baseline_end
+        derive = state_evaluator(st.session_state)
+
+        # Charts are rebuilt only when the inputs in their cache key change
+        figure_cache = charts.state_figure_cache(st.session_state)
+        fingerprint = st.session_state.get('appointment_fingerprint')
+
+        def appointments_figure():
+            fig = charts.figure(
+                [
+                    charts.line(group['month'], group['appointments_attended'], appointment_type, line=dict(color=color))
+                    for (appointment_type, group), color in zip(
+                        specialty_appointment_df.groupby('appointment_type', observed=True, sort=False),
+                        px.colors.qualitative.Safe  # Consistent colors for clarity
+                    )
+                ],
+                title='Monthly Appointments Attended by Type',
+                x_title='month',
+                y_title='Number of Appointments Attended',
+                legend_title='Appointment Type'
             )
 
-        st.plotly_chart(fig, use_container_width=True)
+            # Highlight the baseline period in the chart
+            if baseline_start != baseline_end:
+                fig.add_vrect(
+                    x0=baseline_start,
+                    x1=baseline_end,
+                    fillcolor="LightGrey",
+                    opacity=0.5,
+                    layer="below",
+                    line_width=0,
+                )
+            return fig
+
+        st.plotly_chart(
+            charts.cached_figure(figure_cache, PAGE, 'appointments', (fingerprint, selected_specialty, baseline_start, baseline_end), appointments_figure),
+            use_container_width=True
+        )
         
         
           
         # Summary of appointments during the baseline period
         st.subheader("Baseline Summary of Appointments Attended (Scaled to 12 Months)")
       
-        # Calculate the number of baseline months
-        num_baseline_months = (baseline_end.year - baseline_start.year) * 12 + (baseline_end.month - baseline_start.month) + 1
-      
-        # Group the baseline data by appointment type and sum the appointments attended
-        baseline_summary = baseline_appointment_df.groupby('appointment_type', observed=False)['appointments_attended'].sum().reset_index()
-      
-        # Scale the appointments to a 12-month equivalent
-        baseline_summary['appointments_attended'] = (baseline_summary['appointments_attended'] / num_baseline_months) * 12
-        baseline_summary['appointments_attended'] = baseline_summary['appointments_attended'].astype(int)
-      
-        # Reorder rows and format titles
-        order = ['RTT First', 'RTT Follow-up', 'Non-RTT']
-        baseline_summary['appointment_type'] = pd.Categorical(baseline_summary['appointment_type'], categories=order, ordered=True)
-        baseline_summary = baseline_summary.sort_values('appointment_type')
+        # Sum the appointments attended by appointment type and scale to a 12-month equivalent
+        baseline_summary = derive('available_capacity').rename_axis('appointment_type').reset_index(name='appointments_attended')
       
         # Calculate grand total for the scaled values
         grand_total_baseline = baseline_summary['appointments_attended'].sum()
@@ -114,42 +128,13 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
         st.subheader("First to Follow-up Ratio Analysis")
       
         # Calculate the RTT First to RTT Follow-up ratio from the displayed table
-        rtt_first_attended = baseline_summary.loc[baseline_summary['appointment_type'] == 'RTT First', 'appointments_attended'].sum()
-        rtt_followup_attended = baseline_summary.loc[baseline_summary['appointment_type'] == 'RTT Follow-up', 'appointments_attended'].sum()
-        non_rtt_attended = baseline_summary.loc[baseline_summary['appointment_type'] == 'Non-RTT', 'appointments_attended'].sum()
-
-        st.session_state.available_rtt_first = rtt_first_attended
-        st.session_state.available_rtt_followup = rtt_followup_attended
-        st.session_state.available_non_rtt = non_rtt_attended
-          
-        if rtt_first_attended > 0:
-            rtt_first_to_followup_ratio_attended = rtt_followup_attended / rtt_first_attended
-        else:
-            rtt_first_to_followup_ratio_attended = None
-
-        if rtt_first_attended > 0:
-            rtt_first_to_non_rtt_ratio_attended = non_rtt_attended / rtt_first_attended
-        else:
-            rtt_first_to_non_rtt_ratio_attended = None          
+        rtt_first_to_followup_ratio_attended, rtt_first_to_non_rtt_ratio_attended = follow_up_ratios(
+            baseline_summary.set_index('appointment_type')['appointments_attended']
+        )
       
-        # Extract appointments for removals
-        appointments_for_removals = baseline_appointment_df.groupby('appointment_type')['appointments_for_removals'].sum().reset_index()
-        rtt_first_removals = appointments_for_removals.loc[appointments_for_removals['appointment_type'] == 'RTT First', 'appointments_for_removals'].sum()
-        rtt_followup_removals = appointments_for_removals.loc[appointments_for_removals['appointment_type'] == 'RTT Follow-up', 'appointments_for_removals'].sum()
-        non_rtt_removals = appointments_for_removals.loc[appointments_for_removals['appointment_type'] == 'Non-RTT', 'appointments_for_removals'].sum()
-          
-        if rtt_first_removals > 0:
-            rtt_first_to_followup_ratio_removals = rtt_followup_removals / rtt_first_removals
-        else:
-            rtt_first_to_followup_ratio_removals = None
-
-        if rtt_first_removals > 0:
-            rtt_first_to_non_rtt_ratio_removals = non_rtt_removals / rtt_first_removals
-        else:
-            rtt_first_to_non_rtt_ratio_removals = None
-
-        st.session_state.first_followup_removals_ratio = rtt_first_to_followup_ratio_removals
-        st.session_state.first_non_rtt_removals_ratio = rtt_first_to_non_rtt_ratio_removals
+        # Ratios of appointments for removals
+        rtt_first_to_followup_ratio_removals = derive('first_followup_removals_ratio')
+        rtt_first_to_non_rtt_ratio_removals = derive('first_non_rtt_removals_ratio')
           
         # Display ratios
         st.write("**RTT First to RTT Follow-up Ratios:**")
@@ -189,7 +174,7 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
         num_baseline_months = (baseline_end.year - baseline_start.year) * 12 + (baseline_end.month - baseline_start.month) + 1
         total_first_appointments = baseline_summary.loc[baseline_summary['appointment_type'] == 'RTT First', 'appointments_attended'].sum()
         total_first_appointments_scaled = baseline_summary.loc[baseline_summary['appointment_type'] == 'RTT First', 'appointments_attended'].sum()
-        total_referrals_scaled = st.session_state['forecasted_total']
+        total_referrals_scaled = derive('forecasted_total')
         st.write(f"**Total Referrals for Next Year (Scaled):** {int(total_referrals_scaled)}")
         st.write(f"**Total RTT First Appointments Attended for Next Year (Scaled):** {int(total_first_appointments_scaled)}")
 
@@ -206,11 +191,11 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
         """)
 
         # Inputs for utilisation and DNA rates
-        baseline_utilisation_rate = 0.85  # Example baseline utilisation rate (e.g., 85%)
-        baseline_dna_rate = 0.1  # Example baseline DNA rate (e.g., 10%)
+        baseline_utilisation_rate = BASELINE_UTILISATION_RATE
+        baseline_dna_rate = BASELINE_DNA_RATE
 
         # Calculate available capacity needed based on utilisation and DNA rates
-        available_capacity = total_first_appointments_scaled / baseline_utilisation_rate / (1 - baseline_dna_rate)
+        available_capacity = required_capacity(total_first_appointments_scaled, baseline_utilisation_rate, baseline_dna_rate)
 
         st.write(f"**Baseline Utilisation Rate:** {baseline_utilisation_rate * 100:.2f}%")
         st.write(f"**Baseline DNA Rate:** {baseline_dna_rate * 100:.2f}%")
@@ -234,7 +219,7 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
         )
 
         # Calculate the number of attended appointments with adjusted rates, capped by available capacity
-        adjusted_attended_appointments = min(available_capacity * adjusted_utilisation_rate * (1 - adjusted_dna_rate), available_capacity)
+        adjusted_attended_appointments = adjusted_attended(available_capacity, adjusted_utilisation_rate, adjusted_dna_rate)
         st.write(f"**Projected Number of Attended Appointments with Adjusted Rates:** {int(adjusted_attended_appointments)}")
 
         if total_referrals_scaled > available_capacity:
@@ -244,64 +229,151 @@ if 'referral_df' in st.session_state and st.session_state.referral_df is not Non
         else:
             st.success("The capacity is sufficient, and the waiting list is expected to reduce.")
               
-        grand_total_data = {
-            'Category': [
-                'Baseline Attended (12-Month)', 
-                'Available Capacity (Baseline Rates)', 
-                'Adjusted Attended (Adjusted Rates)'
-            ],
-            'Appointments': [
-                int(total_first_appointments_scaled), 
-                int(available_capacity), 
-                int(adjusted_attended_appointments)
-            ]
-        }
+        grand_totals = (int(total_first_appointments_scaled), int(available_capacity), int(adjusted_attended_appointments))
+
+        def grand_total_figure():
+            grand_total_data = {
+                'Category': [
+                    'Baseline Attended (12-Month)', 
+                    'Available Capacity (Baseline Rates)', 
+                    'Adjusted Attended (Adjusted Rates)'
+                ],
+                'Appointments': list(grand_totals)
+            }
       
-        grand_total_df = pd.DataFrame(grand_total_data)
+            grand_total_df = pd.DataFrame(grand_total_data)
       
-        # Create bar chart for grand total summary
-        fig_grand_total = px.bar(
-            grand_total_df,
-            x='Category',
-            y='Appointments',
-            labels={'Appointments': 'Number of Appointments'},
-            text='Appointments',
-            color_discrete_sequence=px.colors.qualitative.Safe
-        )
+            # Create bar chart for grand total summary
+            fig_grand_total = px.bar(
+                grand_total_df,
+                x='Category',
+                y='Appointments',
+                labels={'Appointments': 'Number of Appointments'},
+                text='Appointments',
+                color_discrete_sequence=px.colors.qualitative.Safe
+            )
       
-        # Add dotted line for the number of referrals (as expected demand)
-        fig_grand_total.add_shape(
-            type='line',
-            x0=-0.5,
-            y0=total_referrals_scaled,
-            x1=2.5,
-            y1=total_referrals_scaled,
-            line=dict(color='red', width=2, dash='dot'),
-            name='Total Referrals'
-        )
+            # Add dotted line for the number of referrals (as expected demand)
+            fig_grand_total.add_shape(
+                type='line',
+                x0=-0.5,
+                y0=total_referrals_scaled,
+                x1=2.5,
+                y1=total_referrals_scaled,
+                line=dict(color='red', width=2, dash='dot'),
+                name='Total Referrals'
+            )
       
-        fig_grand_total.add_annotation(
-            x=1,
-            y=total_referrals_scaled,
-            text=f"Total Referrals: {int(total_referrals_scaled)}",
-            showarrow=False,
-            yshift=10,
-            font=dict(size=12, color='red')
-        )
+            fig_grand_total.add_annotation(
+                x=1,
+                y=total_referrals_scaled,
+                text=f"Total Referrals: {int(total_referrals_scaled)}",
+                showarrow=False,
+                yshift=10,
+                font=dict(size=12, color='red')
+            )
           
-        fig_grand_total.update_layout(
-              xaxis_title='',
-              yaxis_title='Number of Appointments',
-              yaxis_tickformat=',',
-              title_x=0.5,
-              title=''
+            fig_grand_total.update_layout(
+                  xaxis_title='',
+                  yaxis_title='Number of Appointments',
+                  yaxis_tickformat=',',
+                  title_x=0.5,
+                  title=''
+            )
+            return fig_grand_total
+
+        st.plotly_chart(
+            charts.cached_figure(figure_cache, PAGE, 'grand_total', grand_totals + (float(total_referrals_scaled),), grand_total_figure),
+            use_container_width=True
         )
       
-        st.plotly_chart(fig_grand_total, use_container_width=True)
-      
         if adjusted_attended_appointments > total_referrals_scaled:
             st.success("The new rates would mean enough attended appointments to meet the referral demand, although unlikely to reduce the backlog significantly.")
 
+        # Every combination of rates at once, for this specialty or all of them
+        st.subheader("Utilisation and DNA Rate Grid")
+        show_grid = st.toggle(
+            "Show surplus or deficit over a grid of rates",
+            help="Attended RTT first appointments less forecast referrals at every utilisation and DNA rate."
+        )
+        if show_grid:
+            all_specialties = st.checkbox("All specialties", help="Sum the surplus or deficit over every specialty.")
+            if all_specialties:
+                specialties = referral_df['specialty'].unique()
+                values = specialty_values(st.session_state, ['available_rtt_first', 'forecasted_total'], specialties)
+                values = values.astype(float).fillna(0)
+                grid_attended = values['available_rtt_first'].to_numpy()
+                grid_demand = values['forecasted_total'].to_numpy()
+            else:
+                grid_attended = np.array([total_first_appointments_scaled], dtype=float)
+                grid_demand = np.array([total_referrals_scaled], dtype=float)
+
+            # (specialty x utilisation x DNA) surplus, summed over specialties
+            surplus = attended_grid(required_capacity(grid_attended), GRID_UTILISATION_RATES, GRID_DNA_RATES)
+            surplus -= grid_demand[:, None, None]
+            in_deficit = (surplus < 0).sum(axis=0)
+            total_surplus = surplus.sum(axis=0)
+
+            def rate_grid_figure():
+                scale = max(np.abs(total_surplus).max(), 1)
+                fig_grid = charts.figure(
+                    [
+                        charts.heatmap(
+                            GRID_DNA_RATES * 100,
+                            GRID_UTILISATION_RATES * 100,
+                            total_surplus,
+                            colorscale='RdBu',
+                            zmin=-scale,
+                            zmax=scale,
+                            colorbar=dict(title='Surplus'),
+                            customdata=in_deficit,
+                            hovertemplate=(
+                                'Utilisation %{y:.0f}%<br>DNA %{x:.0f}%<br>Surplus %{z:,.0f}'
+                                '<br>Specialties in deficit: %{customdata}<extra></extra>'
+                            )
+                        ),
+                        go.Scatter(
+                            x=[adjusted_dna_rate * 100],
+                            y=[adjusted_utilisation_rate * 100],
+                            mode='markers',
+                            marker=dict(symbol='x', size=12, color='black'),
+                            name='Adjusted Rates',
+                            hoverinfo='skip'
+                        ),
+                    ],
+                    title='Attended RTT First Appointments less Forecast Referrals',
+                    x_title='DNA Rate (%)',
+                    y_title='Utilisation Rate (%)',
+                    dates=False
+                )
+                fig_grid.update_layout(showlegend=False)
+                return fig_grid
+
+            grid_inputs = (
+                all_specialties, adjusted_utilisation_rate, adjusted_dna_rate,
+                tuple(grid_attended.tolist()), tuple(grid_demand.tolist())
+            )
+            st.plotly_chart(
+                charts.cached_figure(figure_cache, PAGE, 'rate_grid', grid_inputs, rate_grid_figure),
+                use_container_width=True
+            )
+
+            met = total_surplus >= 0
+            if not met.any():
+                st.error("Demand is not met at any of these rates. The number of appointments needs to increase.")
+            else:
+                # Lowest utilisation that meets demand at each DNA rate
+                lowest_utilisation = np.where(met.any(axis=0), GRID_UTILISATION_RATES[met.argmax(axis=0)] * 100, np.nan)
+                st.write("Lowest utilisation rate that meets demand at each DNA rate:")
+                st.dataframe(
+                    pd.DataFrame(
+                        [lowest_utilisation],
+                        index=['Utilisation Rate (%)'],
+                        columns=[f"{rate:.0%}" for rate in GRID_DNA_RATES]
+                    ).style.format('{:.0f}', na_rep='-'),
+                    use_container_width=True
+                )
+
         # Next Step
         st.markdown("""
         ## Next Steps
@@ -1,7 +1,20 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
+from demand_capacity.capacity import APPOINTMENT_TYPES, capacity_gap, optimal_allocation, whole_appointments
+from demand_capacity.derived import specialty_values, state_evaluator
+
+MANUAL_ALLOCATION = 'Manual'
+OPTIMISED_ALLOCATION = 'Optimised'
+
+# Derived quantities the all-specialty allocation is solved from
+ALLOCATION_INPUTS = [
+    'forecasted_total', 'first_followup_removals_ratio', 'first_non_rtt_removals_ratio',
+    'available_rtt_first', 'available_rtt_followup', 'available_non_rtt',
+]
+
 st.title("Demand vs Capacity Comparison")
 
 # Check if data is available in session state
@@ -12,18 +25,17 @@ if ('referral_df' in st.session_state and st.session_state.referral_df is not No
     appointment_df = st.session_state.appointment_df
     selected_specialty = st.session_state.selected_specialty
 
+    # Demand and capacity are derived from the current inputs, whichever pages have been visited
+    derive = state_evaluator(st.session_state)
+
     # Baseline Referral Analysis
     st.subheader(f"Referral Demand Forecast for {selected_specialty}")
-
-    if 'forecasted_total' in st.session_state:
-        forecasted_total = st.session_state.forecasted_total
-    else:
-        st.error("Please complete the referral demand analysis to forecast referrals.")
+    forecasted_total = derive('forecasted_total')
 
     # Ratios for waiting list removals
     st.subheader("Appointment Type Ratios Based on Waiting List Removals")
-    rtt_first_to_followup_ratio = st.session_state.first_followup_removals_ratio
-    rtt_first_to_non_rtt_ratio = st.session_state.first_non_rtt_removals_ratio
+    rtt_first_to_followup_ratio = derive('first_followup_removals_ratio')
+    rtt_first_to_non_rtt_ratio = derive('first_non_rtt_removals_ratio')
 
     st.write(f"**RTT First to Follow-up Ratio (Waiting List Removals):** {rtt_first_to_followup_ratio:.2f}")
     st.write(f"**RTT First to Non-RTT Ratio (Waiting List Removals):** {rtt_first_to_non_rtt_ratio:.2f}")
@@ -33,29 +45,62 @@ if ('referral_df' in st.session_state and st.session_state.referral_df is not No
     rtt_followup_demand = round(rtt_first_demand * rtt_first_to_followup_ratio)
     non_rtt_demand = round(rtt_first_demand * rtt_first_to_non_rtt_ratio)
 
-    # Sliders to Adjust Appointment Percentages
+    # Split of the available capacity between appointment types
     st.subheader("Adjust Appointment Capacity Distribution")
-    st.write("Use the sliders below to adjust the percentage allocation of appointments for RTT First, RTT Follow-up, and Non-RTT.")
-
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        pct_rtt_first = st.slider("RTT First (%)", min_value=0, max_value=100, value=50, step=1)
-    with col2:
-        pct_rtt_followup = st.slider("RTT Follow-up (%)", min_value=0, max_value=100, value=30, step=1)
-    with col3:
-        pct_non_rtt = st.slider("Non-RTT (%)", min_value=0, max_value=100, value=20, step=1)
-
-    total_percentage = pct_rtt_first + pct_rtt_followup + pct_non_rtt
-    if total_percentage != 100:
-        st.error("The percentages must add up to 100%. Please adjust the sliders.")
+    available = [derive('available_rtt_first'), derive('available_rtt_followup'), derive('available_non_rtt')]
+    total_available_capacity = sum(available)
+
+    allocation_mode = st.radio(
+        "Allocation",
+        [MANUAL_ALLOCATION, OPTIMISED_ALLOCATION],
+        horizontal=True,
+        help="Optimised splits the available capacity to leave the smallest (weighted) capacity gap."
+    )
+
+    if allocation_mode == OPTIMISED_ALLOCATION:
+        st.write("Set how much an unmet appointment of each type counts. Higher weighted types are filled first; "
+                 "with equal weights the total capacity gap is minimised.")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            weight_rtt_first = st.number_input("RTT First gap weight", min_value=0.0, value=1.0, step=0.5)
+        with col2:
+            weight_rtt_followup = st.number_input("RTT Follow-up gap weight", min_value=0.0, value=1.0, step=0.5)
+        with col3:
+            weight_non_rtt = st.number_input("Non-RTT gap weight", min_value=0.0, value=1.0, step=0.5)
+        weights = [weight_rtt_first, weight_rtt_followup, weight_non_rtt]
+
+        allocated_rtt_first, allocated_rtt_followup, allocated_non_rtt = map(int, whole_appointments(optimal_allocation(
+            [rtt_first_demand, rtt_followup_demand, non_rtt_demand], total_available_capacity, weights
+        )))
+        if total_available_capacity > 0:
+            st.write(
+                f"**Optimised split:** RTT First {allocated_rtt_first / total_available_capacity:.0%}, "
+                f"RTT Follow-up {allocated_rtt_followup / total_available_capacity:.0%}, "
+                f"Non-RTT {allocated_non_rtt / total_available_capacity:.0%}"
+            )
+        allocation_ready = True
     else:
-        # Recalculate available appointments based on percentages
-        total_available_capacity = st.session_state.available_rtt_first + st.session_state.available_rtt_followup + st.session_state.available_non_rtt
-
-        allocated_rtt_first = int(round(total_available_capacity * (pct_rtt_first / 100)))
-        allocated_rtt_followup = int(round(total_available_capacity * (pct_rtt_followup / 100)))
-        allocated_non_rtt = int(round(total_available_capacity * (pct_non_rtt / 100)))
+        st.write("Use the sliders below to adjust the percentage allocation of appointments for RTT First, RTT Follow-up, and Non-RTT.")
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            pct_rtt_first = st.slider("RTT First (%)", min_value=0, max_value=100, value=50, step=1)
+        with col2:
+            pct_rtt_followup = st.slider("RTT Follow-up (%)", min_value=0, max_value=100, value=30, step=1)
+        with col3:
+            pct_non_rtt = st.slider("Non-RTT (%)", min_value=0, max_value=100, value=20, step=1)
+
+        total_percentage = pct_rtt_first + pct_rtt_followup + pct_non_rtt
+        allocation_ready = total_percentage == 100
+        if not allocation_ready:
+            st.error("The percentages must add up to 100%. Please adjust the sliders.")
+        else:
+            # Recalculate available appointments based on percentages
+            allocated_rtt_first = int(round(total_available_capacity * (pct_rtt_first / 100)))
+            allocated_rtt_followup = int(round(total_available_capacity * (pct_rtt_followup / 100)))
+            allocated_non_rtt = int(round(total_available_capacity * (pct_non_rtt / 100)))
 
+    if allocation_ready:
         comparison_data = {
             'Appointment Type': ['RTT First', 'RTT Follow-up', 'Non-RTT'],
             'Required Appointments': [rtt_first_demand, rtt_followup_demand, non_rtt_demand],
@@ -77,6 +122,8 @@ if ('referral_df' in st.session_state and st.session_state.referral_df is not No
 
         if not gaps_exist:
             st.success("The adjusted capacity meets or exceeds the required appointments!")
+        elif allocation_mode == OPTIMISED_ALLOCATION:
+            st.error("Capacity gaps remain with the optimised split. Consider increasing capacity.")
         else:
             st.error("Capacity gaps still exist. Adjust the percentages or consider increasing capacity.")
 
@@ -92,5 +139,34 @@ if ('referral_df' in st.session_state and st.session_state.referral_df is not No
         )
         st.plotly_chart(fig_comparison, use_container_width=True)
 
+    if allocation_mode == OPTIMISED_ALLOCATION:
+        # Every specialty solved at once with the same weights
+        st.subheader("Optimised Allocation for All Specialties")
+        specialties = referral_df['specialty'].unique()
+        values = specialty_values(st.session_state, ALLOCATION_INPUTS, specialties).astype(float).fillna(0)
+
+        first = values['forecasted_total'].to_numpy()
+        demand = np.column_stack([
+            first,
+            np.round(first * values['first_followup_removals_ratio'].to_numpy()),
+            np.round(first * values['first_non_rtt_removals_ratio'].to_numpy()),
+        ])
+        capacity = values[['available_rtt_first', 'available_rtt_followup', 'available_non_rtt']].sum(axis=1).to_numpy()
+        allocated = whole_appointments(optimal_allocation(demand, capacity, weights))
+        gaps = capacity_gap(demand, allocated)
+
+        share = allocated / np.where(capacity > 0, capacity, 1)[:, None] * 100
+        all_specialties_df = pd.DataFrame(
+            np.column_stack([capacity, share, gaps, gaps.sum(axis=1)]),
+            index=values.index,
+            columns=(
+                ['Available Capacity']
+                + [f'{name} (%)' for name in APPOINTMENT_TYPES]
+                + [f'{name} Gap' for name in APPOINTMENT_TYPES]
+                + ['Total Gap']
+            ),
+        )
+        st.dataframe(all_specialties_df.style.format('{:,.0f}'), use_container_width=True)
+
 else:
     st.write("Please upload the required data files in the **Home** page.")
@@ -1,18 +1,24 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
+from demand_capacity import charts
+from demand_capacity.derived import state_evaluator
+from demand_capacity.dynamics import capacity_scenarios, monthly_dynamics
+
+CURRENT_CAPACITY = 'Current capacity'
+
 st.title("Waiting List Dynamics")
 
 st.write("""
 Analyse the dynamics of the waiting list over the year.
 """)
 
-# Check if necessary variables are available in session state
-if 'forecasted_total' in st.session_state and \
-   'available_rtt_first' in st.session_state and \
-   'available_rtt_followup' in st.session_state and \
-   'available_non_rtt' in st.session_state:
+# Demand and capacity are derived from the loaded data, whichever pages have been visited
+if ('referral_df' in st.session_state and st.session_state.referral_df is not None) and \
+   ('appointment_df' in st.session_state and st.session_state.appointment_df is not None):
+    derive = state_evaluator(st.session_state)
 
     # User Inputs for Starting Waiting List and Additions/Removals
     st.header("Input Waiting List Variables")
@@ -29,7 +35,7 @@ if 'forecasted_total' in st.session_state and \
     )
 
     # Calculate waiting list additions from forecasted referrals
-    waiting_list_additions = st.session_state['forecasted_total']
+    waiting_list_additions = derive('forecasted_total')
     st.write(f"**Total Waiting List Additions (Based on Forecasted Referrals):** {waiting_list_additions:.0f}")
 
     # Input for removals not related to treatment
@@ -44,17 +50,44 @@ if 'forecasted_total' in st.session_state and \
     )
 
     # Calculate removals from treatment based on available appointment capacity
-    available_rtt_first = st.session_state['available_rtt_first']
-    available_rtt_followup = st.session_state['available_rtt_followup']
-    available_non_rtt = st.session_state['available_non_rtt']
+    available_rtt_first = derive('available_rtt_first')
+    available_rtt_followup = derive('available_rtt_followup')
+    available_non_rtt = derive('available_non_rtt')
+
+    # Monthly demand follows the forecast (including any seasonality); capacity is spread evenly over the year
+    demand_forecast = derive('demand_forecast')
+    months = demand_forecast['month'].to_numpy()
+    monthly_additions = demand_forecast['predicted_demand'].to_numpy(dtype=float)
+    monthly_capacity = available_rtt_first / len(months)
+
+    # A change to capacity part way through the year, compared against current capacity
+    col1, col2 = st.columns(2)
+    with col1:
+        capacity_change = st.number_input(
+            'Change in RTT First Capacity (%)', min_value=-100.0, value=0.0, step=5.0, key='capacity_change'
+        )
+    with col2:
+        change_from = st.selectbox(
+            'Capacity Change From',
+            range(len(months)),
+            format_func=lambda index: pd.Timestamp(months[index]).strftime('%b %Y'),
+            key='capacity_change_from'
+        )
+
+    # Each referral is treated with an RTT first appointment, so treatment removals follow RTT first capacity
+    scenarios = capacity_scenarios(np.full(len(months), monthly_capacity), [0, capacity_change / 100], change_from)
+    trajectories, treatments, others = monthly_dynamics(
+        waiting_list_start, monthly_additions, scenarios, other_removals / len(months)
+    )
 
-    # Assume each referral requires one RTT first appointment, and then potentially follow-up appointments
-    treatment_removals = min(available_rtt_first, waiting_list_additions)
+    # The planned scenario (with the change) feeds the totals and the waterfall
+    treatment_removals = treatments[-1].sum()
+    other_removals_applied = others[-1].sum()
 
     st.write(f"**Removals from Waiting List Due to Treatment (Based on Available Capacity):** {treatment_removals:.0f}")
 
-    # Calculate the end of year waiting list size
-    waiting_list_end = waiting_list_start + waiting_list_additions - treatment_removals - other_removals
+    # End of year waiting list size
+    waiting_list_end = trajectories[-1, -1]
 
     st.write(f"**Waiting List at End of Year:** {waiting_list_end:.0f}")
 
@@ -67,7 +100,7 @@ if 'forecasted_total' in st.session_state and \
     measure = ["absolute", "relative", "relative", "relative", "total"]
 
     x = ["Start of Year Waiting List", "Additions", "Removals (Treatment)", "Removals (Other)", "End of Year Waiting List"]
-    y = [waiting_list_start, waiting_list_additions, -treatment_removals, -other_removals, waiting_list_end]
+    y = [waiting_list_start, waiting_list_additions, -treatment_removals, -other_removals_applied, waiting_list_end]
 
     text = [f"{val:.0f}" for val in y]
 
@@ -92,6 +125,20 @@ if 'forecasted_total' in st.session_state and \
 
     st.plotly_chart(waterfall_fig, use_container_width=True)
 
+    # Monthly trajectory of the waiting list for each capacity scenario
+    st.subheader('Waiting List Trajectory')
+    scenario_names = [CURRENT_CAPACITY]
+    if capacity_change != 0:
+        scenario_names.append(f"Capacity {capacity_change:+.0f}% from {pd.Timestamp(months[change_from]).strftime('%b %Y')}")
+    trajectory_fig = charts.figure(
+        [charts.line(months, trajectory, name, mode='lines+markers') for name, trajectory in zip(scenario_names, trajectories)],
+        title='Month-End Waiting List',
+        x_title='Month',
+        y_title='Waiting List',
+        legend_title='Scenario'
+    )
+    st.plotly_chart(trajectory_fig, use_container_width=True)
+
     # Analysis of Appointments Needed per RTT Pathway
     st.subheader("Analysis of Appointments Needed per RTT Pathway")
 
@@ -120,4 +167,4 @@ if 'forecasted_total' in st.session_state and \
     """)
 
 else:
-    st.error("Please complete the **Referral Demand** and **Capacity Analysis** sections to provide necessary data.")
+    st.write("Please upload the required data files in the **Home** page.")
@@ -2,6 +2,8 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+from demand_capacity.data import specialty_view
+
 st.title("Historic Non-Admitted Waiting List")
 
 st.markdown("""
@@ -40,11 +42,11 @@ if ('referral_df' in st.session_state and st.session_state.referral_df is not No
         st.session_state.selected_specialty = selected_specialty
 
         # Filter data based on selected specialty
-        referral_specialty_df = referral_df[referral_df['specialty'] == selected_specialty]
-        appointment_specialty_df = appointment_df[appointment_df['specialty'] == selected_specialty]
+        referral_specialty_df = specialty_view(st.session_state.referral_index, selected_specialty)
+        appointment_specialty_df = specialty_view(st.session_state.appointment_index, selected_specialty)
 
         # Aggregate referrals by month and specialty
-        referral_specialty_df = referral_specialty_df.groupby(['month', 'specialty'], as_index=False).sum()
+        referral_specialty_df = referral_specialty_df.groupby(['month', 'specialty'], observed=True, as_index=False).sum()
 
         # Merge the data
         merged_df = pd.merge(appointment_specialty_df, referral_specialty_df, on=['month', 'specialty'], how='inner')